@@ -96,13 +96,9 @@ def recall_dlu_package(package_id):
     else:
         file_list = dlu_file_handler.match_files(package_id,False)
 
-    dlu_files = []
-    for file in directory_info.file_details:
-        file.path = dlu_file_handler.split_path(file.path)['file_path']
-        dlu_files.append(file)
-
-    dlu_file_handler.copy_files(package_id, dlu_files)
-    dlu_file_handler.chown_dir(package_id, file_list, 99413947)
+    # Only files that are missing or differ from what is already in Globus get copied
+    dlu_file_handler.sync_files(package_id, file_list, calculate_checksums=False)
+    dlu_file_handler.chown_dir(package_id, 99413947)
     dlu_management.update_dlu_package(package_id, { "globus_dlu_status": "recalled" })
     dlu_management.update_dlu_package(package_id, { "ready_to_move_from_globus": None })
 
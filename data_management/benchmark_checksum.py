@@ -0,0 +1,69 @@
+import argparse
+import logging
+import os
+import resource
+import time
+from hashlib import md5
+from mmap import mmap, ACCESS_READ
+import hashlib
+from services.dlu_filesystem import stream_checksum, stream_checksums, stream_file, advise
+
+logger = logging.getLogger("benchmark-checksum")
+logger.setLevel(logging.INFO)
+logging.basicConfig(level=logging.INFO)
+
+
+# The whole-file mmap hash calculate_checksum used before switching to streaming reads
+def mmap_checksum(file_path: str):
+    with open(file_path, "rb") as f, mmap(f.fileno(), 0, access=ACCESS_READ) as m:
+        return md5(m).hexdigest()
+
+
+def secondary_only_checksum(file_path: str, algorithm: str, read_size: int = None):
+    digest = hashlib.new(algorithm)
+    stream_file(file_path, [digest], read_size)
+    return digest.hexdigest()
+
+
+def drop_from_page_cache(file_path: str):
+    with open(file_path, "rb") as f:
+        advise(f.fileno(), 0, 0, "POSIX_FADV_DONTNEED")
+
+
+def run(name: str, checksum_function, file_paths: list[str], cold: bool):
+    total_bytes = 0
+    elapsed = 0.0
+    for file_path in file_paths:
+        if cold:
+            drop_from_page_cache(file_path)
+        start = time.perf_counter()
+        checksum = checksum_function(file_path)
+        elapsed += time.perf_counter() - start
+        total_bytes += os.path.getsize(file_path)
+        logger.info(name + " " + file_path + " " + checksum)
+    mb_per_second = (total_bytes / (1024 * 1024)) / elapsed if elapsed > 0 else 0
+    max_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    logger.info(f"{name}: {total_bytes} bytes in {elapsed:.2f}s ({mb_per_second:.1f} MB/s), max RSS {max_rss_mb:.0f} MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("files", nargs="+", help="Files to hash")
+    parser.add_argument("-r", "--read_size", type=int, default=None, help="Read size in bytes for the streaming hasher")
+    parser.add_argument("-c", "--cold", action="store_true", default=False,
+                        help="Ask the kernel to drop each file from the page cache before hashing it")
+    parser.add_argument("-m", "--mode", choices=["stream", "mmap", "both", "dual", "secondary"], default="both",
+                        help="Which checksum path to measure. Run each mode in its own process to compare max RSS. "
+                             "dual is md5 plus the secondary digest in one read, secondary is the secondary digest alone.")
+    parser.add_argument("-a", "--algorithm", default="blake2b", help="Secondary digest for the dual and secondary modes")
+    args = parser.parse_args()
+    if args.mode in ["stream", "both"]:
+        run("stream", lambda file_path: stream_checksum(file_path, args.read_size), args.files, args.cold)
+    if args.mode in ["mmap", "both"]:
+        run("mmap", mmap_checksum, args.files, args.cold)
+    if args.mode == "dual":
+        run("dual", lambda file_path: " ".join(stream_checksums(file_path, args.algorithm, args.read_size)),
+            args.files, args.cold)
+    if args.mode == "secondary":
+        run(args.algorithm, lambda file_path: secondary_only_checksum(file_path, args.algorithm, args.read_size),
+            args.files, args.cold)
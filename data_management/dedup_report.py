@@ -0,0 +1,52 @@
+import argparse
+import logging
+import os
+from dotenv import load_dotenv
+from services.dlu_dedup import DEFAULT_MIN_FILE_SIZE
+from services.dlu_management import DluManagement
+
+logger = logging.getLogger("dedup-report")
+logger.setLevel(logging.INFO)
+logging.basicConfig(level=logging.INFO)
+load_dotenv()
+
+
+# Groups the DLU's files by (size, md5) and reports, for content stored more than once, how many bytes
+# hardlinks are already saving and how many are still stored as separate copies. Reflinked copies share
+# their extents without sharing an inode, so they are counted as separate copies here.
+def build_report(duplicate_files: list, data_lake_directory: str) -> dict:
+    groups = {}
+    for file in duplicate_files:
+        path = os.path.join(data_lake_directory, "package_" + file["dlu_package_id"], file["dlu_fileName"])
+        groups.setdefault((file["dlu_filesize"], file["dlu_md5checksum"]), []).append(path)
+    report = {"duplicate_groups": len(groups), "files": 0, "bytes_saved": 0, "bytes_still_duplicated": 0}
+    for (size, _), paths in groups.items():
+        inodes = set()
+        present = 0
+        for path in paths:
+            try:
+                stat_result = os.stat(path)
+            except FileNotFoundError:
+                continue
+            inodes.add((stat_result.st_dev, stat_result.st_ino))
+            present += 1
+        report["files"] += present
+        report["bytes_saved"] += size * (present - len(inodes))
+        report["bytes_still_duplicated"] += size * max(0, len(inodes) - 1)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-m",
+                        "--min_file_size",
+                        required=False,
+                        type=int,
+                        default=int(os.environ.get("dlu_dedup_min_file_size", DEFAULT_MIN_FILE_SIZE)),
+                        help="Ignore files smaller than this many bytes")
+    args = parser.parse_args()
+    data_lake_directory = os.environ.get("checker_dlu_data_directory", "/data")
+    report = build_report(DluManagement().find_duplicate_files(args.min_file_size), data_lake_directory)
+    logger.info(f"{report['duplicate_groups']} files are stored more than once across {report['files']} copies. "
+                f"Hardlinks save {report['bytes_saved']} bytes, {report['bytes_still_duplicated']} bytes are "
+                f"still duplicated.")
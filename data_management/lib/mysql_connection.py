@@ -1,8 +1,11 @@
 import os
 import mysql.connector
+from contextlib import contextmanager
 from dotenv import load_dotenv
 import logging
+import queue
 import requests
+import threading
 
 load_dotenv()
 slack_passcode = os.environ.get('slack_passcode')
@@ -10,6 +13,75 @@ logger = logging.getLogger("lib-MYSQLConnection")
 logging.basicConfig(level=logging.ERROR)
 slack_url = "https://hooks.slack.com/services/" + slack_passcode
 
+DEFAULT_POOL_SIZE = 5
+MAX_POOL_SIZE = 32
+DEFAULT_POOL_TIMEOUT_SECONDS = 60
+DEFAULT_BATCH_SIZE = 1000
+
+
+# A process-wide pool of connections with the same settings. It holds one slot per connection, opened the first
+# time it is needed, so checkouts wait while every connection is in use. Each connection is pinged as it is
+# checked out so one the server dropped is reconnected instead of failing the query.
+class ConnectionPool:
+    def __init__(self, name: str, size: int, timeout_seconds: float, **config):
+        self.name = name
+        self.size = max(1, min(size, MAX_POOL_SIZE))
+        self.timeout_seconds = timeout_seconds
+        self.config = config
+        # Last in, first out, so recently used connections are reused before unopened slots
+        self.slots = queue.LifoQueue()
+        for _ in range(self.size):
+            self.slots.put(None)
+
+    def checkout(self):
+        try:
+            connection = self.slots.get(timeout=self.timeout_seconds)
+        except queue.Empty:
+            raise mysql.connector.errors.PoolError("Timed out waiting for a connection from pool " + self.name)
+        try:
+            if connection is None:
+                connection = mysql.connector.connect(**self.config)
+                connection.get_warnings = True
+            else:
+                connection.ping(reconnect=True, attempts=2, delay=1)
+            return connection
+        except Exception:
+            self.discard(connection)
+            raise
+
+    def checkin(self, connection):
+        self.slots.put(connection)
+
+    # Frees the slot of a connection that can't be used any more
+    def discard(self, connection):
+        try:
+            if connection is not None:
+                connection.close()
+        except Exception:
+            pass
+        finally:
+            self.slots.put(None)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+# Pools are shared by every MYSQLConnection in the process with the same settings. Sized by mysql_pool_size
+# (or tableau_pool_size for the Tableau database), up to 32 connections.
+def get_connection_pool(name: str, size: int, **config) -> ConnectionPool:
+    key = (name, os.getpid(), config.get("host"), config.get("port"), config.get("user"), config.get("database"))
+    with _pools_lock:
+        if key not in _pools:
+            timeout_seconds = float(os.environ.get("mysql_pool_timeout_seconds", DEFAULT_POOL_TIMEOUT_SECONDS))
+            pool = ConnectionPool(name, size, timeout_seconds, **config)
+            # Opened up front so a database that can't be reached is found at startup, as before
+            pool.checkin(pool.checkout())
+            _pools[key] = pool
+            logger.info("Opened MySQL pool " + name + " with up to " + str(pool.size) + " connections")
+        return _pools[key]
+
+
 class MYSQLConnection:
     def __init__(self):
         logger.debug(
@@ -65,17 +137,34 @@ class MYSQLConnection:
         except:
             logger.warning("Can't load environment variables from local .env file")
 
-    def get_db_cursor(self):
+    # Checks a connection out of the pool for a single statement and hands it back afterwards, committed or
+    # rolled back so nothing is left open on a connection another thread will get. With transaction, the
+    # statements run on the cursor are committed together instead of one at a time.
+    @contextmanager
+    def get_db_cursor(self, transaction: bool = False):
+        connection = self.pool.checkout()
+        cursor = None
         try:
-            self.cursor = self.database.cursor(buffered=False, dictionary=True)
-            return self.cursor
-        except:
-            logger.error("Can't get mysql cursor")
-            os.sys.exit()
+            if transaction:
+                connection.start_transaction()
+            cursor = connection.cursor(buffered=False, dictionary=True)
+            yield cursor
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            try:
+                if cursor is not None:
+                    cursor.close()
+            finally:
+                self.pool.checkin(connection)
 
     def get_db_connection(self):
         try:
-            self.database = mysql.connector.connect(
+            self.pool = get_connection_pool(
+                "data_management",
+                int(os.environ.get("mysql_pool_size", DEFAULT_POOL_SIZE)),
                 host=self.host,
                 user=self.user,
                 port=self.port,
@@ -83,15 +172,16 @@ class MYSQLConnection:
                 database=self.database_name,
                 autocommit=True
             )
-            self.database.get_warnings = True
-            return self.database
+            return self.pool
         except Exception as error:
-            logger.exception("Can't connect to MySQL: ", error)
+            logger.exception("Can't connect to MySQL: " + str(error))
             os.sys.exit()
 
     def get_tableau_db_connection(self):
         try:
-            self.database = mysql.connector.connect(
+            self.pool = get_connection_pool(
+                "tableau",
+                int(os.environ.get("tableau_pool_size", DEFAULT_POOL_SIZE)),
                 host=self.tableau_host,
                 user=self.tableau_user,
                 port=self.tableau_port,
@@ -99,19 +189,18 @@ class MYSQLConnection:
                 database=self.tableau_database_name,
                 ssl_ca=self.tableau_ca_file
             )
-            self.database.get_warnings = True
-            return self.database
+            return self.pool
         except Exception as error:
-            logger.exception("Can't connect to MySQL: ", error)
+            logger.exception("Can't connect to MySQL: " + str(error))
             os.sys.exit()
 
     def insert_data(self, sql, data):
         try:
-            self.get_db_cursor()
-            self.cursor.execute(sql, data)
-            warning = self.cursor.fetchwarnings()
-            if warning is not None:
-                print(warning)
+            with self.get_db_cursor() as cursor:
+                cursor.execute(sql, data)
+                warning = cursor.fetchwarnings()
+                if warning is not None:
+                    print(warning)
         except:
             message = f"Error: Cannot insert with query: {sql}; and the data: {data}"
             logger.error(message)
@@ -120,32 +209,96 @@ class MYSQLConnection:
                 headers={'Content-type': 'application/json', },
                 data='{"text":"' + message + '"}'
             )
-        finally:
-            self.database.commit()
-            self.cursor.close()
-            
+
     def insert_data_no_alert(self, sql, data):
         try:
-            self.get_db_cursor()
-            self.cursor.execute(sql, data)
-            warning = self.cursor.fetchwarnings()
-            if warning is not None:
-                print(warning)
+            with self.get_db_cursor() as cursor:
+                cursor.execute(sql, data)
+                warning = cursor.fetchwarnings()
+                if warning is not None:
+                    print(warning)
         except:
             message = f"Error: Cannot insert with query: {sql}; and the data: {data}"
             logger.error(message)
-        finally:
-            self.database.commit()
-            self.cursor.close()
+
+    # Runs sql for every row in batches of batch_size (mysql_batch_size by default). mysql.connector rewrites an
+    # INSERT ... VALUES into a single multi-row statement, so each batch is one round trip and one commit. A batch
+    # that fails is rolled back and retried a row at a time, so only the rows that fail themselves are lost and
+    # reported. Returns the number of rows that went in.
+    def insert_many(self, sql, rows, batch_size: int = None, alert: bool = True) -> int:
+        if batch_size is None:
+            batch_size = int(os.environ.get("mysql_batch_size", DEFAULT_BATCH_SIZE))
+        batch_size = max(1, batch_size)
+        rows = list(rows)
+        inserted = 0
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            try:
+                with self.get_db_cursor() as cursor:
+                    cursor.executemany(sql, batch)
+                inserted += len(batch)
+            except Exception as error:
+                logger.warning(f"Batch of rows {start + 1} to {start + len(batch)} failed, retrying one row at a "
+                               f"time: {error}")
+                inserted += self.insert_rows(sql, batch, alert)
+        return inserted
+
+    # Runs delete_sql and then inserts the rows in batches in one transaction, so either all the rows replace
+    # the old ones or, when anything fails, the old rows are left as they were and the error is raised
+    def replace_rows(self, delete_sql, delete_data, sql, rows, batch_size: int = None) -> int:
+        if batch_size is None:
+            batch_size = int(os.environ.get("mysql_batch_size", DEFAULT_BATCH_SIZE))
+        batch_size = max(1, batch_size)
+        rows = list(rows)
+        with self.get_db_cursor(transaction=True) as cursor:
+            cursor.execute(delete_sql, delete_data)
+            for start in range(0, len(rows), batch_size):
+                cursor.executemany(sql, rows[start:start + batch_size])
+        return len(rows)
+
+    def insert_rows(self, sql, rows, alert: bool = True) -> int:
+        inserted = 0
+        for row in rows:
+            try:
+                with self.get_db_cursor() as cursor:
+                    cursor.execute(sql, row)
+                inserted += 1
+            except Exception as error:
+                message = f"Error: Cannot insert with query: {sql}; and the data: {row}; {error}"
+                logger.error(message)
+                if alert:
+                    requests.post(
+                        slack_url,
+                        headers={'Content-type': 'application/json', },
+                        data='{"text":"' + message + '"}'
+                    )
+        return inserted
+
+    # Like insert_data, but returns the number of rows the statement changed, e.g. to tell whether a
+    # compare-and-set UPDATE won
+    def update_data(self, sql, data) -> int:
+        try:
+            with self.get_db_cursor() as cursor:
+                cursor.execute(sql, data)
+                return cursor.rowcount
+        except:
+            message = f"Error: Cannot update with query: {sql}; and the data: {data}"
+            logger.error(message)
+            requests.post(
+                slack_url,
+                headers={'Content-type': 'application/json', },
+                data='{"text":"' + message + '"}'
+            )
+            return 0
 
     def get_data(self, sql, query_data=None):
         try:
-            self.get_db_cursor()
-            data = []
-            self.cursor.execute(sql, query_data)
-            for row in self.cursor:
-                data.append(row)
-            return data
+            with self.get_db_cursor() as cursor:
+                data = []
+                cursor.execute(sql, query_data)
+                for row in cursor:
+                    data.append(row)
+                return data
         except Exception as error:
             logger.error(str(error))
             requests.post(
@@ -153,8 +306,6 @@ class MYSQLConnection:
                 headers={'Content-type': 'application/json', },
                 data='{"text":"' + "Error: " + str(error) + '"}'
             )
-        finally:
-            self.cursor.close()
 
 
 if __name__ == "__main__":
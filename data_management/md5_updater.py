@@ -4,7 +4,9 @@ from services.dlu_mongo import DLUMongo
 from lib.mongo_connection import MongoConnection
 from services.dlu_management import DluManagement
 from dotenv import load_dotenv
-from services.dlu_filesystem import calculate_checksum, DLUFile
+from services.dlu_filesystem import calculate_checksum, calculate_checksums, verify_secondary_checksum, DLUFile
+from services.checksum_executor import get_checksum_executor
+from services.chunk_manifest import verify_manifest, load_manifest
 import os
 
 logger = logging.getLogger("md5-updater")
@@ -13,7 +15,14 @@ load_dotenv()
 
 
 class Main:
-    def __init__(self):
+    def __init__(self, verify: bool = False, fast_verify: bool = False, chunk_sample: float = None):
+        # verify bypasses the checksum cache and re-reads every file
+        self.verify = verify
+        # fast_verify checks DMD files against their secondary checksum and only recomputes md5s that fail
+        self.fast_verify = fast_verify
+        # With chunk_sample, DMD files that have a chunk manifest are checked against that share of their chunks
+        # and only recomputed when a chunk fails
+        self.chunk_sample = chunk_sample
         self.mongo_connection = MongoConnection().get_mongo_connection()
         self.dlu_mongo = DLUMongo(self.mongo_connection)
         self.dlu_management = DluManagement()
@@ -52,8 +61,10 @@ class Main:
             all_packages = self.dlu_mongo.find_all_packages()
             for package in all_packages:
                 package_files = []
-                for file in package['files']:
-                    checksum = self.calculate_md5(file_name=file['fileName'], package_id=package["_id"])
+                futures = [self.submit_md5(file_name=file['fileName'], package_id=package["_id"])
+                           for file in package['files']]
+                for file, future in zip(package['files'], futures):
+                    checksum = future.result() if future is not None else None
                     logger.info(checksum)
                     if report_only:
                         if "md5Checksum" not in file:
@@ -77,14 +88,16 @@ class Main:
     def fill_dmd_missing_md5s(self, report_only: bool = False):
         logger.info("Handling DMD records missing md5checksum")
         files = self.dlu_management.find_files_missing_md5()
+        checksums = {} if report_only else self.calculate_dmd_md5s(files)
         for file in files:
             if report_only:
                 logger.error(
                     "file uuid: " + file["dlu_file_id"] + " in package: " + file["dlu_package_id"] + " missing md5")
             else:
-                new_checksum = self.calculate_md5(file_name=file["dlu_fileName"], package_id=file["dlu_package_id"])
+                new_checksum, secondary_checksum = checksums[file["dlu_file_id"]]
                 if new_checksum is not None:
-                    self.dlu_management.update_md5(file["dlu_file_id"], new_checksum, file["dlu_package_id"])
+                    self.dlu_management.update_md5(file["dlu_file_id"], new_checksum, file["dlu_package_id"],
+                                                   secondary_checksum)
 
     def fix_dmd_md5s(self, report_only: bool = False, fill_missing_only: bool = False):
         if fill_missing_only:
@@ -92,8 +105,9 @@ class Main:
         else:
             files = self.dlu_management.find_all_files()
             logger.info("Handling DMD records with incorrect md5checksums")
+            checksums = self.calculate_dmd_md5s(files)
             for file in files:
-                checksum = self.calculate_md5(file_name=file["dlu_fileName"], package_id=file["dlu_package_id"])
+                checksum, secondary_checksum = checksums[file["dlu_file_id"]]
                 logger.info(checksum)
                 if report_only is True:
                     if file["dlu_md5checksum"] is None:
@@ -105,19 +119,66 @@ class Main:
                                      " incorrect md5")
                 else:
                     if file["dlu_md5checksum"] is None or file["dlu_md5checksum"] != checksum and checksum is not None:
-                        self.dlu_management.update_md5(file["dlu_file_id"], checksum, file["dlu_package_id"])
+                        self.dlu_management.update_md5(file["dlu_file_id"], checksum, file["dlu_package_id"],
+                                                       secondary_checksum)
+                    elif secondary_checksum is not None and file.get("dlu_secondary_checksum") != secondary_checksum:
+                        self.dlu_management.update_secondary_checksum(file["dlu_file_id"], secondary_checksum)
 
-    def calculate_md5(self, file_name, package_id):
+    def get_file_path(self, file_name, package_id):
         full_path = os.path.join(self.data_lake_directory, "package_" + package_id + "/"
                                  + file_name)
         logger.info(full_path);
         if os.path.isfile(full_path):
-            new_checksum = calculate_checksum(full_path)
-            return new_checksum
+            return full_path
         else:
             logger.error("file : " + full_path + " not found")
             return None
 
+    def submit_md5(self, file_name, package_id, checksum_function=calculate_checksum):
+        full_path = self.get_file_path(file_name, package_id)
+        if full_path is None:
+            return None
+        return get_checksum_executor().submit(checksum_function, full_path, None, self.verify)
+
+    def calculate_md5(self, file_name, package_id):
+        future = self.submit_md5(file_name, package_id)
+        return future.result() if future is not None else None
+
+    # Queues every file on the checksum pool up front and returns a dict of dlu_file_id to (md5, secondary
+    # checksum). With fast_verify or chunk_sample, files whose secondary checksum or sampled chunks still match
+    # keep their stored checksums.
+    def calculate_dmd_md5s(self, files: list) -> dict:
+        checksums = {}
+        fast_futures = {}
+        if self.fast_verify:
+            for file in files:
+                full_path = self.get_file_path(file["dlu_fileName"], file["dlu_package_id"])
+                if full_path is not None and file.get("dlu_secondary_checksum") and file["dlu_md5checksum"]:
+                    fast_futures[file["dlu_file_id"]] = get_checksum_executor().submit(
+                        verify_secondary_checksum, full_path, None, file["dlu_secondary_checksum"])
+        files_by_id = {file["dlu_file_id"]: file for file in files}
+        for file_id, future in fast_futures.items():
+            if future.result():
+                checksums[file_id] = (files_by_id[file_id]["dlu_md5checksum"], files_by_id[file_id]["dlu_secondary_checksum"])
+        if self.chunk_sample is not None:
+            for file in files:
+                if file["dlu_file_id"] in checksums or not file.get("dlu_chunk_manifest") or not file["dlu_md5checksum"]:
+                    continue
+                full_path = self.get_file_path(file["dlu_fileName"], file["dlu_package_id"])
+                if full_path is not None and not verify_manifest(full_path, load_manifest(file["dlu_chunk_manifest"]),
+                                                                 self.chunk_sample):
+                    checksums[file["dlu_file_id"]] = (file["dlu_md5checksum"], file.get("dlu_secondary_checksum"))
+        if self.fast_verify or self.chunk_sample is not None:
+            logger.info("Verified " + str(len(checksums)) + " of " + str(len(files)) + " files without recomputing md5s")
+        futures = {}
+        for file in files:
+            if file["dlu_file_id"] not in checksums:
+                futures[file["dlu_file_id"]] = self.submit_md5(file["dlu_fileName"], file["dlu_package_id"],
+                                                               calculate_checksums)
+        for file_id, future in futures.items():
+            checksums[file_id] = future.result() if future is not None else (None, None)
+        return checksums
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -138,8 +199,25 @@ if __name__ == "__main__":
                         default=True,
                         action='store_true',
                         help='DEFAULT: Will run with no option selected. Fills in missing md5s AND fixes incorrect md5s')
+    parser.add_argument("-v",
+                        "--verify",
+                        required=False,
+                        action='store_true',
+                        help='Ignore the checksum cache and re-read every file')
+    parser.add_argument("-s",
+                        "--fast_verify",
+                        required=False,
+                        action='store_true',
+                        help='Check files against their secondary checksum first and only recompute md5s that fail')
+    parser.add_argument("-c",
+                        "--chunk_sample",
+                        required=False,
+                        type=float,
+                        default=None,
+                        help='Check files that have a chunk manifest against this fraction of their chunks (e.g. 0.05) '
+                             'and only recompute md5s that fail')
     args = parser.parse_args()
-    main = Main()
+    main = Main(verify=args.verify, fast_verify=args.fast_verify, chunk_sample=args.chunk_sample)
     if args.dryrun:
         logger.info("Dry run will report only")
         main.fill_mongo_missing_md5s(report_only=True)
@@ -1,6 +1,8 @@
 import sys
 from services.dlu_management import DluManagement
-from services.dlu_filesystem import DLUFile, DLUFileHandler, calculate_checksum
+from services.dlu_filesystem import DLUFile, DLUFileHandler, calculate_checksum, calculate_pending_checksums, \
+    defer_pending_checksums
+from services.dlu_dedup import get_dedup_index
 from services.dlu_state import PackageState, DLUState
 from services.dlu_mongo import PackageType
 from model.dlu_package import DLUPackage
@@ -24,7 +26,8 @@ SEGMENTATION_README = "README.md"
 
 
 class ProcessBulkUploads:
-    def __init__(self, data_directory: str, globus_only: bool = False, globus_root: str = None, preserve_path: bool = False, bypass_dup_check: bool = False):
+    def __init__(self, data_directory: str, globus_only: bool = False, globus_root: str = None, preserve_path: bool = False, bypass_dup_check: bool = False,
+                 defer_verification: bool = False):
         try:
             self.dlu_management = DluManagement()
         except Exception as e:
@@ -42,6 +45,7 @@ class ProcessBulkUploads:
         self.preserve_path = preserve_path
         self.globus_only = globus_only
         self.bypass_dup_check = bypass_dup_check
+        self.defer_verification = defer_verification
         self.dlu_file_handler = DLUFileHandler()
         self.dlu_file_handler.globus_data_directory = data_directory
         self.dlu_file_handler.dlu_data_directory = self.dlu_data_directory
@@ -49,6 +53,8 @@ class ProcessBulkUploads:
         if globus_only:
             self.dlu_file_handler.dlu_data_directory = globus_root
             self.dlu_file_handler.dlu_package_dir_prefix = ''
+        else:
+            self.dlu_file_handler.dedup_index = get_dedup_index(self.dlu_data_directory)
 
         self.dlu_state = DLUState()
 
@@ -72,14 +78,19 @@ class ProcessBulkUploads:
                 checksum = file["file_metadata"]["md5_hash"]
                 del file["file_metadata"]["md5_hash"]
             else:
-                checksum = calculate_checksum(file_full_path)
+                checksum = None
             if "file_metadata" in file:
                 metadata = file["file_metadata"]
             else:
                 metadata = {}
-            dlu_file = DLUFile(file_info["file_name"], file_info["file_path"], checksum, size, metadata)
+            dlu_file = DLUFile(file_info["file_name"], file_info["file_path"], checksum, size, metadata,
+                               source_path=file_full_path)
             dlu_files.append(dlu_file)
-        return dlu_files
+        if self.defer_verification:
+            # Registered with the manifest md5 (or a cached one) and hashed later by the watcher's file verifier
+            return defer_pending_checksums(dlu_files)
+        # Files without a manifest md5 are hashed together on the checksum pool
+        return calculate_pending_checksums(dlu_files)
 
     def process_globus_only_files(self, manifest_files_arr: list) -> list:
         logger.info("globus only file processing")
@@ -191,7 +202,7 @@ class ProcessBulkUploads:
                             self.dlu_management.insert_dlu_files(package.package_id, dlu_file_list)
                             if records_modified == 1:
                                 logger.info(f"{len(dlu_file_list)} files added to package {package_id}")
-                                files_copied = self.dlu_file_handler.copy_files(package_id, dlu_file_list, self.preserve_path, True)
+                                files_copied = self.dlu_file_handler.copy_files(package_id, dlu_file_list, self.preserve_path, True, calculate_checksums=False)
                                 if files_copied == len(dlu_file_list):
                                     self.dlu_state.set_package_state(package_id, PackageState.UPLOAD_SUCCEEDED)
                                     logger.info(f"{files_copied} files copied to DLU.")
@@ -199,7 +210,7 @@ class ProcessBulkUploads:
                                     logger.error(f"There was a problem adding files to package {package_id}")
                         else:
                             logger.info("Copying files to Globus.")
-                            files_copied = self.dlu_file_handler.copy_files(package_id, dlu_file_list, self.preserve_path, True)
+                            files_copied = self.dlu_file_handler.copy_files(package_id, dlu_file_list, self.preserve_path, True, calculate_checksums=False)
                             if files_copied == len(dlu_file_list):
                                 logger.info(f"{files_copied} files copied to Globus.")
 
@@ -251,8 +262,17 @@ if __name__ == "__main__":
         default=False,
         help='Bypass duplicate package check. Will create new packages when package exists for package type/redcap_id combo.'
     )
+    parser.add_argument(
+        '-v',
+        '--defer_verification',
+        action='store_true',
+        required=False,
+        default=False,
+        help='Register files with their manifest md5 without hashing them, and leave them pending for the file verifier.'
+    )
     args = parser.parse_args()
     if args.globus_only and args.globus_root is None:
         parser.error("--globus_only requires --globus_root to be set.")
-    process_bulk_uploads = ProcessBulkUploads(args.data_directory, args.globus_only, args.globus_root, args.preserve_path, args.bypass_dup_check)
+    process_bulk_uploads = ProcessBulkUploads(args.data_directory, args.globus_only, args.globus_root, args.preserve_path, args.bypass_dup_check,
+                                              args.defer_verification)
     process_bulk_uploads.process_bulk_uploads()
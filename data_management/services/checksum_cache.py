@@ -0,0 +1,130 @@
+import os
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger("services-ChecksumCache")
+logger.setLevel(logging.INFO)
+
+DEFAULT_MAX_ENTRIES = 5000000
+DEFAULT_MAX_AGE_DAYS = 90
+# How many stores between eviction passes
+EVICTION_INTERVAL = 1000
+
+
+# Local SQLite cache of file checksums, holding the md5 and the secondary checksum when one was computed.
+# An entry only counts as a hit while the file's device, inode, size and mtime_ns still match what they
+# were when it was hashed, so a changed file is always re-read.
+# Entries that haven't been used for max_age_days are dropped, and once the cache holds more than
+# max_entries the least recently used entries are evicted.
+class ChecksumCache:
+
+    def __init__(self, cache_path: str, max_entries: int = None, max_age_days: int = None):
+        if max_entries is None:
+            max_entries = int(os.environ.get("checksum_cache_max_entries", DEFAULT_MAX_ENTRIES))
+        if max_age_days is None:
+            max_age_days = int(os.environ.get("checksum_cache_max_age_days", DEFAULT_MAX_AGE_DAYS))
+        self.cache_path = cache_path
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.local = threading.local()
+        self.stores_since_eviction = 0
+        self.lock = threading.Lock()
+        self.get_connection()
+
+    def get_connection(self) -> sqlite3.Connection:
+        # One connection per thread, and a fresh one in forked pool workers
+        if getattr(self.local, "pid", None) != os.getpid():
+            connection = sqlite3.connect(self.cache_path, timeout=60, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS checksum_cache (path TEXT PRIMARY KEY, device INTEGER, inode INTEGER, "
+                "size INTEGER, mtime_ns INTEGER, checksum TEXT, last_used REAL, secondary_checksum TEXT)")
+            connection.execute("CREATE INDEX IF NOT EXISTS checksum_cache_last_used ON checksum_cache (last_used)")
+            self.add_secondary_checksum_column(connection)
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return self.local.connection
+
+    # Caches created before secondary checksums were kept don't have the column yet
+    def add_secondary_checksum_column(self, connection: sqlite3.Connection):
+        columns = [row[1] for row in connection.execute("PRAGMA table_info(checksum_cache)")]
+        if "secondary_checksum" not in columns:
+            try:
+                connection.execute("ALTER TABLE checksum_cache ADD COLUMN secondary_checksum TEXT")
+            except sqlite3.OperationalError:
+                # Another thread or process added it first
+                pass
+
+    def lookup(self, file_path: str, stat_result: os.stat_result = None):
+        checksums = self.lookup_checksums(file_path, stat_result)
+        return checksums[0] if checksums is not None else None
+
+    # Returns (md5, secondary checksum), where the secondary may be None, or None on a miss
+    def lookup_checksums(self, file_path: str, stat_result: os.stat_result = None):
+        file_path = os.path.abspath(file_path)
+        if stat_result is None:
+            stat_result = os.stat(file_path)
+        connection = self.get_connection()
+        row = connection.execute(
+            "SELECT checksum, secondary_checksum FROM checksum_cache "
+            "WHERE path = ? AND device = ? AND inode = ? AND size = ? AND mtime_ns = ?",
+            (file_path, stat_result.st_dev, stat_result.st_ino, stat_result.st_size, stat_result.st_mtime_ns)
+        ).fetchone()
+        if row is None:
+            return None
+        connection.execute("UPDATE checksum_cache SET last_used = ? WHERE path = ?", (time.time(), file_path))
+        return row[0], row[1]
+
+    def store(self, file_path: str, checksum: str, stat_result: os.stat_result = None, secondary_checksum: str = None):
+        file_path = os.path.abspath(file_path)
+        if stat_result is None:
+            stat_result = os.stat(file_path)
+        self.get_connection().execute(
+            "INSERT OR REPLACE INTO checksum_cache (path, device, inode, size, mtime_ns, checksum, last_used, "
+            "secondary_checksum) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (file_path, stat_result.st_dev, stat_result.st_ino, stat_result.st_size, stat_result.st_mtime_ns,
+             checksum, time.time(), secondary_checksum)
+        )
+        with self.lock:
+            self.stores_since_eviction += 1
+            evict = self.stores_since_eviction >= EVICTION_INTERVAL
+            if evict:
+                self.stores_since_eviction = 0
+        if evict:
+            self.evict()
+
+    def evict(self):
+        connection = self.get_connection()
+        cutoff = time.time() - self.max_age_days * 24 * 60 * 60
+        connection.execute("DELETE FROM checksum_cache WHERE last_used < ?", (cutoff,))
+        count = connection.execute("SELECT COUNT(*) FROM checksum_cache").fetchone()[0]
+        if count > self.max_entries:
+            # Trim to 90% so we aren't evicting again on the very next pass
+            to_remove = count - int(self.max_entries * 0.9)
+            connection.execute(
+                "DELETE FROM checksum_cache WHERE path IN "
+                "(SELECT path FROM checksum_cache ORDER BY last_used LIMIT ?)", (to_remove,))
+            logger.info("Evicted " + str(to_remove) + " entries from checksum cache " + self.cache_path)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+# Returns the shared cache, or None when checksum_cache_path isn't set
+def get_checksum_cache() -> ChecksumCache:
+    global _cache
+    cache_path = os.environ.get("checksum_cache_path")
+    if not cache_path:
+        return None
+    with _cache_lock:
+        if _cache is None or _cache.cache_path != cache_path:
+            _cache = ChecksumCache(cache_path)
+        return _cache
+
+
+def verify_by_default() -> bool:
+    return os.environ.get("checksum_cache_verify", "false").lower() in ["true", "1", "yes"]
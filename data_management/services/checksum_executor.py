@@ -0,0 +1,77 @@
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future
+
+logger = logging.getLogger("services-ChecksumExecutor")
+logger.setLevel(logging.INFO)
+
+DEFAULT_MAX_INFLIGHT_BYTES = 8 * 1024 * 1024 * 1024
+
+
+# Worker pool for hashing files. Submissions block while the total size of the files being hashed
+# is above max_inflight_bytes, so a large package can't flood the storage with reads.
+class ChecksumExecutor:
+
+    def __init__(self, workers: int = None, pool_type: str = None, max_inflight_bytes: int = None):
+        if workers is None:
+            workers = int(os.environ.get("checksum_workers", os.cpu_count() or 1))
+        if pool_type is None:
+            pool_type = os.environ.get("checksum_pool_type", "thread")
+        if max_inflight_bytes is None:
+            max_inflight_bytes = int(os.environ.get("checksum_max_inflight_bytes", DEFAULT_MAX_INFLIGHT_BYTES))
+        self.workers = max(1, workers)
+        self.pool_type = pool_type
+        self.max_inflight_bytes = max_inflight_bytes
+        self.inflight_bytes = 0
+        self.condition = threading.Condition()
+        if pool_type == "process":
+            self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        else:
+            self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="checksum")
+
+    def reserve(self, size: int):
+        with self.condition:
+            # A single file bigger than the budget is still allowed through once nothing else is running
+            while self.inflight_bytes > 0 and self.inflight_bytes + size > self.max_inflight_bytes:
+                self.condition.wait()
+            self.inflight_bytes += size
+
+    def release(self, size: int):
+        with self.condition:
+            self.inflight_bytes -= size
+            self.condition.notify_all()
+
+    def submit(self, fn, file_path: str, size: int = None, *args) -> Future:
+        if size is None:
+            size = os.path.getsize(file_path) if os.path.isfile(file_path) else 0
+        self.reserve(size)
+        try:
+            future = self.pool.submit(fn, file_path, *args)
+        except Exception:
+            self.release(size)
+            raise
+        future.add_done_callback(lambda _: self.release(size))
+        return future
+
+    def map(self, fn, files: list[tuple[str, int]]) -> dict:
+        futures = {}
+        for file_path, size in files:
+            futures[file_path] = self.submit(fn, file_path, size)
+        return {file_path: future.result() for file_path, future in futures.items()}
+
+    def shutdown(self):
+        self.pool.shutdown(wait=True)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_checksum_executor() -> ChecksumExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ChecksumExecutor()
+            logger.info("Started " + _executor.pool_type + " checksum pool with " + str(_executor.workers) + " workers")
+        return _executor
@@ -0,0 +1,133 @@
+import os
+import json
+import logging
+import hashlib
+import random
+from services.checksum_executor import get_checksum_executor
+from services.dlu_filesystem import CHECKSUM_READ_SIZE, advise
+from services.io_governor import get_io_governor
+
+logger = logging.getLogger("services-ChunkManifest")
+logger.setLevel(logging.INFO)
+
+DEFAULT_CHUNK_SIZE = 64 * 1024 * 1024
+DEFAULT_MIN_FILE_SIZE = 1024 * 1024 * 1024
+DEFAULT_ALGORITHM = "blake2b"
+
+
+def get_chunk_size() -> int:
+    return int(os.environ.get("chunk_manifest_chunk_size", DEFAULT_CHUNK_SIZE))
+
+
+# Files smaller than this aren't worth splitting, their md5 is checked as usual
+def get_min_file_size() -> int:
+    return int(os.environ.get("chunk_manifest_min_file_size", DEFAULT_MIN_FILE_SIZE))
+
+
+# Hashes length bytes of the file starting at offset with positioned reads, so any number of chunks of the
+# same file can be hashed at once
+def hash_chunk(file_path: str, offset: int, length: int, algorithm: str) -> str:
+    digest = hashlib.new(algorithm)
+    governor = get_io_governor()
+    fd = os.open(file_path, os.O_RDONLY)
+    try:
+        advise(fd, offset, length, "POSIX_FADV_SEQUENTIAL")
+        position = offset
+        end = offset + length
+        while position < end:
+            block = os.pread(fd, min(CHECKSUM_READ_SIZE, end - position), position)
+            if not block:
+                break
+            if governor is not None:
+                governor.acquire(len(block))
+            digest.update(block)
+            position += len(block)
+        advise(fd, offset, length, "POSIX_FADV_DONTNEED")
+    finally:
+        os.close(fd)
+    return digest.hexdigest()
+
+
+def hash_chunks(file_path: str, manifest: dict, chunk_indexes: list[int]) -> dict:
+    chunk_size = manifest["chunkSize"]
+    executor = get_checksum_executor()
+    futures = {}
+    for index in chunk_indexes:
+        offset = index * chunk_size
+        length = min(chunk_size, manifest["size"] - offset)
+        futures[index] = executor.submit(hash_chunk, file_path, length, offset, length, manifest["algorithm"])
+    return {index: future.result() for index, future in futures.items()}
+
+
+# The manifest stored in dlu_file.dlu_chunk_manifest: the digest of every chunk_size bytes of the file, with
+# the size and mtime it had when it was built. The file's md5 is computed in the same read and kept in the
+# manifest, so it can be checked against dlu_md5checksum before the manifest is trusted.
+def build_manifest(file_path: str, chunk_size: int = None, algorithm: str = None) -> dict:
+    stat_result = os.stat(file_path)
+    manifest = {
+        "algorithm": algorithm or os.environ.get("chunk_manifest_algorithm", DEFAULT_ALGORITHM),
+        "chunkSize": chunk_size or get_chunk_size(),
+        "size": stat_result.st_size,
+        "mtimeNs": stat_result.st_mtime_ns,
+    }
+    md5_digest = hashlib.md5()
+    chunks = []
+    governor = get_io_governor()
+    fd = os.open(file_path, os.O_RDONLY)
+    try:
+        advise(fd, 0, 0, "POSIX_FADV_SEQUENTIAL")
+        position = 0
+        while position < stat_result.st_size or len(chunks) == 0:
+            chunk_digest = hashlib.new(manifest["algorithm"])
+            end = min(position + manifest["chunkSize"], stat_result.st_size)
+            while position < end:
+                block = os.pread(fd, min(CHECKSUM_READ_SIZE, end - position), position)
+                if not block:
+                    break
+                if governor is not None:
+                    governor.acquire(len(block))
+                md5_digest.update(block)
+                chunk_digest.update(block)
+                position += len(block)
+            chunks.append(chunk_digest.hexdigest())
+            if position < end:
+                # The file shrank while it was being read
+                break
+        advise(fd, 0, 0, "POSIX_FADV_DONTNEED")
+    finally:
+        os.close(fd)
+    manifest["chunks"] = chunks
+    manifest["md5"] = md5_digest.hexdigest()
+    return manifest
+
+
+# dlu_chunk_manifest as it comes back from MySQL, which may be JSON text rather than a dict
+def load_manifest(manifest) -> dict:
+    if isinstance(manifest, (bytes, bytearray)):
+        manifest = manifest.decode()
+    return json.loads(manifest) if isinstance(manifest, str) else manifest
+
+
+# Picks which chunks to check. A file that has changed size or mtime since its manifest was built has
+# every chunk checked, otherwise sample_fraction of them (at least one) are picked at random.
+def choose_chunks(file_path: str, manifest: dict, sample_fraction: float = 1.0) -> list[int]:
+    chunk_count = len(manifest["chunks"])
+    stat_result = os.stat(file_path)
+    if stat_result.st_size != manifest["size"] or stat_result.st_mtime_ns != manifest["mtimeNs"] \
+            or sample_fraction >= 1:
+        return list(range(chunk_count))
+    return sorted(random.sample(range(chunk_count), max(1, round(chunk_count * sample_fraction))))
+
+
+# Returns the indexes of the checked chunks that no longer match the manifest. A file whose size has changed
+# fails outright with every chunk reported.
+def verify_manifest(file_path: str, manifest: dict, sample_fraction: float = 1.0) -> list[int]:
+    if os.path.getsize(file_path) != manifest["size"]:
+        return list(range(len(manifest["chunks"])))
+    chunk_indexes = choose_chunks(file_path, manifest, sample_fraction)
+    chunk_digests = hash_chunks(file_path, manifest, chunk_indexes)
+    mismatched = [index for index in chunk_indexes if chunk_digests[index] != manifest["chunks"][index]]
+    if mismatched:
+        logger.warning(file_path + " has " + str(len(mismatched)) + " of " + str(len(chunk_indexes))
+                       + " checked chunks that don't match its manifest")
+    return mismatched
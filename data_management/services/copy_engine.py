@@ -0,0 +1,113 @@
+import os
+import errno
+import fcntl
+import logging
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from services.io_governor import get_io_governor, IOGovernor
+
+logger = logging.getLogger("services-CopyEngine")
+logger.setLevel(logging.INFO)
+
+# From linux/fs.h, clones the source file's extents into the destination (btrfs, XFS with reflink=1)
+FICLONE = 0x40049409
+COPY_CHUNK_SIZE = 64 * 1024 * 1024
+DEFAULT_COPY_WORKERS = 4
+
+
+def try_reflink(source_fd: int, dest_fd: int):
+    try:
+        fcntl.ioctl(dest_fd, FICLONE, source_fd)
+        return True
+    except OSError:
+        return False
+
+
+# Copies inside the kernel, trying a reflink first, then copy_file_range (which NFS 4.2 and some
+# filesystems can turn into a server-side copy), then sendfile, and finally a plain read/write loop.
+# Like copy2, the permission bits and timestamps are carried over.
+def kernel_copy(source_file: str, dest_file: str):
+    with open(source_file, "rb") as source, open(dest_file, "wb") as dest:
+        source_fd = source.fileno()
+        dest_fd = dest.fileno()
+        size = os.fstat(source_fd).st_size
+        governor = get_io_governor()
+        if not try_reflink(source_fd, dest_fd):
+            copied = 0
+            for copy_function in [getattr(os, "copy_file_range", None), getattr(os, "sendfile", None)]:
+                if copy_function is None:
+                    continue
+                try:
+                    copied = copy_range(copy_function, source_fd, dest_fd, copied, size, governor)
+                    break
+                except OSError as error:
+                    if error.errno not in [errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP,
+                                           errno.ENOTSUP, errno.EBADF]:
+                        raise
+            if copied < size:
+                source.seek(copied)
+                dest.seek(copied)
+                copy_stream(source, dest, governor)
+    shutil.copystat(source_file, dest_file)
+    return size
+
+
+def copy_range(copy_function, source_fd: int, dest_fd: int, offset: int, size: int, governor: IOGovernor = None):
+    while offset < size:
+        chunk_size = min(COPY_CHUNK_SIZE, size - offset)
+        if governor is not None:
+            governor.acquire(chunk_size)
+        if copy_function is os.sendfile:
+            bytes_copied = os.sendfile(dest_fd, source_fd, offset, chunk_size)
+        else:
+            bytes_copied = os.copy_file_range(source_fd, dest_fd, chunk_size, offset, offset)
+        if bytes_copied == 0:
+            break
+        offset += bytes_copied
+    return offset
+
+
+# shutil.copyfileobj, with each chunk going through the governor
+def copy_stream(source, dest, governor: IOGovernor = None):
+    while True:
+        chunk = source.read(COPY_CHUNK_SIZE)
+        if not chunk:
+            break
+        if governor is not None:
+            governor.acquire(len(chunk))
+        dest.write(chunk)
+
+
+class CopyTask:
+
+    def __init__(self, source_file: str, dest_file: str):
+        self.source_file = source_file
+        self.dest_file = dest_file
+        self.size = os.path.getsize(source_file)
+
+
+# Runs a package's file copies on a bounded thread pool. The copy function is called as
+# copy_function(source_file, dest_file), the same as shutil.copytree's copy_function.
+class CopyEngine:
+
+    def __init__(self, workers: int = None):
+        if workers is None:
+            workers = int(os.environ.get("copy_workers", DEFAULT_COPY_WORKERS))
+        self.workers = max(1, workers)
+
+    def run(self, tasks: list[CopyTask], copy_function=kernel_copy, label: str = ""):
+        start = time.perf_counter()
+        total_bytes = sum(task.size for task in tasks)
+        # Biggest files first, so one large slide doesn't start last and hold up the whole package
+        ordered_tasks = sorted(tasks, key=lambda task: task.size, reverse=True)
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="copy") as pool:
+            futures = [pool.submit(copy_function, task.source_file, task.dest_file) for task in ordered_tasks]
+            for future in futures:
+                future.result()
+        elapsed = time.perf_counter() - start
+        mb_per_second = (total_bytes / (1024 * 1024)) / elapsed if elapsed > 0 else 0
+        logger.info(f"Copied {len(tasks)} files ({total_bytes} bytes) for {label} in {elapsed:.1f}s "
+                    f"({mb_per_second:.1f} MB/s)")
+        return {"files": len(tasks), "bytes": total_bytes, "seconds": elapsed, "bytes_per_second":
+                total_bytes / elapsed if elapsed > 0 else 0}
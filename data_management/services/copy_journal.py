@@ -0,0 +1,67 @@
+import os
+import json
+import logging
+import threading
+
+logger = logging.getLogger("services-CopyJournal")
+logger.setLevel(logging.INFO)
+
+
+# Append-only JSON lines record of the files of a package that have finished copying. A line is only
+# written once a file's copy is complete, so after a crash any destination file without an entry, or
+# whose size no longer matches its entry, is copied again.
+class CopyJournal:
+
+    def __init__(self, package_id: str, journal_directory: str):
+        self.journal_path = os.path.join(journal_directory, package_id + ".jsonl")
+        os.makedirs(journal_directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.entries = {}
+
+    def load(self):
+        self.entries = {}
+        if not os.path.isfile(self.journal_path):
+            return self.entries
+        with open(self.journal_path) as journal:
+            for line in journal:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # The last line can be cut short by a crash
+                    continue
+                self.entries[entry["dest"]] = entry
+        logger.info("Loaded " + str(len(self.entries)) + " completed files from " + self.journal_path)
+        return self.entries
+
+    def reset(self):
+        self.entries = {}
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+
+    def record(self, source_file: str, dest_file: str, checksum: str = None, secondary_checksum: str = None):
+        stat_result = os.stat(dest_file)
+        entry = {"source": source_file, "dest": dest_file, "size": stat_result.st_size,
+                 "mtime_ns": stat_result.st_mtime_ns, "checksum": checksum, "secondary_checksum": secondary_checksum}
+        with self.lock:
+            with open(self.journal_path, "a") as journal:
+                journal.write(json.dumps(entry) + "\n")
+            self.entries[dest_file] = entry
+
+    # A file is complete when it was journaled and the copy on disk is still the one that was journaled
+    def completed_entry(self, source_file: str, dest_file: str):
+        entry = self.entries.get(dest_file)
+        if entry is None or entry["source"] != source_file:
+            return None
+        try:
+            dest_stat = os.stat(dest_file)
+            source_stat = os.stat(source_file)
+        except FileNotFoundError:
+            return None
+        if dest_stat.st_size != entry["size"] or dest_stat.st_mtime_ns != entry["mtime_ns"] \
+                or source_stat.st_size != entry["size"]:
+            return None
+        return entry
+
+    def clear(self):
+        self.reset()
+        logger.info("Cleared copy journal " + self.journal_path)
@@ -0,0 +1,156 @@
+import os
+import logging
+import shutil
+import threading
+import time
+from services.copy_engine import try_reflink
+from services.dlu_filesystem import calculate_checksum
+from services.dlu_management import DluManagement
+
+logger = logging.getLogger("services-DluDedup")
+logger.setLevel(logging.INFO)
+
+DEDUP_MODES = ["off", "hardlink", "reflink"]
+DEFAULT_MIN_FILE_SIZE = 1024 * 1024
+DEFAULT_REFRESH_SECONDS = 5 * 60
+
+
+# Index of the files already in the DLU keyed by (size, md5), loaded from dlu_file and refreshed every
+# refresh_seconds, so copies of content that is already there can be hardlinked or reflinked to it instead.
+# Files copied since the last load are added as they are copied. Before linking, the existing file has to
+# still be there with the same size and, with dlu_dedup_verify on, the same md5 (from the checksum cache
+# when it has the file).
+class DedupIndex:
+
+    def __init__(self, mode: str, dlu_management=None, dlu_data_directory: str = '/data', min_file_size: int = None,
+                 refresh_seconds: int = None, verify: bool = None):
+        if min_file_size is None:
+            min_file_size = int(os.environ.get("dlu_dedup_min_file_size", DEFAULT_MIN_FILE_SIZE))
+        if refresh_seconds is None:
+            refresh_seconds = int(os.environ.get("dlu_dedup_refresh_seconds", DEFAULT_REFRESH_SECONDS))
+        if verify is None:
+            verify = os.environ.get("dlu_dedup_verify", "true").lower() in ["true", "1", "yes"]
+        self.mode = mode
+        self.dlu_management = dlu_management
+        self.dlu_data_directory = dlu_data_directory
+        self.min_file_size = min_file_size
+        self.refresh_seconds = refresh_seconds
+        self.verify = verify
+        self.entries = {}
+        self.sizes = set()
+        self.loaded_at = None
+        self.lock = threading.Lock()
+        self.files_linked = 0
+        self.bytes_saved = 0
+
+    def load(self):
+        if self.dlu_management is None:
+            self.dlu_management = DluManagement()
+        entries = {}
+        for row in self.dlu_management.find_dedup_candidates(self.min_file_size) or []:
+            path = os.path.join(self.dlu_data_directory, 'package_' + row['dlu_package_id'], row['dlu_fileName'])
+            entries.setdefault((row['dlu_filesize'], row['dlu_md5checksum']), path)
+        with self.lock:
+            # Keep files added since the last load that dlu_file doesn't have yet
+            for key, path in self.entries.items():
+                entries.setdefault(key, path)
+            self.entries = entries
+            self.sizes = set(size for size, _ in entries)
+            self.loaded_at = time.monotonic()
+        logger.info("Loaded " + str(len(entries)) + " files into the dedup index")
+
+    def refresh(self):
+        with self.lock:
+            if self.loaded_at is not None and time.monotonic() - self.loaded_at < self.refresh_seconds:
+                return
+            # Claimed up front so only one copy thread reloads
+            self.loaded_at = time.monotonic()
+        try:
+            self.load()
+        except Exception as error:
+            # Deduplication is only an optimization, so copies carry on without it
+            logger.error("Unable to load the dedup index: " + str(error))
+
+    # A cheap check before anything is hashed: no file of this size means no duplicate
+    def has_size(self, size: int) -> bool:
+        self.refresh()
+        return size >= self.min_file_size and size in self.sizes
+
+    def add(self, size: int, checksum: str, path: str):
+        if size < self.min_file_size or not checksum or checksum == "0":
+            return
+        with self.lock:
+            self.entries.setdefault((size, checksum), path)
+            self.sizes.add(size)
+
+    # Returns the path of an existing file with this content, or None
+    def find(self, size: int, checksum: str, dest_file: str):
+        with self.lock:
+            existing_file = self.entries.get((size, checksum))
+        if existing_file is None or os.path.abspath(existing_file) == os.path.abspath(dest_file):
+            return None
+        try:
+            unchanged = os.path.getsize(existing_file) == size \
+                and (not self.verify or calculate_checksum(existing_file) == checksum)
+        except FileNotFoundError:
+            unchanged = False
+        if not unchanged:
+            logger.info("Dropping " + existing_file + " from the dedup index, it is gone or has changed")
+            with self.lock:
+                if self.entries.get((size, checksum)) == existing_file:
+                    del self.entries[(size, checksum)]
+            return None
+        return existing_file
+
+    # Links dest_file to an existing file with the same content. Returns False when there isn't one or the
+    # filesystem can't link them, so the caller copies instead.
+    def link_duplicate(self, source_file: str, dest_file: str, size: int, checksum: str) -> bool:
+        existing_file = self.find(size, checksum, dest_file)
+        if existing_file is None:
+            return False
+        if os.path.lexists(dest_file):
+            os.remove(dest_file)
+        try:
+            if self.mode == "hardlink":
+                os.link(existing_file, dest_file)
+            else:
+                with open(existing_file, "rb") as existing, open(dest_file, "wb") as dest:
+                    linked = try_reflink(existing.fileno(), dest.fileno())
+                if not linked:
+                    os.remove(dest_file)
+                    return False
+                shutil.copystat(source_file, dest_file)
+        except OSError as error:
+            logger.warning("Unable to " + self.mode + " " + dest_file + " to " + existing_file + ": " + str(error))
+            if os.path.lexists(dest_file):
+                os.remove(dest_file)
+            return False
+        with self.lock:
+            self.files_linked += 1
+            self.bytes_saved += size
+        logger.info("Deduplicated " + dest_file + " against " + existing_file)
+        return True
+
+    def report(self) -> dict:
+        with self.lock:
+            return {"mode": self.mode, "indexed_files": len(self.entries), "files_linked": self.files_linked,
+                    "bytes_saved": self.bytes_saved}
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+# Returns the shared index, or None when dlu_dedup_mode is off
+def get_dedup_index(dlu_data_directory: str = '/data') -> DedupIndex:
+    global _index
+    mode = os.environ.get("dlu_dedup_mode", "off")
+    if mode not in DEDUP_MODES:
+        logger.warning("Unknown dlu_dedup_mode " + mode + ", not deduplicating")
+        return None
+    if mode == "off":
+        return None
+    with _index_lock:
+        if _index is None or _index.dlu_data_directory != dlu_data_directory:
+            _index = DedupIndex(mode, dlu_data_directory=dlu_data_directory)
+        return _index
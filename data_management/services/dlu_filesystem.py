@@ -1,43 +1,341 @@
 import shutil
 import os
+import errno
 from pathlib import Path
 import logging
 import shutil
+import hashlib
 from hashlib import md5
 import uuid
 from zarr_checksum import compute_zarr_checksum
-from zarr_checksum.generators import yield_files_local
-from mmap import mmap, ACCESS_READ
+from zarr_checksum.generators import ZarrArchiveFile
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from services.checksum_executor import get_checksum_executor
+from services.checksum_cache import get_checksum_cache, verify_by_default
+from services.copy_engine import CopyEngine, CopyTask, kernel_copy
+from services.copy_journal import CopyJournal
+from services.io_governor import get_io_governor
 
 logger = logging.getLogger("DLUFilesystem")
 logger.setLevel(logging.INFO)
 
+DEFAULT_CHECKSUM_READ_SIZE = 8 * 1024 * 1024
+# This is apparently the md5 returned for an empty file
+EMPTY_FILE_CHECKSUM = 'd41d8cd98f00b204e9800998ecf8427e'
+VERIFICATION_PENDING = "pending"
+VERIFICATION_VERIFIED = "verified"
+VERIFICATION_MISMATCH = "mismatch"
+CHECKSUM_READ_SIZE = int(os.environ.get("checksum_read_size", DEFAULT_CHECKSUM_READ_SIZE))
 
-def calculate_checksum(file_path: str):
+
+def advise(fd: int, offset: int, length: int, advice_name: str):
+    # posix_fadvise is only a hint and isn't available everywhere (e.g. macOS), so failures are ignored
+    if hasattr(os, "posix_fadvise"):
+        try:
+            os.posix_fadvise(fd, offset, length, getattr(os, advice_name))
+        except OSError:
+            pass
+
+
+def is_zarr_store(path: str):
+    return ".zarr" in path
+
+
+# Reads the file in fixed-size blocks into a single reused buffer and feeds each block to every digest,
+# and to dest_file if one is given. Pages already read are dropped from the page cache so multi-GB
+# slides don't push everything else out of memory.
+def stream_file(file_path: str, digests: list, read_size: int = None, dest_file=None):
+    read_size = read_size or CHECKSUM_READ_SIZE
+    buffer = bytearray(read_size)
+    view = memoryview(buffer)
+    offset = 0
+    governor = get_io_governor()
+    with open(file_path, "rb", buffering=0) as f:
+        fd = f.fileno()
+        advise(fd, 0, 0, "POSIX_FADV_SEQUENTIAL")
+        while True:
+            bytes_read = f.readinto(buffer)
+            if not bytes_read:
+                break
+            if governor is not None:
+                governor.acquire(bytes_read)
+            for digest in digests:
+                digest.update(view[:bytes_read])
+            if dest_file is not None:
+                dest_file.write(view[:bytes_read])
+            advise(fd, offset, bytes_read, "POSIX_FADV_DONTNEED")
+            offset += bytes_read
+    return offset
+
+
+def stream_checksum(file_path: str, read_size: int = None):
+    digest = md5()
+    stream_file(file_path, [digest], read_size)
+    return digest.hexdigest()
+
+
+@lru_cache
+def is_supported_algorithm(algorithm: str) -> bool:
+    # Variable-length digests like shake_128 can't be hexdigested without a length
+    if algorithm not in hashlib.algorithms_available or hashlib.new(algorithm).digest_size == 0:
+        logger.warning("Unsupported secondary_checksum_algorithm " + algorithm + ", only computing md5")
+        return False
+    return True
+
+
+# The fast digest kept alongside the md5, e.g. blake2b, or None when secondary_checksum_algorithm isn't set
+def get_secondary_algorithm():
+    algorithm = os.environ.get("secondary_checksum_algorithm")
+    if not algorithm or not is_supported_algorithm(algorithm):
+        return None
+    return algorithm
+
+
+# Secondary checksums are stored as "algorithm:hexdigest" so they can still be checked after the
+# configured algorithm changes
+def format_secondary_checksum(algorithm: str, hexdigest: str):
+    return algorithm + ":" + hexdigest
+
+
+def is_secondary_checksum_for(secondary_checksum: str, algorithm: str) -> bool:
+    return secondary_checksum is not None and secondary_checksum.startswith(algorithm + ":")
+
+
+# Returns (md5, secondary checksum) from a single read of the file. The secondary is None without an algorithm.
+def stream_checksums(file_path: str, secondary_algorithm: str = None, read_size: int = None) -> tuple:
+    digests = [md5()]
+    if secondary_algorithm:
+        digests.append(hashlib.new(secondary_algorithm))
+    stream_file(file_path, digests, read_size)
+    if not secondary_algorithm:
+        return digests[0].hexdigest(), None
+    return digests[0].hexdigest(), format_secondary_checksum(secondary_algorithm, digests[1].hexdigest())
+
+
+# Re-reads the file with only the secondary checksum's algorithm, which is much cheaper than md5
+def verify_secondary_checksum(file_path: str, secondary_checksum: str) -> bool:
+    algorithm = secondary_checksum.split(":", 1)[0]
+    digest = hashlib.new(algorithm)
+    stream_file(file_path, [digest])
+    return format_secondary_checksum(algorithm, digest.hexdigest()) == secondary_checksum
+
+
+# Copies source_file to dest_file and hashes it from the same buffers, so the data is only read once.
+# Like copy2, the permission bits and timestamps are carried over.
+def copy_and_hash(source_file: str, dest_file: str, secondary_algorithm: str = None):
+    digests = [md5()]
+    if secondary_algorithm:
+        digests.append(hashlib.new(secondary_algorithm))
+    source_stat = os.stat(source_file)
+    with open(dest_file, "wb", buffering=0) as out:
+        size = stream_file(source_file, digests, dest_file=out)
+    shutil.copystat(source_file, dest_file)
+    secondary_checksum = None
+    if secondary_algorithm:
+        secondary_checksum = format_secondary_checksum(secondary_algorithm, digests[1].hexdigest())
+    checksum_cache = get_checksum_cache()
+    if checksum_cache is not None:
+        checksum_cache.store(source_file, digests[0].hexdigest(), source_stat, secondary_checksum)
+        checksum_cache.store(dest_file, digests[0].hexdigest(), secondary_checksum=secondary_checksum)
+    dlu_file = DLUFile(name=os.path.basename(dest_file), path=os.path.dirname(dest_file),
+                       checksum=digests[0].hexdigest(), size=size)
+    dlu_file.secondary_checksum = secondary_checksum
+    return dlu_file
+
+
+# Gives a hardlinked file its own copy of the data, written to a temporary file next to it and renamed over
+# it, so writing to it afterwards can't change the other names for the old inode. Returns True if it was linked.
+def break_hardlink(file_path: str) -> bool:
+    try:
+        if os.lstat(file_path).st_nlink <= 1:
+            return False
+    except FileNotFoundError:
+        return False
+    temp_path = file_path + ".unlink-" + str(os.getpid())
+    try:
+        kernel_copy(file_path, temp_path)
+        os.replace(temp_path, file_path)
+    finally:
+        if os.path.lexists(temp_path):
+            os.remove(temp_path)
+    return True
+
+
+# Returns (full path, path relative to the store, size) for every chunk file in a zarr store, in the same
+# order zarr_checksum's yield_files_local walks them
+def list_zarr_files(zarr_path: str) -> list[tuple]:
+    zarr_files = []
+    for root, _, file_names in os.walk(zarr_path):
+        for file_name in file_names:
+            full_path = os.path.join(root, file_name)
+            zarr_files.append((full_path, os.path.relpath(full_path, zarr_path), os.path.getsize(full_path)))
+    return zarr_files
+
+
+# Builds the zarr_checksum tree digest from per-chunk md5s, so chunks can be hashed (or pulled from the
+# checksum cache) individually and still give the same digest as compute_zarr_checksum(yield_files_local())
+def assemble_zarr_checksum(zarr_files: list[tuple], chunk_checksums: dict) -> str:
+    return compute_zarr_checksum(
+        ZarrArchiveFile(path=Path(relative_path), size=size, digest=chunk_checksums[full_path])
+        for full_path, relative_path, size in zarr_files
+    ).md5
+
+
+def calculate_zarr_checksum(zarr_path: str, verify: bool = None):
+    zarr_files = list_zarr_files(zarr_path)
+    chunk_checksums = {full_path: calculate_checksum(full_path, verify) for full_path, _, _ in zarr_files}
+    return assemble_zarr_checksum(zarr_files, chunk_checksums)
+
+
+# Zarr stores get the zarr_checksum digest of their contents and other directories get "0".
+# Regular files are looked up in the checksum cache first (when one is configured) unless verify is set,
+# in which case they're always re-read and the cache entry refreshed.
+def calculate_checksum(file_path: str, verify: bool = None):
 
     if os.path.isdir(file_path):
+        if is_zarr_store(file_path):
+            return calculate_zarr_checksum(file_path, verify)
         return "0"
+    return hash_file(file_path, verify, False)[0]
+
+
+# Like calculate_checksum, but returns (md5, secondary checksum). Directories and zarr stores have no
+# secondary checksum.
+def calculate_checksums(file_path: str, verify: bool = None) -> tuple:
+    if os.path.isdir(file_path):
+        return calculate_checksum(file_path, verify), None
+    return hash_file(file_path, verify, True)
+
+
+def hash_file(file_path: str, verify: bool, need_secondary: bool) -> tuple:
+    secondary_algorithm = get_secondary_algorithm()
+    if os.path.getsize(file_path) == 0:
+        if not secondary_algorithm:
+            return EMPTY_FILE_CHECKSUM, None
+        return EMPTY_FILE_CHECKSUM, format_secondary_checksum(secondary_algorithm, hashlib.new(secondary_algorithm).hexdigest())
+    checksum_cache = get_checksum_cache()
+    if checksum_cache is None:
+        return stream_checksums(file_path, secondary_algorithm if need_secondary else None)
+    if verify is None:
+        verify = verify_by_default()
+    # Stat before reading so a file modified mid-hash doesn't get cached under its new mtime
+    stat_result = os.stat(file_path)
+    if not verify:
+        cached = checksum_cache.lookup_checksums(file_path, stat_result)
+        if cached is not None:
+            checksum, secondary_checksum = cached
+            if secondary_algorithm and not is_secondary_checksum_for(secondary_checksum, secondary_algorithm):
+                secondary_checksum = None
+            if secondary_checksum is not None or not need_secondary or not secondary_algorithm:
+                return checksum, secondary_checksum
+    # With a cache both digests are always computed, so later callers find the secondary too
+    checksum, secondary_checksum = stream_checksums(file_path, secondary_algorithm)
+    checksum_cache.store(file_path, checksum, stat_result, secondary_checksum)
+    return checksum, secondary_checksum
+
+
+# Hashes a list of paths on the shared checksum pool, returning a dict of path to checksum, or to
+# (md5, secondary checksum) with with_secondary. Zarr stores are split into their chunk files so one
+# store's chunks are hashed in parallel too.
+def calculate_checksums_for_paths(file_paths: list[str], with_secondary: bool = False) -> dict:
+    files = []
+    zarr_stores = {}
+    for file_path in file_paths:
+        if os.path.isdir(file_path) and is_zarr_store(file_path):
+            zarr_stores[file_path] = list_zarr_files(file_path)
+            files.extend((full_path, size) for full_path, _, size in zarr_stores[file_path])
+        else:
+            size = 0 if os.path.isdir(file_path) else os.path.getsize(file_path)
+            files.append((file_path, size))
+    checksums = get_checksum_executor().map(calculate_checksums if with_secondary else calculate_checksum, files)
+    for zarr_path, zarr_files in zarr_stores.items():
+        if with_secondary:
+            chunk_checksums = {full_path: checksums[full_path][0] for full_path, _, _ in zarr_files}
+            checksums[zarr_path] = (assemble_zarr_checksum(zarr_files, chunk_checksums), None)
+        else:
+            checksums[zarr_path] = assemble_zarr_checksum(zarr_files, checksums)
+    return {file_path: checksums[file_path] for file_path in file_paths}
+
+
+# The checksum of a file or zarr store from the checksum cache alone, or None if anything would need reading
+def lookup_cached_checksum(file_path: str):
+    if os.path.isdir(file_path):
+        if not is_zarr_store(file_path):
+            return "0"
+        zarr_files = list_zarr_files(file_path)
+        chunk_checksums = {full_path: lookup_cached_checksum(full_path) for full_path, _, _ in zarr_files}
+        if None in chunk_checksums.values():
+            return None
+        return assemble_zarr_checksum(zarr_files, chunk_checksums)
     if os.path.getsize(file_path) == 0:
-        # This is apparently the md5 returned for an empty file
-        return 'd41d8cd98f00b204e9800998ecf8427e'
-    elif ".zarr" not in file_path:
-        with open(file_path) as f, mmap(f.fileno(), 0, access=ACCESS_READ) as f:
-            return md5(f).hexdigest()
-    else:
-        return compute_zarr_checksum(yield_files_local(file_path)).md5
+        return EMPTY_FILE_CHECKSUM
+    checksum_cache = get_checksum_cache()
+    return checksum_cache.lookup(file_path) if checksum_cache is not None else None
+
+
+# For deferred verification: files keep a supplied checksum or take one from the checksum cache, nothing
+# is hashed, and all of them are marked for the background verifier. Files with neither are registered
+# without a checksum and get theirs from the verifier, as do files whose source is already gone.
+def defer_pending_checksums(file_list: list) -> list:
+    for file in file_list:
+        if file.checksum_pending():
+            try:
+                cached_checksum = lookup_cached_checksum(file.source_path)
+            except FileNotFoundError:
+                cached_checksum = None
+            if cached_checksum is None:
+                file.source_path = None
+            file.checksum = cached_checksum
+        file.verification_status = VERIFICATION_PENDING
+    return file_list
+
+
+# Resolves every lazy checksum in the list together on the checksum pool
+def calculate_pending_checksums(file_list: list) -> list:
+    pending_files = [file for file in file_list if file.checksum_pending()]
+    if len(pending_files) > 0:
+        checksums = calculate_checksums_for_paths([file.source_path for file in pending_files], with_secondary=True)
+        for file in pending_files:
+            file.checksum, secondary_checksum = checksums[file.source_path]
+            if file.secondary_checksum is None:
+                file.secondary_checksum = secondary_checksum
+    return file_list
 
 
 class DLUFile:
 
-    def __init__(self, name: str, path: str, checksum: str, size: int, metadata: dict = {}):
+    # A checksum of None with a source_path makes the checksum lazy: source_path is hashed the first
+    # time the checksum is read and the result is kept, so a file is never hashed twice.
+    def __init__(self, name: str, path: str, checksum: str, size: int, metadata: dict = {}, source_path: str = None):
         self.name = name
         self.path = path
-        self.checksum = checksum
+        self._checksum = checksum
+        self.source_path = source_path
         self.size = size
         self.file_id = str(uuid.uuid4())
         self.metadata = metadata
         self.modified_at = None
+        # "algorithm:hexdigest" from secondary_checksum_algorithm, when one is configured
+        self.secondary_checksum = None
+        # VERIFICATION_PENDING while a deferred checksum is waiting for the background verifier
+        self.verification_status = None
+
+    @property
+    def checksum(self):
+        if self.checksum_pending():
+            self._checksum, secondary_checksum = calculate_checksums(self.source_path)
+            if self.secondary_checksum is None:
+                self.secondary_checksum = secondary_checksum
+        return self._checksum
+
+    @checksum.setter
+    def checksum(self, checksum: str):
+        self._checksum = checksum
+
+    def checksum_pending(self):
+        return self._checksum is None and self.source_path is not None
 
     # Returns path without top directory, i.e. package dir or participant dir (bulk uploads)
     def get_short_path(self):
@@ -48,9 +346,72 @@ class DLUFile:
         return self.name.split("/")[-1:][0]
 
 
+# Yields every file under directory_path from a single scandir pass per directory, reusing the stat
+# info from the directory entries. Names are relative to directory_path, and .zarr stores are
+# yielded as single entries rather than walked into.
+def walk_files(directory_path: str, calculate_checksums: bool = True, prefix: str = ""):
+    subdirectories = []
+    with os.scandir(directory_path) as entries:
+        for entry in entries:
+            name = prefix + entry.name
+            if entry.is_dir() and not is_zarr_store(entry.name):
+                subdirectories.append((entry.path, name))
+            elif calculate_checksums:
+                yield DLUFile(name, entry.path, None, entry.stat().st_size, source_path=entry.path)
+            else:
+                yield DLUFile(name, entry.path, "0", entry.stat().st_size)
+    for subdirectory_path, name in subdirectories:
+        yield from walk_files(subdirectory_path, calculate_checksums, name + "/")
+
+
+# Walks a directory tree through directory file descriptors, chowning every entry that isn't already owned
+# by uid:gid. Symlinks are changed themselves rather than followed. When a pool is given, each subdirectory
+# is walked as a separate task.
+def chown_tree(directory_fd: int, uid: int, gid: int, pool: ThreadPoolExecutor = None) -> int:
+    changed = 0
+    subdirectories = []
+    with os.scandir(directory_fd) as entries:
+        for entry in entries:
+            stat_result = entry.stat(follow_symlinks=False)
+            if stat_result.st_uid != uid or stat_result.st_gid != gid:
+                os.chown(entry.name, uid, gid, dir_fd=directory_fd, follow_symlinks=False)
+                changed += 1
+            if entry.is_dir(follow_symlinks=False):
+                subdirectories.append(entry.name)
+    if pool is not None:
+        futures = [pool.submit(chown_subdirectory, directory_fd, name, uid, gid) for name in subdirectories]
+        return changed + sum(future.result() for future in futures)
+    for name in subdirectories:
+        changed += chown_subdirectory(directory_fd, name, uid, gid)
+    return changed
+
+
+def chown_subdirectory(parent_fd: int, name: str, uid: int, gid: int) -> int:
+    directory_fd = os.open(name, os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW, dir_fd=parent_fd)
+    try:
+        return chown_tree(directory_fd, uid, gid)
+    finally:
+        os.close(directory_fd)
+
+
+# Total size of the files under a directory, from stat calls only. A missing directory counts as empty.
+def get_directory_size(directory_path: str) -> int:
+    size = 0
+    try:
+        with os.scandir(directory_path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    size += get_directory_size(entry.path)
+                else:
+                    size += entry.stat().st_size
+    except (FileNotFoundError, NotADirectoryError):
+        pass
+    return size
+
+
 class DirectoryInfo:
     def __init__(self, directory_path: str, calculate_checksums: bool = True):
-        self.dir_contents = os.listdir(directory_path)
+        self.dir_contents = []
         self.subdir_count = 0
         self.file_count = 0
         self.file_details = []
@@ -60,16 +421,22 @@ class DirectoryInfo:
         self.get_directory_information()
         self.check_if_valid_for_dlu()
 
+    # With calculate_checksums on, files get lazy checksums, so a scan only costs the stat calls
     def get_directory_information(self):
-        for item in self.dir_contents:
-            full_path = os.path.join(self.directory_path, item)
-            if os.path.isdir(full_path) and ".zarr" not in full_path:
-                self.subdir_count += 1
-                checksum = "0"
-            else:
-                self.file_count += 1
-                checksum = "0" if not self.calculate_checksums else calculate_checksum(full_path)
-            self.file_details.append(DLUFile(item, full_path, checksum, os.path.getsize(full_path)))
+        with os.scandir(self.directory_path) as entries:
+            for entry in entries:
+                self.dir_contents.append(entry.name)
+                size = entry.stat().st_size
+                if entry.is_dir() and not is_zarr_store(entry.path):
+                    self.subdir_count += 1
+                    dlu_file = DLUFile(entry.name, entry.path, "0", size)
+                else:
+                    self.file_count += 1
+                    if self.calculate_checksums:
+                        dlu_file = DLUFile(entry.name, entry.path, None, size, source_path=entry.path)
+                    else:
+                        dlu_file = DLUFile(entry.name, entry.path, "0", size)
+                self.file_details.append(dlu_file)
 
     def check_if_valid_for_dlu(self):
         self.valid_for_dlu = (len(self.dir_contents) != 0)
@@ -82,6 +449,21 @@ class DLUFileHandler:
         self.dlu_data_directory = '/data'
         self.dlu_package_dir_prefix = 'package_'
         self.globus_dir_prefix = ''
+        # Checksums computed while copying, keyed by source path
+        self.copied_checksums = {}
+        self.copied_secondary_checksums = {}
+        self.hash_on_copy = True
+        self.last_copy_stats = None
+        # "copy", or "link"/"rename" to hardlink or rename files into place when source and destination share a filesystem
+        self.move_strategy = "copy"
+        # When on, finished copies are journaled so a package can be resumed after a restart
+        self.journal_copies = False
+        self.journal = None
+        # A DedupIndex (see dlu_dedup) to link files whose content is already in the DLU instead of copying them
+        self.dedup_index = None
+        # Checksums already known for source files, e.g. from a bulk upload manifest, keyed by source path
+        self.known_checksums = {}
+        self.deduplicated_sizes = []
     
     def set_recall_package_directories(self):
         self.globus_data_directory = '/data'
@@ -103,44 +485,251 @@ class DLUFileHandler:
 
         return {"file_name": file_name, "file_path": file_path}
     
-    def chown_dir(self, package_id: str, files: list[DLUFile], user_id):
+    # Gives the whole package tree to user_id and the dlu_group, only touching entries that are owned by
+    # someone else. With chown_workers above 1 the top level subdirectories are done in parallel.
+    def chown_dir(self, package_id: str, user_id: int):
         package_path = self.dlu_data_directory + "/" + self.dlu_package_dir_prefix + package_id
-        if os.stat(package_path).st_uid != user_id or os.stat(package_path).st_gid != int(os.environ['dlu_group']):
-            os.chown(package_path, user_id, int(os.environ['dlu_group']))
-            for file in files:
-                os.chown(package_path + "/" + file.name, user_id, int(os.environ['dlu_group']))
-        for root, dirs, _ in os.walk(package_path):
-            for dir in dirs:
-                subdir_path = os.path.join(root, dir)
-                if os.stat(subdir_path).st_uid != user_id or os.stat(subdir_path).st_gid != int(os.environ['dlu_group']):
-                    os.chown(subdir_path, user_id, int(os.environ['dlu_group']))
-
-    def rename_and_move_files(self, file_list: list[DLUFile], slide_name_map, package_id ):
+        group_id = int(os.environ['dlu_group'])
+        workers = int(os.environ.get("chown_workers", 1))
+        package_stat = os.stat(package_path)
+        changed = 0
+        if package_stat.st_uid != user_id or package_stat.st_gid != group_id:
+            os.chown(package_path, user_id, group_id)
+            changed += 1
+        package_fd = os.open(package_path, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            if workers > 1:
+                with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="chown") as pool:
+                    changed += chown_tree(package_fd, user_id, group_id, pool)
+            else:
+                changed += chown_tree(package_fd, user_id, group_id)
+        finally:
+            os.close(package_fd)
+        logger.info("Changed the owner of " + str(changed) + " entries in " + package_path)
+        return changed
+
+    def rename_and_move_files(self, file_list: list[DLUFile], slide_name_map, package_id, resume: bool = False):
         dluFiles = []
         dest_package_directory = os.path.join(self.dlu_data_directory, self.dlu_package_dir_prefix + package_id)
-        if os.path.exists(dest_package_directory):
+        self.start_journal(package_id, resume)
+        if os.path.exists(dest_package_directory) and not resume:
             shutil.rmtree(dest_package_directory)
         if not os.path.exists(dest_package_directory):
             logger.info("Creating directory " + dest_package_directory)
             os.makedirs(dest_package_directory, exist_ok=True)
 
         source_package_directory = self.globus_data_directory + '/' + self.globus_dir_prefix + package_id
+        self.copied_checksums = {}
+        self.copied_secondary_checksums = {}
+        self.deduplicated_sizes = []
+        self.hash_on_copy = True
+        tasks = []
         for file in file_list:
             dest_file = os.path.join(dest_package_directory, slide_name_map[file.name])
             logger.info("Copying file " + os.path.join(source_package_directory, file.name) + " to "
                         + os.path.join(dest_package_directory, slide_name_map[file.name]))
-            shutil.copy(os.path.join(source_package_directory, file.name),
-                        dest_file)
-            file = DLUFile(name=slide_name_map[file.name], path=dest_package_directory,
-                           checksum=calculate_checksum(dest_file), size=os.path.getsize(dest_file))
+            tasks.append(CopyTask(os.path.join(source_package_directory, file.name), dest_file))
+        self.last_copy_stats = CopyEngine().run(self.skip_completed(tasks), self.copy_file, "package " + package_id)
+        self.log_deduplication(package_id)
+        for task in tasks:
+            file = DLUFile(name=os.path.basename(task.dest_file), path=dest_package_directory,
+                           checksum=self.copied_checksums[os.path.normpath(task.source_file)], size=task.size)
+            file.secondary_checksum = self.copied_secondary_checksums.get(os.path.normpath(task.source_file))
             dluFiles.append(file)
         return dluFiles
 
-    def copy_files(self, package_id: str, file_list: list[DLUFile], preserve_path: bool = False, no_src_package: bool = False):
+    # Used for every file copy. When checksums are wanted the file is hashed as it is copied, unless the
+    # checksum cache already has it, in which case the copy can be done in the kernel.
+    def copy_file(self, source_file: str, dest_file: str):
+        if self.move_strategy != "copy" and self.move_file(source_file, dest_file):
+            if self.hash_on_copy:
+                self.record_checksums(source_file, *calculate_checksums(dest_file))
+            self.record_copy(source_file, dest_file)
+            return dest_file
+        # A hardlinked destination shares its data with another file, so it is replaced rather than overwritten
+        if os.path.lexists(dest_file) and os.lstat(dest_file).st_nlink > 1:
+            os.remove(dest_file)
+        if self.dedup_index is not None and self.link_duplicate(source_file, dest_file):
+            self.record_copy(source_file, dest_file)
+            return dest_file
+        if self.hash_on_copy:
+            secondary_algorithm = get_secondary_algorithm()
+            checksum_cache = get_checksum_cache()
+            cached = checksum_cache.lookup_checksums(source_file) if checksum_cache is not None else None
+            if cached is None or secondary_algorithm and not is_secondary_checksum_for(cached[1], secondary_algorithm):
+                copied_file = copy_and_hash(source_file, dest_file, secondary_algorithm)
+                self.record_checksums(source_file, copied_file.checksum, copied_file.secondary_checksum)
+            else:
+                kernel_copy(source_file, dest_file)
+                self.record_checksums(source_file, *cached)
+        else:
+            kernel_copy(source_file, dest_file)
+        if self.dedup_index is not None:
+            self.dedup_index.add(os.path.getsize(dest_file), self.get_known_checksum(source_file), dest_file)
+        self.record_copy(source_file, dest_file)
+        return dest_file
+
+    def get_known_checksum(self, source_file: str):
+        source_file = os.path.normpath(source_file)
+        return self.copied_checksums.get(source_file) or self.known_checksums.get(source_file)
+
+    # Only files with a possible match by size are hashed (when their checksum isn't already known)
+    def link_duplicate(self, source_file: str, dest_file: str) -> bool:
+        size = os.path.getsize(source_file)
+        if not self.dedup_index.has_size(size):
+            return False
+        checksum = self.get_known_checksum(source_file) or calculate_checksum(source_file)
+        if not self.dedup_index.link_duplicate(source_file, dest_file, size, checksum):
+            return False
+        if self.hash_on_copy:
+            self.record_checksums(source_file, checksum)
+        self.deduplicated_sizes.append(size)
+        return True
+
+    def log_deduplication(self, package_id: str):
+        if self.last_copy_stats is not None:
+            self.last_copy_stats["deduplicated_files"] = len(self.deduplicated_sizes)
+            self.last_copy_stats["deduplicated_bytes"] = sum(self.deduplicated_sizes)
+        if self.deduplicated_sizes:
+            logger.info("Deduplicated " + str(len(self.deduplicated_sizes)) + " files for package " + package_id
+                        + ", saving " + str(sum(self.deduplicated_sizes)) + " bytes")
+
+    def record_checksums(self, source_file: str, checksum: str, secondary_checksum: str = None):
+        self.copied_checksums[os.path.normpath(source_file)] = checksum
+        if secondary_checksum is not None:
+            self.copied_secondary_checksums[os.path.normpath(source_file)] = secondary_checksum
+
+    def record_copy(self, source_file: str, dest_file: str):
+        if self.journal is not None:
+            self.journal.record(source_file, dest_file, self.copied_checksums.get(os.path.normpath(source_file)),
+                                self.copied_secondary_checksums.get(os.path.normpath(source_file)))
+
+    # Hardlinks or renames the file into place. Returns False when that isn't possible so the caller can copy instead.
+    def move_file(self, source_file: str, dest_file: str):
+        try:
+            if self.move_strategy == "link":
+                if os.path.lexists(dest_file):
+                    # Left over from an interrupted run
+                    os.remove(dest_file)
+                os.link(source_file, dest_file)
+            else:
+                os.rename(source_file, dest_file)
+            return True
+        except OSError as error:
+            if error.errno in [errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP, errno.EOPNOTSUPP]:
+                logger.warning("Unable to " + self.move_strategy + " " + source_file + ", copying instead: " + str(error))
+                return False
+            raise
+
+    # Uses the dlu_move_strategy from the environment when the package and the destination are on the same
+    # device, otherwise falls back to copying
+    def choose_move_strategy(self, package_id: str):
+        move_strategy = os.environ.get("dlu_move_strategy", "copy")
+        if move_strategy not in ["copy", "link", "rename"]:
+            logger.warning("Unknown dlu_move_strategy " + move_strategy + ", copying instead")
+            move_strategy = "copy"
+        source_package_directory = self.globus_data_directory + '/' + self.globus_dir_prefix + package_id
+        if move_strategy != "copy" and os.stat(source_package_directory).st_dev != os.stat(self.dlu_data_directory).st_dev:
+            logger.info("Package " + package_id + " is on a different device than " + self.dlu_data_directory + ", copying")
+            move_strategy = "copy"
+        self.move_strategy = move_strategy
+        return move_strategy
+
+    def get_journal_directory(self):
+        return os.environ.get("copy_journal_directory", os.path.join(self.dlu_data_directory, ".copy_journal"))
+
+    # Starts journaling a package's copies. Resuming keeps the entries of the interrupted run, otherwise
+    # the package is copied from scratch.
+    def start_journal(self, package_id: str, resume: bool = False):
+        if not self.journal_copies:
+            self.journal = None
+            return
+        self.journal = CopyJournal(package_id, self.get_journal_directory())
+        if resume:
+            self.journal.load()
+        else:
+            self.journal.reset()
+
+    def clear_journal(self, package_id: str):
+        if self.journal_copies:
+            CopyJournal(package_id, self.get_journal_directory()).clear()
+        self.journal = None
+
+    # Renames done by an interrupted run are put back, so the package can be checked and moved again as a whole
+    def restore_renamed_files(self, package_id: str):
+        if not self.journal_copies:
+            return 0
+        restored = 0
+        for entry in CopyJournal(package_id, self.get_journal_directory()).load().values():
+            if not os.path.lexists(entry["source"]) and os.path.exists(entry["dest"]):
+                os.makedirs(os.path.dirname(entry["source"]), exist_ok=True)
+                os.rename(entry["dest"], entry["source"])
+                restored += 1
+        if restored > 0:
+            logger.info("Restored " + str(restored) + " renamed files for package " + package_id)
+        return restored
+
+    # Drops tasks the journal shows were already copied, keeping the checksums that were recorded for them
+    def skip_completed(self, tasks: list[CopyTask]) -> list[CopyTask]:
+        if self.journal is None or len(self.journal.entries) == 0:
+            return tasks
+        remaining = []
+        for task in tasks:
+            entry = self.journal.completed_entry(task.source_file, task.dest_file)
+            if entry is None:
+                remaining.append(task)
+            elif entry["checksum"] is not None:
+                # Journals written before secondary checksums were recorded don't have one
+                self.record_checksums(task.source_file, entry["checksum"], entry.get("secondary_checksum"))
+        logger.info("Resuming copy with " + str(len(remaining)) + " of " + str(len(tasks)) + " files left to copy")
+        return remaining
+
+    # Adds copy tasks for a file, or for every file under a directory the way copytree would copy it.
+    # Destination directories are created up front so the copies can run in any order.
+    def plan_copy(self, source_file: str, dest_file: str, tasks: list[CopyTask], directories: list[tuple]):
+        if os.path.isdir(source_file):
+            for root, _, file_names in os.walk(source_file, followlinks=True):
+                dest_root = os.path.join(dest_file, os.path.relpath(root, source_file))
+                os.makedirs(dest_root, exist_ok=True)
+                directories.append((root, dest_root))
+                for file_name in file_names:
+                    tasks.append(CopyTask(os.path.join(root, file_name), os.path.join(dest_root, file_name)))
+        else:
+            tasks.append(CopyTask(source_file, dest_file))
+
+    # Sets checksums from the last copy_files call; any other lazy checksums are resolved on the pool
+    def fill_in_checksums(self, file_list: list[DLUFile]):
+        for file in file_list:
+            if file.checksum_pending():
+                source_file = os.path.normpath(file.source_path)
+                if source_file in self.copied_checksums:
+                    file.checksum = self.copied_checksums[source_file]
+                    if file.secondary_checksum is None:
+                        file.secondary_checksum = self.copied_secondary_checksums.get(source_file)
+                elif os.path.isdir(source_file) and is_zarr_store(source_file):
+                    # A copied zarr store's digest can be built from the chunk checksums taken during the copy
+                    zarr_files = list_zarr_files(source_file)
+                    if all(full_path in self.copied_checksums for full_path, _, _ in zarr_files):
+                        file.checksum = assemble_zarr_checksum(zarr_files, self.copied_checksums)
+        return calculate_pending_checksums(file_list)
+
+    def copy_files(self, package_id: str, file_list: list[DLUFile], preserve_path: bool = False, no_src_package: bool = False,
+                   calculate_checksums: bool = True, resume: bool = False):
         files_copied = 0
-        source_wd = os.getcwd()
+        self.copied_checksums = {}
+        self.copied_secondary_checksums = {}
+        self.known_checksums = {}
+        self.deduplicated_sizes = []
+        # Linked files can still be hashed lazily from the source. With rename the source is gone afterwards,
+        # so callers need to resolve their checksums before copying.
+        self.hash_on_copy = calculate_checksums and self.move_strategy == "copy"
+        # Everything to copy is collected first and then run on the copy engine's worker pool
+        tasks = []
+        directories = []
+        planned_dest_files = set()
         dest_package_directory = os.path.join(self.dlu_data_directory, self.dlu_package_dir_prefix + package_id)
-        if os.path.exists(dest_package_directory):
+        self.start_journal(package_id, resume)
+        if os.path.exists(dest_package_directory) and not resume:
             shutil.rmtree(dest_package_directory)
         for file in file_list:
 
@@ -160,22 +749,22 @@ class DLUFileHandler:
               if os.path.isdir(os.path.join(source_package_directory, o))]
             dir = "".join(subdirs)
             if len(os.listdir(source_package_directory)) == 1 and os.path.isdir(source_package_directory) and os.path.isdir(dir):
-                os.chdir(dir)
                 allfiles = os.listdir(dir)
                 for f in allfiles:
                     src_path = os.path.join(dir, f)
                     dst_path = os.path.join(dest_package_directory, f)
                     if not os.path.isdir(dest_package_directory):
                         os.mkdir(dest_package_directory)
-                    if os.path.isfile(f):
+                    if dst_path in planned_dest_files:
+                        logger.warning(dst_path + " already exists. Skipping.")
+                        continue
+                    if os.path.isfile(src_path):
                         logger.info("Copying file " + f + " to " + dst_path)
-                        shutil.copy(src_path, dst_path)
-                        files_copied += 1
                     else:
                         logger.info("Copying directory " + src_path)
-                        files_copied += 1
-                        shutil.copytree(src_path, dst_path)
-                os.chdir(source_wd)
+                    self.plan_copy(src_path, dst_path, tasks, directories)
+                    planned_dest_files.add(dst_path)
+                    files_copied += 1
             
             if not os.path.exists(dest_package_directory):
                 logger.info("Creating directory " + dest_package_directory)
@@ -183,22 +772,133 @@ class DLUFileHandler:
             source_file = os.path.join(source_package_directory, file.get_short_filename())
             dest_file = os.path.join(dest_package_directory, file.get_short_filename())
             
-            if not os.path.exists(dest_file):
+            # When resuming, files already in the destination are checked against the journal instead
+            if (resume or not os.path.exists(dest_file)) and dest_file not in planned_dest_files:
                 if os.path.isdir(source_file):
                     logger.info("Copying directory to " + dest_file)
-                    shutil.copytree(source_file, dest_file)
                 elif os.path.isfile(source_file):
                     logger.info("Copying file to " + dest_file)
-                    shutil.copy(source_file, dest_file)
                 else:
                     source_file = os.path.join(source_package_directory, file.path)
                     logger.info("Copying file to " + dest_file)
-                    shutil.copy(source_file, dest_file)
+                # Checksums still waiting for deferred verification aren't trusted enough to link by
+                if not file.checksum_pending() and file.checksum not in [None, "0"] and file.verification_status is None:
+                    self.known_checksums[os.path.normpath(source_file)] = file.checksum
+                self.plan_copy(source_file, dest_file, tasks, directories)
+                planned_dest_files.add(dest_file)
                 files_copied = files_copied + 1
             else:
                 logger.warning(dest_file + " already exists. Skipping.")
+
+        self.last_copy_stats = CopyEngine().run(self.skip_completed(tasks), self.copy_file, "package " + package_id)
+        self.log_deduplication(package_id)
+        # Directory timestamps are set last, as copytree does, since copying into them changes their mtime
+        for source_directory, dest_directory in reversed(directories):
+            shutil.copystat(source_directory, dest_directory)
         return files_copied
 
+    # Where a package's files are copied from. Like copy_files, a package holding a single top level
+    # directory has that directory's contents copied. A single zarr store is a file, not a wrapper.
+    def get_source_root(self, package_id: str):
+        source_package_directory = self.globus_data_directory + '/' + self.globus_dir_prefix + package_id
+        contents = os.listdir(source_package_directory)
+        if len(contents) == 1:
+            only_entry = os.path.join(source_package_directory, contents[0])
+            if os.path.isdir(only_entry) and not is_zarr_store(contents[0]):
+                return only_entry
+        return source_package_directory
+
+    # A destination file is kept when its size and mtime match the source. When only the mtime differs,
+    # the contents are compared by checksum if checksums are wanted anyway, otherwise the file is copied.
+    # Returns "copy", "same", or "compare" when the checksums have to decide.
+    def compare_files(self, source_file: str, dest_file: str, compare_checksums: bool):
+        try:
+            dest_stat = os.stat(dest_file)
+        except FileNotFoundError:
+            return "copy"
+        source_stat = os.stat(source_file)
+        if source_stat.st_size != dest_stat.st_size:
+            return "copy"
+        if source_stat.st_mtime_ns == dest_stat.st_mtime_ns:
+            return "same"
+        return "compare" if compare_checksums else "copy"
+
+    # rsync-style sync of a package to its destination: only new or changed files are copied and files
+    # that are no longer in the source are deleted. file_list holds the package's files named relative to
+    # get_source_root, as from match_files. Returns the files split the same way insert_dlu_files does.
+    def sync_files(self, package_id: str, file_list: list[DLUFile], calculate_checksums: bool = True) -> dict:
+        self.copied_checksums = {}
+        self.copied_secondary_checksums = {}
+        self.known_checksums = {}
+        self.deduplicated_sizes = []
+        self.hash_on_copy = calculate_checksums and self.move_strategy == "copy"
+        self.journal = None
+        source_root = self.get_source_root(package_id)
+        dest_package_directory = os.path.join(self.dlu_data_directory, self.dlu_package_dir_prefix + package_id)
+        os.makedirs(dest_package_directory, exist_ok=True)
+
+        tasks = []
+        suspects = []
+        changed_files = {}
+        source_files = set()
+        for file in file_list:
+            source_file = os.path.join(source_root, file.name)
+            if os.path.isdir(source_file):
+                physical_files = [full_path for full_path, _, _ in list_zarr_files(source_file)]
+            else:
+                physical_files = [source_file]
+            for physical_file in physical_files:
+                relative_path = os.path.relpath(physical_file, source_root)
+                source_files.add(relative_path)
+                dest_file = os.path.join(dest_package_directory, relative_path)
+                # A destination still linked to its source (or anything else) would follow later writes to it,
+                # e.g. a recalled file edited in Globus changing the DLU copy
+                if self.move_strategy == "copy" and break_hardlink(dest_file):
+                    logger.info("Broke hardlink to " + dest_file)
+                comparison = self.compare_files(physical_file, dest_file, calculate_checksums)
+                if comparison == "copy":
+                    tasks.append(CopyTask(physical_file, dest_file))
+                    changed_files[file.name] = True
+                elif comparison == "compare":
+                    suspects.append((physical_file, dest_file, file.name))
+
+        # Same size but a different mtime: both sides are hashed together on the checksum pool
+        if suspects:
+            checksums = calculate_checksums_for_paths([path for source_file, dest_file, _ in suspects
+                                                       for path in [source_file, dest_file]])
+            for source_file, dest_file, name in suspects:
+                if checksums[source_file] == checksums[dest_file]:
+                    shutil.copystat(source_file, dest_file)
+                    self.copied_checksums[os.path.normpath(source_file)] = checksums[source_file]
+                else:
+                    tasks.append(CopyTask(source_file, dest_file))
+                    changed_files[name] = True
+
+        for task in tasks:
+            os.makedirs(os.path.dirname(task.dest_file), exist_ok=True)
+        self.last_copy_stats = CopyEngine().run(tasks, self.copy_file, "package " + package_id)
+        self.log_deduplication(package_id)
+
+        file_names = set(file.name for file in file_list)
+        deleted_files = [{"dlu_fileName": file.name}
+                         for file in walk_files(dest_package_directory, calculate_checksums=False)
+                         if file.name not in file_names]
+        for root, directories, names in os.walk(dest_package_directory, topdown=False):
+            for name in names:
+                dest_file = os.path.join(root, name)
+                if os.path.relpath(dest_file, dest_package_directory) not in source_files:
+                    logger.info("Deleting " + dest_file)
+                    os.remove(dest_file)
+            relative_root = os.path.relpath(root, dest_package_directory)
+            if root != dest_package_directory and len(os.listdir(root)) == 0 \
+                    and not os.path.isdir(os.path.join(source_root, relative_root)):
+                os.rmdir(root)
+
+        unmodified_files = [file for file in file_list if not changed_files.get(file.name, False)]
+        logger.info("Synced package " + package_id + ": " + str(len(tasks)) + " files copied, "
+                    + str(len(unmodified_files)) + " unchanged, " + str(len(deleted_files)) + " deleted")
+        return {"files": file_list, "unmodified_files": unmodified_files, "deleted_files": deleted_files}
+
     def validate_package_directories(self, package_id: str):
         source_package_directory = self.globus_data_directory + '/' + self.globus_dir_prefix + package_id
         source_directory_info = DirectoryInfo(source_package_directory, False)
@@ -210,53 +910,11 @@ class DLUFileHandler:
             logger.error("Directory for package " + package_id + " failed validation.")
         return success
 
-    def process_globus_directory(self, directory_listing, globus_directories: list[DirectoryInfo], package_id,
-                                 initial_dir, calculate_checksums: bool = True):
-        for dir in globus_directories:
-            prefix = ""
-            if not initial_dir == "":
-                prefix = initial_dir + "/"
-            current_dir = prefix + os.path.basename(dir.directory_path)
-
-            globus_files = []
-            globus_directories = []
-            for item in dir.file_details:
-                if os.path.isdir(item.path):
-                    globus_directories.append(DirectoryInfo(item.path, calculate_checksums=calculate_checksums))
-                else:
-                    globus_files.append(item)
-            directory_listing[current_dir] = globus_files
-            if len(globus_directories) > 0:
-                self.process_globus_directory(directory_listing, globus_directories, package_id, current_dir,
-                                              calculate_checksums)
-        return directory_listing
-
+    # With calculate_checksums on, the returned files have lazy checksums. Use calculate_pending_checksums
+    # or fill_in_checksums to hash them together on the checksum pool.
     def match_files(self, package_id: str, calculate_checksums: bool = True) -> list[DLUFile]:
-        top_level_dir = DirectoryInfo(self.globus_data_directory + '/' + self.globus_dir_prefix + package_id,
-                                      calculate_checksums=calculate_checksums)
-        globus_files = []
-        globus_directories = []
-        for obj in top_level_dir.file_details:
-            if os.path.isdir(obj.path):
-                directory = DirectoryInfo(obj.path, calculate_checksums=calculate_checksums)
-                globus_directories.append(directory)
-            else:
-                globus_files.append(obj)
-        files_in_globus_directories = {}
-        files_in_globus_directories[""] = globus_files
-        current_dir = ""
-        files_in_globus_directories = self.process_globus_directory(files_in_globus_directories, globus_directories,
-                                                                    package_id, current_dir, calculate_checksums)
-        return self.get_globus_file_paths(files_in_globus_directories)
-
-    def get_globus_file_paths(self, files_in_globus_directories: dict[str, list[DLUFile]]) -> list[DLUFile]:
-        fileList = []
-        for dir, files in files_in_globus_directories.items():
-            for file in files:
-                prefix = dir + "/" if dir else ""
-                file.name = prefix + file.name
-                fileList.append(file)
-        return fileList
+        return list(walk_files(self.globus_data_directory + '/' + self.globus_dir_prefix + package_id,
+                               calculate_checksums=calculate_checksums))
 
     def validate_all_wsi_files_present(self, ):
         return True
\ No newline at end of file
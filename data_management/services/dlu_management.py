@@ -6,7 +6,8 @@ import logging
 from services.dlu_filesystem import DLUFileHandler
 from services.dlu_mongo import DLUMongo
 from services.dlu_state import DLUState
-from services.dlu_filesystem import DLUFile
+from services.package_events import send_nudge
+from services.dlu_filesystem import DLUFile, calculate_pending_checksums, VERIFICATION_PENDING
 from typing import List
 import json
 
@@ -114,11 +115,12 @@ class DluManagement:
 
     def insert_dlu_files(self, package_id: str, file_list: List[DLUFile]) -> dict:
         logger.info(f"Inserting files for package {package_id}")
+        calculate_pending_checksums(file_list)
         existing_files = self.get_files_by_package_id(package_id)
         unmodified_files = []
+        rows = []
         if existing_files is not None and len(existing_files) > 0:
-            logger.info(f"Deleting existing files for package {package_id}")
-            self.delete_files_by_package_id(package_id)
+            logger.info(f"Replacing existing files for package {package_id}")
         for file in file_list:
             for existing_file in existing_files:
                 if existing_file["dlu_fileName"] == file.name:
@@ -129,11 +131,32 @@ class DluManagement:
                         unmodified_files.append(file)
                     file.file_id = existing_file["dlu_file_id"]
                     existing_files.remove(existing_file)
-            query_string = self.insert_dlu_file((file.name, package_id, file.file_id, file.size, file.checksum, file.modified_at, json.dumps(file.metadata)))
-            logger.info(query_string)
+            rows.append((file.name, package_id, file.file_id, file.size, file.checksum, file.modified_at,
+                         json.dumps(file.metadata), file.verification_status, file.secondary_checksum))
+        # The old rows are only removed if every new one goes in, otherwise this raises and the package fails
+        inserted = self.db.replace_rows(
+            "DELETE FROM dlu_file WHERE dlu_package_id = %s", (package_id,),
+            "INSERT INTO dlu_file (dlu_fileName, dlu_package_id, dlu_file_id, dlu_filesize, dlu_md5checksum, "
+            "dlu_modified_at, dlu_metadata, dlu_verification_status, dlu_secondary_checksum) "
+            "VALUES(%s, %s, %s, %s, %s, %s, %s, %s, %s)",
+            rows
+        )
+        logger.info(f"Inserted {inserted} of {len(rows)} files for package {package_id}")
 
         return {"files": file_list, "deleted_files": existing_files, "unmodified_files": unmodified_files}
 
+    # Files a sync left untouched are still the ones inserted last time, so their stored checksums are reused
+    def fill_in_unmodified_checksums(self, package_id: str, unmodified_files: List[DLUFile]):
+        existing_files = {}
+        for existing_file in self.get_files_by_package_id(package_id) or []:
+            existing_files[existing_file["dlu_fileName"]] = existing_file
+        for file in unmodified_files:
+            existing_file = existing_files.get(file.name)
+            if file.checksum_pending() and existing_file is not None and existing_file["dlu_md5checksum"]:
+                file.checksum = existing_file["dlu_md5checksum"]
+                file.secondary_checksum = existing_file.get("dlu_secondary_checksum")
+        return unmodified_files
+
     def get_ready_to_move(self, package_id: str):
         package_record = self.db.get_data(
             "SELECT ready_to_move_from_globus FROM data_manager_data_v WHERE dlu_package_id = %s",
@@ -154,9 +177,46 @@ class DluManagement:
             "SELECT * FROM dlu_file"
         )
 
-    def update_md5(self, file_id: str, checksum: str, package_id: str):
-        return self.db.insert_data("UPDATE dlu_file SET dlu_md5checksum = %s WHERE dlu_file_id = %s and dlu_package_id = %s",
-                            (checksum, file_id,package_id))
+    # The secondary checksum is replaced too, since one taken before the md5 changed can't be trusted
+    def update_md5(self, file_id: str, checksum: str, package_id: str, secondary_checksum: str = None):
+        return self.db.insert_data("UPDATE dlu_file SET dlu_md5checksum = %s, dlu_secondary_checksum = %s WHERE dlu_file_id = %s and dlu_package_id = %s",
+                            (checksum, secondary_checksum, file_id, package_id))
+
+    def update_secondary_checksum(self, file_id: str, secondary_checksum: str):
+        return self.db.insert_data("UPDATE dlu_file SET dlu_secondary_checksum = %s WHERE dlu_file_id = %s",
+                                   (secondary_checksum, file_id))
+
+    def update_chunk_manifest(self, file_id: str, manifest: dict):
+        return self.db.insert_data("UPDATE dlu_file SET dlu_chunk_manifest = %s WHERE dlu_file_id = %s",
+                                   (json.dumps(manifest), file_id))
+
+    # Only files with a verified md5, since a manifest is checked against it when it's built
+    def find_files_missing_chunk_manifest(self, min_file_size: int):
+        return self.db.get_data(
+            "SELECT * FROM dlu_file WHERE dlu_chunk_manifest IS NULL AND dlu_filesize >= %s "
+            "AND dlu_md5checksum IS NOT NULL AND (dlu_verification_status IS NULL OR dlu_verification_status = 'verified')",
+            (min_file_size,)
+        )
+
+    def find_files_with_chunk_manifest(self):
+        return self.db.get_data("SELECT * FROM dlu_file WHERE dlu_chunk_manifest IS NOT NULL")
+
+    # Every file whose size and md5 are shared with at least one other file
+    def find_duplicate_files(self, min_file_size: int):
+        return self.db.get_data(
+            "SELECT f.dlu_package_id, f.dlu_fileName, f.dlu_filesize, f.dlu_md5checksum FROM dlu_file f JOIN "
+            "(SELECT dlu_filesize, dlu_md5checksum FROM dlu_file WHERE dlu_filesize >= %s AND dlu_md5checksum IS NOT NULL "
+            "AND dlu_md5checksum != '0' GROUP BY dlu_filesize, dlu_md5checksum HAVING COUNT(*) > 1) d "
+            "ON f.dlu_filesize = d.dlu_filesize AND f.dlu_md5checksum = d.dlu_md5checksum", (min_file_size,)
+        )
+
+    # Files whose md5 is still pending verification or didn't match aren't trusted as link targets
+    def find_dedup_candidates(self, min_file_size: int):
+        return self.db.get_data(
+            "SELECT dlu_package_id, dlu_fileName, dlu_filesize, dlu_md5checksum FROM dlu_file "
+            "WHERE dlu_filesize >= %s AND dlu_md5checksum IS NOT NULL AND dlu_md5checksum != '0' "
+            "AND (dlu_verification_status IS NULL OR dlu_verification_status = 'verified')", (min_file_size,)
+        )
 
     def move_globus_files_to_dlu(self, package_id: str):
         ready_status = self.get_ready_to_move(package_id)
@@ -167,6 +227,8 @@ class DluManagement:
                 response_msg = "Error: directory for package " + package_id + " failed validation."
             else:
                 self.update_dlu_package(package_id, {"ready_to_move_from_globus": "yes"})
+                self.insert_package_event(package_id, "ready_to_move")
+                send_nudge(package_id)
                 response_msg = "Package " + package_id + " successfully marked as ready to move."
         elif ready_status == 'yes':
             response_msg = "Error: package " + package_id + " was already marked as ready to move."
@@ -176,6 +238,11 @@ class DluManagement:
             response_msg = ready_status
         return response_msg
 
+    def insert_package_event(self, package_id: str, event_type: str):
+        self.db.insert_data(
+            "INSERT INTO dlu_package_event (dlu_package_id, event_type) VALUES (%s, %s)", (package_id, event_type)
+        )
+
     def get_redcapid_by_subjectid(self, subject_id: str):
         result = self.db.get_data(
             "select spectrack_redcap_record_id from spectrack_specimen where spectrack_sample_id = %s", (subject_id,)
@@ -218,6 +285,19 @@ class DluManagement:
         else:
             return None
 
+    def set_dlu_file_verification(self, file_id: str, status: str, checksum: str = None):
+        if checksum is None:
+            self.db.insert_data("UPDATE dlu_file SET dlu_verification_status = %s WHERE dlu_file_id = %s", (status, file_id))
+        else:
+            self.db.insert_data("UPDATE dlu_file SET dlu_verification_status = %s, dlu_md5checksum = %s WHERE dlu_file_id = %s",
+                                (status, checksum, file_id))
+
+    def get_files_pending_verification(self):
+        return self.db.get_data(
+            "SELECT dlu_file_id, dlu_package_id, dlu_fileName, dlu_filesize, dlu_md5checksum FROM dlu_file "
+            "WHERE dlu_verification_status = %s", (VERIFICATION_PENDING,)
+        )
+
     def get_files_by_package_id(self, package_id: str):
         return self.db.get_data("SELECT * FROM dlu_file WHERE dlu_package_id = %s", (package_id,))
 
@@ -257,11 +337,13 @@ class DluManagement:
             "update slide_scan_curation set dlu_package_id = %s where redcap_id = %s and dlu_package_id is null and error_message is null",
             (package_id, redcap_id,))
 
-    def insert_into_slide_scan_curation(self, values):
-        query = "INSERT INTO slide_scan_curation (image_id, kit_id, redcap_id, new_file_name, source_file_name, " \
-                "source_folder_name) VALUES (%s, %s, %s, %s, %s, %s)"
-        self.db.insert_data(query, values)
-        return query % values
+    # Rows are (image_id, kit_id, redcap_id, new_file_name, source_file_name, source_folder_name, error_message)
+    def insert_many_into_slide_scan_curation(self, values_list: list) -> int:
+        return self.db.insert_many(
+            "INSERT INTO slide_scan_curation (image_id, kit_id, redcap_id, new_file_name, source_file_name, "
+            "source_folder_name, error_message) VALUES (%s, %s, %s, %s, %s, %s, %s)",
+            values_list
+        )
 
     def get_slide_manifest_import_by_kit(self, kit_id, stain):
         return self.db.get_data("SELECT * FROM slide_manifest_import WHERE outside_acc= %s AND stain = %s "
@@ -56,6 +56,10 @@ class DLUMongo:
             logger.info("Updating " + file.name + " for package " + package_id)
             if len(file.metadata) != 0:
                 file_dict["metadata"] = file.metadata
+            if file.verification_status is not None:
+                file_dict["verificationStatus"] = file.verification_status
+            if file.secondary_checksum is not None:
+                file_dict["secondaryChecksum"] = file.secondary_checksum
             mongo_files.append(file_dict)
         package = self.find_by_package_id(package_id)
         if "modifications" in package:
@@ -64,6 +68,13 @@ class DLUMongo:
         result = self.package_collection.update_one({"_id": package_id}, {"$set": {"files": mongo_files, "modifications": final_modifications}})
         return result.modified_count
 
+    def set_file_verification(self, package_id: str, file_id: str, status: str, checksum: str = None):
+        fields = {"files.$.verificationStatus": status}
+        if checksum is not None:
+            fields["files.$.md5Checksum"] = checksum
+        result = self.package_collection.update_one({"_id": package_id, "files._id": file_id}, {"$set": fields})
+        return result.modified_count
+
     def find_by_package_type_and_redcap_id(self, package_type: str, subject_id: str):
         return self.package_collection.find_one({"subjectId": subject_id, "packageType": package_type})
 
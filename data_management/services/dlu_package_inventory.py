@@ -7,6 +7,11 @@ load_dotenv()
 logger = logging.getLogger("dlu_globus_mover")
 logger.setLevel(logging.INFO)
 
+# How long ago the package was last marked ready to move, which the package scheduler ages packages by. NULL for
+# packages marked ready without an event.
+SECONDS_SINCE_READY = ('(SELECT TIMESTAMPDIFF(SECOND, MAX(e.created_at), NOW()) FROM data_management.dlu_package_event e '
+                       'WHERE e.dlu_package_id = v.dlu_package_id AND e.event_type = "ready_to_move") AS seconds_since_ready')
+
 
 class DLUPackageInventory:
     def __init__(self):
@@ -23,15 +28,21 @@ class DLUPackageInventory:
             (status,)
         )
     
-    def set_dlu_package_waiting(self, status, package_id):
-        return self.db.insert_data(
-            'UPDATE data_management.data_manager_data_v SET globus_dlu_status = "waiting" WHERE ready_to_move_from_globus = %s AND dlu_package_id = %s',
-            (status, package_id,)
-        )
+    # A compare-and-set like claim_package: only a package that hasn't been moved (or was recalled) and that no
+    # watcher holds a live claim on goes to "waiting", so a package another watcher is moving or has just
+    # finished isn't queued again. Returns True if the package was set to waiting.
+    def set_dlu_package_waiting(self, status, package_id, lease_seconds):
+        return self.db.update_data(
+            'UPDATE data_management.dlu_package_inventory dpi JOIN data_management.dmd_data_manager dmd ON dmd.dlu_package_id = dpi.dlu_package_id '
+            'SET dpi.globus_dlu_status = "waiting" WHERE dmd.ready_to_move_from_globus = %s AND dpi.dlu_package_id = %s '
+            'AND (dpi.globus_dlu_status IS NULL OR dpi.globus_dlu_status = "recalled") '
+            'AND (dpi.claim_owner IS NULL OR dpi.claim_heartbeat < NOW(6) - INTERVAL %s SECOND)',
+            (status, package_id, lease_seconds)
+        ) == 1
         
     def get_waiting_packages(self):
         return self.db.get_data(
-            'Select * from data_management.data_manager_data_v where globus_dlu_status = "waiting" and ready_to_move_from_globus = "yes"'
+            'Select v.*, ' + SECONDS_SINCE_READY + ' from data_management.data_manager_data_v v where v.globus_dlu_status = "waiting" and v.ready_to_move_from_globus = "yes"'
         )
     
     def get_ready_packages(self):
@@ -45,7 +56,63 @@ class DLUPackageInventory:
             (package_id,)
         )
 
+    # Packages still being uploaded: not marked ready to move and not already moved into the DLU
+    def get_prehash_candidates(self):
+        return self.db.get_data(
+            'SELECT dlu_package_id FROM data_management.data_manager_data_v '
+            'WHERE (ready_to_move_from_globus IS NULL OR ready_to_move_from_globus != "yes") '
+            'AND (globus_dlu_status IS NULL OR globus_dlu_status != "success")'
+        )
+
     def get_processing_packages(self):
         return self.db.get_data(
-            'SELECT dlu_package_id FROM data_management.data_manager_data_v WHERE globus_dlu_status = "processing"'
-        )
\ No newline at end of file
+            'SELECT * FROM data_management.data_manager_data_v WHERE globus_dlu_status = "processing"'
+        )
+
+    # Claims are a compare-and-set on dlu_package_inventory: a package can be claimed when it is in a state
+    # that can still be moved and nobody else holds a live lease on it. Returns True if this owner got it.
+    def claim_package(self, package_id, owner, lease_seconds):
+        return self.db.update_data(
+            'UPDATE dlu_package_inventory SET claim_owner = %s, claim_heartbeat = NOW(6) WHERE dlu_package_id = %s '
+            'AND (globus_dlu_status IS NULL OR globus_dlu_status IN ("waiting", "recalled", "processing")) '
+            'AND (claim_owner IS NULL OR claim_owner = %s OR claim_heartbeat < NOW(6) - INTERVAL %s SECOND)',
+            (owner, package_id, owner, lease_seconds)
+        ) == 1
+
+    def heartbeat_claims(self, owner):
+        return self.db.update_data(
+            'UPDATE dlu_package_inventory SET claim_heartbeat = NOW(6) WHERE claim_owner = %s',
+            (owner,)
+        )
+
+    def release_package(self, package_id, owner):
+        return self.db.update_data(
+            'UPDATE dlu_package_inventory SET claim_owner = NULL, claim_heartbeat = NULL WHERE dlu_package_id = %s AND claim_owner = %s',
+            (package_id, owner)
+        )
+
+    # Packages left in "processing" by this owner before a restart, or by a watcher whose lease has expired
+    def get_reclaimable_packages(self, owner, lease_seconds):
+        return self.db.get_data(
+            'SELECT v.*, ' + SECONDS_SINCE_READY + ' FROM data_management.data_manager_data_v v JOIN data_management.dlu_package_inventory dpi ON dpi.dlu_package_id = v.dlu_package_id '
+            'WHERE v.globus_dlu_status = "processing" AND (dpi.claim_owner IS NULL OR dpi.claim_owner = %s OR dpi.claim_heartbeat < NOW(6) - INTERVAL %s SECOND)',
+            (owner, lease_seconds)
+        )
+
+    # Watchers only poll for events newer than the latest they have seen, so old ones are only kept for packages
+    # still queued or moving, whose ready_to_move event the scheduler ages them by. Returns the number deleted.
+    def prune_package_events(self, retention_seconds):
+        return self.db.update_data(
+            'DELETE e FROM data_management.dlu_package_event e '
+            'LEFT JOIN data_management.dlu_package_inventory dpi ON dpi.dlu_package_id = e.dlu_package_id '
+            'WHERE e.created_at < NOW() - INTERVAL %s SECOND '
+            'AND (dpi.dlu_package_id IS NULL OR dpi.globus_dlu_status NOT IN ("waiting", "processing", "recalled"))',
+            (retention_seconds,)
+        )
+
+    # Returns None when the event table can't be read
+    def get_latest_package_event_id(self):
+        result = self.db.get_data('SELECT MAX(id) AS max_id FROM data_management.dlu_package_event')
+        if result is None:
+            return None
+        return result[0]["max_id"] or 0
@@ -0,0 +1,81 @@
+import os
+import logging
+import threading
+import time
+from services.dlu_filesystem import calculate_checksums_for_paths, VERIFICATION_VERIFIED, VERIFICATION_MISMATCH
+from services.dlu_management import DluManagement
+
+logger = logging.getLogger("services-FileVerifier")
+logger.setLevel(logging.INFO)
+
+DEFAULT_INTERVAL_SECONDS = 60
+DEFAULT_BATCH_SIZE = 100
+
+
+# Background queue for files registered with deferred verification. Each pending dlu_file is hashed
+# from the DLU once its copy is complete. The result confirms the supplied checksum, fills in a missing
+# one, or flags a mismatch, in both dlu_file and Mongo.
+class FileVerifier:
+
+    def __init__(self, dlu_management=None, dlu_data_directory: str = '/data', interval_seconds: int = None,
+                 batch_size: int = None):
+        if interval_seconds is None:
+            interval_seconds = int(os.environ.get("file_verifier_interval_seconds", DEFAULT_INTERVAL_SECONDS))
+        if batch_size is None:
+            batch_size = int(os.environ.get("file_verifier_batch_size", DEFAULT_BATCH_SIZE))
+        self.dlu_management = dlu_management
+        self.dlu_data_directory = dlu_data_directory
+        self.interval_seconds = interval_seconds
+        self.batch_size = max(1, batch_size)
+
+    def get_file_path(self, file_row: dict):
+        return os.path.join(self.dlu_data_directory, 'package_' + file_row['dlu_package_id'], file_row['dlu_fileName'])
+
+    # Files that aren't in the DLU yet, or are still being copied, are left for a later pass
+    def is_ready(self, file_row: dict, file_path: str):
+        if not os.path.exists(file_path):
+            return False
+        return os.path.isdir(file_path) or os.path.getsize(file_path) == file_row['dlu_filesize']
+
+    def verify_pending(self) -> int:
+        pending_files = self.dlu_management.get_files_pending_verification() or []
+        ready_files = [(file_row, self.get_file_path(file_row)) for file_row in pending_files]
+        ready_files = [(file_row, file_path) for file_row, file_path in ready_files if self.is_ready(file_row, file_path)]
+        for start in range(0, len(ready_files), self.batch_size):
+            batch = ready_files[start:start + self.batch_size]
+            checksums = calculate_checksums_for_paths([file_path for _, file_path in batch])
+            for file_row, file_path in batch:
+                self.record_result(file_row, checksums[file_path])
+        if len(ready_files) > 0:
+            logger.info("Verified " + str(len(ready_files)) + " of " + str(len(pending_files)) + " pending files")
+        return len(ready_files)
+
+    def record_result(self, file_row: dict, checksum: str):
+        expected_checksum = file_row['dlu_md5checksum']
+        if expected_checksum is None or expected_checksum == checksum:
+            status = VERIFICATION_VERIFIED
+            new_checksum = checksum if expected_checksum is None else None
+        else:
+            status = VERIFICATION_MISMATCH
+            new_checksum = None
+            logger.error("Checksum mismatch for " + file_row['dlu_fileName'] + " in package " + file_row['dlu_package_id']
+                         + ": expected " + expected_checksum + ", found " + checksum)
+        self.dlu_management.set_dlu_file_verification(file_row['dlu_file_id'], status, new_checksum)
+        self.dlu_management.dlu_mongo.set_file_verification(file_row['dlu_package_id'], file_row['dlu_file_id'], status,
+                                                            new_checksum)
+        return status
+
+    def run_forever(self):
+        # Created on the verifier's own thread so it has its own connections
+        if self.dlu_management is None:
+            self.dlu_management = DluManagement()
+        while True:
+            try:
+                self.verify_pending()
+            except Exception as error:
+                logger.error("Verification pass failed: " + str(error))
+            time.sleep(self.interval_seconds)
+
+    def start(self):
+        threading.Thread(target=self.run_forever, name="file-verifier", daemon=True).start()
+        return self
@@ -0,0 +1,88 @@
+import os
+import logging
+import subprocess
+import threading
+import time
+
+logger = logging.getLogger("services-IOGovernor")
+logger.setLevel(logging.INFO)
+
+IO_PRIORITY_CLASSES = {"realtime": "1", "best-effort": "2", "idle": "3"}
+
+
+# Refills at rate tokens per second up to capacity. A caller may take more than is available, in which
+# case it sleeps off the debt, so a single large request still works and later callers wait their turn.
+class TokenBucket:
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, amount: float):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+
+# Limits the bytes per second and IO operations per second of everything that shares it. Copies and
+# checksum reads call acquire once per block.
+class IOGovernor:
+
+    def __init__(self, bytes_per_second: int = 0, iops: int = 0):
+        self.bandwidth = TokenBucket(bytes_per_second) if bytes_per_second > 0 else None
+        self.operations = TokenBucket(iops) if iops > 0 else None
+
+    def acquire(self, size: int):
+        if self.operations is not None:
+            self.operations.acquire(1)
+        if self.bandwidth is not None:
+            self.bandwidth.acquire(size)
+
+
+_governor = None
+_governor_lock = threading.Lock()
+
+
+# Returns the shared governor, or None when neither io_max_bytes_per_second nor io_max_iops is set
+def get_io_governor() -> IOGovernor:
+    global _governor
+    bytes_per_second = int(os.environ.get("io_max_bytes_per_second", 0))
+    iops = int(os.environ.get("io_max_iops", 0))
+    if bytes_per_second <= 0 and iops <= 0:
+        return None
+    with _governor_lock:
+        if _governor is None:
+            _governor = IOGovernor(bytes_per_second, iops)
+            logger.info("Limiting IO to " + str(bytes_per_second) + " bytes/s and " + str(iops) + " IOPS")
+        return _governor
+
+
+# Sets the IO scheduling class of this process from io_priority_class (realtime, best-effort or idle) and
+# io_priority_level (0-7). Threads and processes started afterwards inherit it, so call it before the
+# copy and checksum pools start. Only schedulers that support priorities (BFQ, CFQ) act on it.
+def set_io_priority():
+    priority_class = os.environ.get("io_priority_class")
+    if not priority_class:
+        return False
+    if priority_class not in IO_PRIORITY_CLASSES:
+        logger.warning("Unknown io_priority_class " + priority_class)
+        return False
+    command = ["ionice", "-c", IO_PRIORITY_CLASSES[priority_class]]
+    if priority_class != "idle":
+        command += ["-n", os.environ.get("io_priority_level", "4")]
+    command += ["-p", str(os.getpid())]
+    try:
+        subprocess.run(command, check=True, capture_output=True)
+    except (OSError, subprocess.CalledProcessError) as error:
+        logger.warning("Unable to set IO priority: " + str(error))
+        return False
+    logger.info("Set IO priority class to " + priority_class)
+    return True
@@ -0,0 +1,54 @@
+import os
+import logging
+import socket
+import threading
+
+logger = logging.getLogger("services-PackageEvents")
+logger.setLevel(logging.INFO)
+
+
+def parse_address(address: str) -> tuple:
+    host, port = address.rsplit(":", 1)
+    return host, int(port)
+
+
+# Tells the watcher at dlu_watcher_nudge_address (host:port) that a package is ready. It is a single UDP
+# datagram, so a watcher that isn't listening costs nothing; the package_event table is the reliable path.
+def send_nudge(package_id: str):
+    address = os.environ.get("dlu_watcher_nudge_address")
+    if not address:
+        return False
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as nudge_socket:
+            nudge_socket.sendto(package_id.encode(), parse_address(address))
+        return True
+    except (OSError, ValueError) as error:
+        logger.warning("Unable to nudge the watcher at " + address + ": " + str(error))
+        return False
+
+
+# Sets the event whenever a nudge arrives on dlu_watcher_listen_address (host:port)
+class NudgeListener:
+
+    def __init__(self, address: str, event: threading.Event):
+        self.event = event
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(parse_address(address))
+        self.address = self.socket.getsockname()
+
+    def listen(self):
+        while True:
+            try:
+                data, _ = self.socket.recvfrom(1024)
+            except OSError:
+                return
+            logger.info("Nudged for package " + data.decode(errors="replace"))
+            self.event.set()
+
+    def start(self):
+        threading.Thread(target=self.listen, name="nudge-listener", daemon=True).start()
+        logger.info("Listening for package nudges on " + str(self.address))
+        return self
+
+    def close(self):
+        self.socket.close()
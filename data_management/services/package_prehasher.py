@@ -0,0 +1,110 @@
+import os
+import logging
+import threading
+import time
+from services.checksum_cache import get_checksum_cache
+from services.checksum_executor import ChecksumExecutor
+from services.dlu_filesystem import calculate_checksum
+from services.dlu_package_inventory import DLUPackageInventory
+
+logger = logging.getLogger("services-PackagePrehasher")
+logger.setLevel(logging.INFO)
+
+DEFAULT_QUIET_SECONDS = 15 * 60
+DEFAULT_INTERVAL_SECONDS = 5 * 60
+DEFAULT_WORKERS = 1
+DEFAULT_MAX_INFLIGHT_BYTES = 1024 * 1024 * 1024
+
+
+# Returns every file under the directory as (path, size), along with the newest mtime of any file or
+# directory in the tree
+def scan_tree(directory_path: str) -> tuple[list, int]:
+    files = []
+    newest_mtime_ns = os.stat(directory_path).st_mtime_ns
+    directories = [directory_path]
+    while directories:
+        with os.scandir(directories.pop()) as entries:
+            for entry in entries:
+                stat_result = entry.stat(follow_symlinks=False)
+                newest_mtime_ns = max(newest_mtime_ns, stat_result.st_mtime_ns)
+                if entry.is_dir(follow_symlinks=False):
+                    directories.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    files.append((entry.path, stat_result.st_size))
+    return files, newest_mtime_ns
+
+
+# Hashes Globus package directories into the checksum cache while users are still uploading, so the
+# watcher only has to check stat data once a package is marked ready. A package is hashed once nothing in
+# it has changed for prehash_quiet_seconds, and again if it changes after that. Only packages that aren't
+# ready to move or already moved are looked at. Hashing runs on its own small pool (prehash_workers,
+# prehash_max_inflight_bytes) so it never competes with the watcher for checksum workers. Needs
+# checksum_cache_path.
+class PackagePrehasher:
+
+    def __init__(self, globus_data_directory: str = '/globus', quiet_seconds: int = None, interval_seconds: int = None,
+                 package_inventory: DLUPackageInventory = None, globus_dir_prefix: str = '', executor: ChecksumExecutor = None):
+        if quiet_seconds is None:
+            quiet_seconds = int(os.environ.get("prehash_quiet_seconds", DEFAULT_QUIET_SECONDS))
+        if interval_seconds is None:
+            interval_seconds = int(os.environ.get("prehash_interval_seconds", DEFAULT_INTERVAL_SECONDS))
+        self.globus_data_directory = globus_data_directory
+        self.quiet_seconds = quiet_seconds
+        self.interval_seconds = interval_seconds
+        self.globus_dir_prefix = globus_dir_prefix
+        self.package_inventory = package_inventory if package_inventory is not None else DLUPackageInventory()
+        if executor is None:
+            executor = ChecksumExecutor(
+                workers=int(os.environ.get("prehash_workers", DEFAULT_WORKERS)),
+                max_inflight_bytes=int(os.environ.get("prehash_max_inflight_bytes", DEFAULT_MAX_INFLIGHT_BYTES))
+            )
+        self.executor = executor
+        # What each package looked like when it was last hashed, so unchanged packages are skipped
+        self.hashed_packages = {}
+
+    def scan_once(self) -> int:
+        if get_checksum_cache() is None:
+            logger.warning("checksum_cache_path isn't set, so there is nowhere to keep pre-hashed checksums")
+            return 0
+        packages = self.package_inventory.get_prehash_candidates()
+        if packages is None:
+            logger.warning("Unable to look up packages to pre-hash")
+            return 0
+        hashed = 0
+        package_directories = [self.globus_data_directory + '/' + self.globus_dir_prefix + package['dlu_package_id']
+                               for package in packages]
+        for package_directory in package_directories:
+            try:
+                files, newest_mtime_ns = scan_tree(package_directory)
+            except (FileNotFoundError, NotADirectoryError):
+                # Not uploaded yet, or moved or removed while we were looking
+                continue
+            signature = (newest_mtime_ns, len(files), sum(size for _, size in files))
+            if time.time() - newest_mtime_ns / 1e9 < self.quiet_seconds \
+                    or self.hashed_packages.get(package_directory) == signature:
+                continue
+            logger.info("Pre-hashing " + str(len(files)) + " files in " + package_directory)
+            start = time.perf_counter()
+            try:
+                self.executor.map(calculate_checksum, files)
+            except FileNotFoundError:
+                continue
+            self.hashed_packages[package_directory] = signature
+            hashed += 1
+            logger.info(f"Pre-hashed {package_directory} in {time.perf_counter() - start:.1f}s")
+        for package_directory in list(self.hashed_packages):
+            if package_directory not in package_directories:
+                del self.hashed_packages[package_directory]
+        return hashed
+
+    def run_forever(self):
+        while True:
+            try:
+                self.scan_once()
+            except Exception as error:
+                logger.error("Pre-hash pass failed: " + str(error))
+            time.sleep(self.interval_seconds)
+
+    def start(self):
+        threading.Thread(target=self.run_forever, name="prehasher", daemon=True).start()
+        return self
@@ -0,0 +1,97 @@
+import os
+import logging
+import threading
+import time
+from itertools import zip_longest
+from services.dlu_filesystem import get_directory_size
+
+logger = logging.getLogger("services-PackageScheduler")
+logger.setLevel(logging.INFO)
+
+POLICIES = ["fifo", "shortest_first", "fifo_aging", "fair_share"]
+DEFAULT_MAX_WAIT_SECONDS = 6 * 60 * 60
+
+
+# Decides the order queued packages are moved in, using a scandir estimate of each package's size:
+#   fifo            the order the database returned them in
+#   shortest_first  smallest packages first
+#   fifo_aging      smallest first, but anything that has waited longer than package_max_wait_seconds goes
+#                   ahead, oldest first, so big packages aren't starved
+#   fair_share      takes turns between submitting sites (dlu_tis), smallest first within each site
+# Wait time is counted from when the package was marked ready (its seconds_since_ready, from dlu_package_event)
+# until it starts moving, or from when the scheduler first saw it for packages without an event.
+# Sizes are cached per package and only walked again when the package directory's mtime changes.
+class PackageScheduler:
+
+    def __init__(self, policy: str = None, max_wait_seconds: int = None, globus_data_directory: str = '/globus',
+                 globus_dir_prefix: str = ''):
+        if policy is None:
+            policy = os.environ.get("package_schedule_policy", "fifo_aging")
+        if max_wait_seconds is None:
+            max_wait_seconds = int(os.environ.get("package_max_wait_seconds", DEFAULT_MAX_WAIT_SECONDS))
+        if policy not in POLICIES:
+            logger.warning("Unknown package_schedule_policy " + policy + ", using fifo")
+            policy = "fifo"
+        self.policy = policy
+        self.max_wait_seconds = max_wait_seconds
+        self.globus_data_directory = globus_data_directory
+        self.globus_dir_prefix = globus_dir_prefix
+        self.ready_since = {}
+        # package id -> (directory mtime, size)
+        self.sizes = {}
+        self.lock = threading.Lock()
+
+    def estimate_size(self, package: dict) -> int:
+        package_id = package['dlu_package_id']
+        package_directory = self.globus_data_directory + '/' + self.globus_dir_prefix + package_id
+        try:
+            mtime_ns = os.stat(package_directory).st_mtime_ns
+        except FileNotFoundError:
+            return 0
+        with self.lock:
+            cached = self.sizes.get(package_id)
+        if cached is not None and cached[0] == mtime_ns:
+            return cached[1]
+        size = get_directory_size(package_directory)
+        with self.lock:
+            self.sizes[package_id] = (mtime_ns, size)
+        return size
+
+    # Returns (package, estimated size) pairs in the order they should be moved
+    def order(self, packages: list) -> list[tuple]:
+        sizes = [self.estimate_size(package) for package in packages]
+        now = time.time()
+        queue = []
+        with self.lock:
+            package_ids = set()
+            for package, size in zip(packages, sizes):
+                package_ids.add(package['dlu_package_id'])
+                if package.get('seconds_since_ready') is not None:
+                    self.ready_since[package['dlu_package_id']] = now - float(package['seconds_since_ready'])
+                ready_since = self.ready_since.setdefault(package['dlu_package_id'], now)
+                queue.append((package, size, now - ready_since))
+            for package_id in list(self.sizes):
+                if package_id not in package_ids:
+                    del self.sizes[package_id]
+        if self.policy == "shortest_first":
+            queue.sort(key=lambda entry: entry[1])
+        elif self.policy == "fifo_aging":
+            overdue = [entry for entry in queue if entry[2] >= self.max_wait_seconds]
+            overdue.sort(key=lambda entry: entry[2], reverse=True)
+            queue = overdue + sorted([entry for entry in queue if entry[2] < self.max_wait_seconds],
+                                     key=lambda entry: entry[1])
+        elif self.policy == "fair_share":
+            by_site = {}
+            for entry in queue:
+                by_site.setdefault(entry[0].get('dlu_tis'), []).append(entry)
+            site_queues = [sorted(entries, key=lambda entry: entry[1]) for entries in by_site.values()]
+            queue = [entry for turn in zip_longest(*site_queues) for entry in turn if entry is not None]
+        return [(package, size) for package, size, _ in queue]
+
+    def started(self, package_id: str) -> float:
+        with self.lock:
+            ready_since = self.ready_since.pop(package_id, None)
+            self.sizes.pop(package_id, None)
+        wait_seconds = time.time() - ready_since if ready_since is not None else 0.0
+        logger.info(f"Package {package_id} started after waiting {wait_seconds:.0f}s in the queue ({self.policy})")
+        return wait_seconds
@@ -75,6 +75,7 @@ class SlideManagement:
     def process_slide_manifest_imports(self):
         new_records = self.db.get_new_slide_manifest_import_rows()
         redcap_ids_processed = []
+        curation_rows = []
         for record in new_records:
             record_in_error = False
             error_message = ""
@@ -108,15 +109,16 @@ class SlideManagement:
             slide_scan = SlideScanModel(image_id=image_id, redcap_id=redcap_id, kit_id=kit_id,
                                     new_file_name=new_file_name, source_file_name=source_file_name,
                                     source_folder_name=source_folder_name)
-            self.db.insert_into_slide_scan_curation(slide_scan.get_dmd_tuple())
+            curation_rows.append(slide_scan.get_dmd_tuple() + (error_message if record_in_error else None,))
+            if redcap_id not in redcap_ids_processed:
+                redcap_ids_processed.append(redcap_id)
 
+        # Inserted together, then checked once per redcap id now that all of its slides are in
+        self.db.insert_many_into_slide_scan_curation(curation_rows)
+        for redcap_id in redcap_ids_processed:
             check_missing_slides = self.db.get_missing_slides_from_view(redcap_id)
-            redcap_ids_processed.append(redcap_id)
             if all(check_missing_slides):
                 self.db.update_missing_slides(redcap_id)
-
-            if record_in_error:
-                self.db.set_error_message_slide_scan_curation(image_id=image_id, error=error_message)
         logger.info("Processed " + str(len(new_records)) + " new slide_manifest_import records.")
 
         for redcap_id in redcap_ids_processed:
@@ -147,7 +149,9 @@ class SlideManagement:
         else:
             return sample_id + "_" + stain_type + "_" + str(numerator) + "of" + str(denominator) + ".svs"
     
+    # Returns how many redcap ids got a package id
     def fill_in_package_ids(self):
+        updated = 0
         redcap_id_list = self.db.get_redcap_ids_with_null_package_id()
         if len(redcap_id_list) != 0:
             for row in redcap_id_list:
@@ -157,7 +161,9 @@ class SlideManagement:
                     package_id = package_id_list[0]['dlu_package_id']
                     self.db.update_package_ids_in_slide_scan_curation(redcap_id=redcap_id, package_id=package_id)
                     logger.info("Updated package id " + package_id + " for redcap id " + redcap_id)
+                    updated += 1
                 elif len(package_id_list) > 1:
                     error_message = "Multiple dlu_package_ids found for redcap_id " + redcap_id + ", unable to fill in package id."
                     logger.info(error_message)
-                    self.db.set_error_message_slide_scan_curation_redcap_id(error=error_message, redcap_id=redcap_id)
\ No newline at end of file
+                    self.db.set_error_message_slide_scan_curation_redcap_id(error=error_message, redcap_id=redcap_id)
+        return updated
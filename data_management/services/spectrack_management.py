@@ -5,6 +5,18 @@ import logging
 logger = logging.getLogger("services-spectrackManagement")
 logger.setLevel(logging.INFO)
 
+SPECIMEN_INSERT_QUERY = (
+    "INSERT INTO data_management.spectrack_specimen ( "
+    + "spectrack_specimen_id, spectrack_sample_id, "
+    + "spectrack_sample_type_id, spectrack_sample_type, spectrack_derivative_parent, spectrack_redcap_record_id, "
+    + "spectrack_specimen_level,"
+    + "spectrack_specimen_type_sample_type_code, spectrack_specimen_kit_id, spectrack_specimen_kit_type_name, "
+    + "spectrack_specimen_kit_redcap_project_type, spectrack_specimen_kit_collecting_org, spectrack_biopsy_disease_category, "
+    + "spectrack_biopsy_date, spectrack_created_date, spectrack_modified_date) "
+    + "VALUES(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"
+)
+EXISTING_IDS_BATCH_SIZE = 1000
+
 class SpectrackManagement:
     def __init__(self):
         self.spectrack = SpecTrack()
@@ -25,22 +37,44 @@ class SpectrackManagement:
         )[0]["specimen_count"]
         if result == 0:
             logger.info("Inserting into spectrack_specimen for specimen id: " + str(values[0]))
-            self.db.insert_data(
-                "INSERT INTO data_management.spectrack_specimen ( "
-                + "spectrack_specimen_id, spectrack_sample_id, "
-                + "spectrack_sample_type_id, spectrack_sample_type, spectrack_derivative_parent, spectrack_redcap_record_id, "
-                + "spectrack_specimen_level,"
-                + "spectrack_specimen_type_sample_type_code, spectrack_specimen_kit_id, spectrack_specimen_kit_type_name, "
-                + "spectrack_specimen_kit_redcap_project_type, spectrack_specimen_kit_collecting_org, spectrack_biopsy_disease_category, "
-                + "spectrack_biopsy_date, spectrack_created_date, spectrack_modified_date) "
-                + "VALUES(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)",
-                values,
+            self.db.insert_data(SPECIMEN_INSERT_QUERY, values)
+
+    # Returned as strings, so they compare the same whichever type the ids were passed in as. None when a lookup
+    # fails, as get_data does, so callers don't take every specimen for new and insert duplicates.
+    def get_existing_specimen_ids(self, specimen_ids: list) -> set:
+        existing_ids = set()
+        for start in range(0, len(specimen_ids), EXISTING_IDS_BATCH_SIZE):
+            batch = specimen_ids[start:start + EXISTING_IDS_BATCH_SIZE]
+            rows = self.db.get_data(
+                "SELECT spectrack_specimen_id FROM data_management.spectrack_specimen WHERE spectrack_specimen_id IN ("
+                + ", ".join(["%s"] * len(batch)) + ")",
+                tuple(batch),
             )
+            if rows is None:
+                return None
+            existing_ids.update(str(row["spectrack_specimen_id"]) for row in rows)
+        return existing_ids
+
+    # Specimens are collected from every page first, so the ones that aren't in spectrack_specimen yet go in
+    # with batched inserts rather than a lookup and an insert each
+    def insert_spectrack_specimens(self, values_list: list) -> int:
+        new_specimens = {}
+        for values in values_list:
+            new_specimens.setdefault(str(values[0]), values)
+        existing_ids = self.get_existing_specimen_ids([values[0] for values in new_specimens.values()])
+        if existing_ids is None:
+            logger.error("Unable to look up existing specimens, skipping insert of " + str(len(new_specimens)) + " specimens")
+            return 0
+        for specimen_id in existing_ids:
+            new_specimens.pop(specimen_id, None)
+        logger.info("Inserting " + str(len(new_specimens)) + " specimens into spectrack_specimen")
+        return self.db.insert_many(SPECIMEN_INSERT_QUERY, list(new_specimens.values()))
+
     def insert_all_spectrack_specimens(self):
         results = self.spectrack.get_specimens(20)
-        record_count = self.spectrack.get_next_with_callback(
-            results, self.insert_dmd_records_from_spectrack
-        )
+        values_list = []
+        record_count = self.spectrack.get_next_with_callback(results, values_list.append)
+        self.insert_spectrack_specimens(values_list)
         return record_count
 
     def get_spectrack_record(self, specimen_id: int):
@@ -84,15 +118,30 @@ class SpectrackManagement:
     def upsert_dmd_records_from_spectrack(self, values: tuple):
         self.upsert_spectrack_record(values)
 
+    # Existing specimens are updated one at a time, new ones are inserted in batches. A specimen that shows up
+    # more than once keeps its last values, as it would have after an upsert per record.
+    def upsert_spectrack_specimens(self, values_list: list):
+        specimens = {}
+        for values in values_list:
+            specimens[str(values[0])] = values
+        existing_ids = self.get_existing_specimen_ids([values[0] for values in specimens.values()])
+        if existing_ids is None:
+            logger.error("Unable to look up existing specimens, skipping upsert of " + str(len(specimens)) + " specimens")
+            return
+        for specimen_id in existing_ids:
+            if specimen_id in specimens:
+                self.update_spectrack_specimen(specimens.pop(specimen_id))
+        self.db.insert_many(SPECIMEN_INSERT_QUERY, list(specimens.values()))
+
     def upsert_new_spectrack_specimens(self):
         record_count = 0
         max_date = self.get_max_spectrack_date()
         logger.info("Retrieving specimens modified greater than " + max_date.strftime("%Y-%m-%dT%H:%M:%S"))
         results = self.spectrack.get_specimens_modified_greater_than(max_date)
         if len(results) > 0:
-            record_count = self.spectrack.get_next_with_callback(
-                results, self.upsert_dmd_records_from_spectrack
-            )
+            values_list = []
+            record_count = self.spectrack.get_next_with_callback(results, values_list.append)
+            self.upsert_spectrack_specimens(values_list)
         else:
             logger.info("No new Spectrack records found.")
         return record_count
@@ -0,0 +1,5 @@
+-- Per-chunk digests of large files (see services/chunk_manifest.py), so they can be verified in parallel
+-- or by sampling chunks. Built by verify_files.py --build.
+
+ALTER TABLE `dlu_file`
+  ADD COLUMN `dlu_chunk_manifest` json DEFAULT NULL;
@@ -0,0 +1,5 @@
+-- Fast secondary digest kept next to the md5, stored as "algorithm:hexdigest" (e.g. blake2b) so routine
+-- re-verification doesn't have to pay for md5. NULL when no secondary_checksum_algorithm was configured.
+
+ALTER TABLE `dlu_file`
+  ADD COLUMN `dlu_secondary_checksum` varchar(160) DEFAULT NULL;
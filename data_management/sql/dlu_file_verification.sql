@@ -0,0 +1,6 @@
+-- Tracks deferred checksum verification. Files registered with defer_verification start as 'pending' and the
+-- file verifier sets them to 'verified' or 'mismatch'. NULL means the file was hashed before it was registered.
+
+ALTER TABLE `dlu_file`
+  ADD COLUMN `dlu_verification_status` varchar(50) DEFAULT NULL,
+  ADD INDEX `dlu_file_verification_status` (`dlu_verification_status`);
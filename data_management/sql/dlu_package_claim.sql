@@ -0,0 +1,8 @@
+-- Lets several watchers share the package queue. A watcher owns a package while claim_owner is set to its
+-- watcher_id and it keeps claim_heartbeat fresh; after claim_lease_seconds without a heartbeat another
+-- watcher can take the package over.
+
+ALTER TABLE `dlu_package_inventory`
+  ADD COLUMN `claim_owner` varchar(255) DEFAULT NULL,
+  ADD COLUMN `claim_heartbeat` datetime(6) DEFAULT NULL,
+  ADD INDEX `dlu_package_inventory_claim_owner` (`claim_owner`);
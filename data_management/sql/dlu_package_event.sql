@@ -0,0 +1,10 @@
+-- Outbox of package events. The API adds a row when a package is marked ready to move and the watchers
+-- poll for ids above the last one they saw, so new packages are picked up without waiting for the full loop.
+
+CREATE TABLE `dlu_package_event` (
+  `id` bigint(20) NOT NULL AUTO_INCREMENT,
+  `dlu_package_id` varchar(100) NOT NULL,
+  `event_type` varchar(50) NOT NULL,
+  `created_at` datetime NOT NULL DEFAULT current_timestamp(),
+  PRIMARY KEY (`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=latin1 COLLATE=latin1_swedish_ci;
@@ -0,0 +1,160 @@
+import threading
+import unittest
+from unittest.mock import patch, MagicMock
+import mysql.connector
+import lib.mysql_connection as mysql_connection
+from lib.mysql_connection import ConnectionPool, MYSQLConnection
+
+
+class TestConnectionPool(unittest.TestCase):
+
+    def setUp(self):
+        patcher = patch("mysql.connector.connect")
+        self.connect = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.connect.side_effect = lambda **config: MagicMock()
+        mysql_connection._pools.clear()
+        self.addCleanup(mysql_connection._pools.clear)
+
+    def test_connections_are_opened_when_needed_and_reused(self):
+        pool = ConnectionPool("test", 2, 1)
+        self.connect.assert_not_called()
+        connection = pool.checkout()
+        pool.checkin(connection)
+        self.assertIs(pool.checkout(), connection)
+        self.assertEqual(self.connect.call_count, 1)
+
+    def test_checkout_pings_with_reconnect(self):
+        pool = ConnectionPool("test", 1, 1)
+        connection = pool.checkout()
+        pool.checkin(connection)
+        pool.checkout()
+        connection.ping.assert_called_once_with(reconnect=True, attempts=2, delay=1)
+
+    def test_size_is_clamped(self):
+        self.assertEqual(ConnectionPool("test", 100, 1).size, 32)
+
+    def test_checkout_blocks_until_checkin(self):
+        pool = ConnectionPool("test", 1, 5)
+        first = pool.checkout()
+        checked_out = threading.Event()
+
+        def checkout_second():
+            pool.checkin(pool.checkout())
+            checked_out.set()
+
+        threading.Thread(target=checkout_second).start()
+        self.assertFalse(checked_out.wait(0.2))
+        pool.checkin(first)
+        self.assertTrue(checked_out.wait(5))
+
+    def test_checkout_times_out(self):
+        pool = ConnectionPool("test", 1, 0.1)
+        pool.checkout()
+        with self.assertRaises(mysql.connector.errors.PoolError):
+            pool.checkout()
+
+    def test_failed_ping_frees_the_slot(self):
+        pool = ConnectionPool("test", 1, 0.1)
+        connection = pool.checkout()
+        connection.ping.side_effect = Exception()
+        pool.checkin(connection)
+        with self.assertRaises(Exception):
+            pool.checkout()
+        connection.close.assert_called_once()
+        self.assertIsNot(pool.checkout(), connection)
+
+    def test_connections_share_a_pool(self):
+        first = MYSQLConnection()
+        first.get_db_connection()
+        second = MYSQLConnection()
+        second.get_db_connection()
+        self.assertIs(first.pool, second.pool)
+
+    def test_query_returns_connection_to_pool(self):
+        connection = MagicMock()
+        connection.cursor.return_value.__iter__.return_value = iter([{"id": 1}])
+        self.connect.side_effect = [connection]
+        db = MYSQLConnection()
+        db.get_db_connection()
+        self.assertEqual(db.get_data("SELECT 1"), [{"id": 1}])
+        connection.commit.assert_called_once()
+        self.assertIs(db.pool.checkout(), connection)
+
+
+class TestInsertMany(unittest.TestCase):
+
+    def setUp(self):
+        patcher = patch("mysql.connector.connect")
+        self.connect = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.connection = MagicMock()
+        self.connect.return_value = self.connection
+        mysql_connection._pools.clear()
+        self.addCleanup(mysql_connection._pools.clear)
+        self.db = MYSQLConnection()
+        self.db.get_db_connection()
+
+    def test_rows_are_sent_in_batches(self):
+        rows = [(index,) for index in range(5)]
+        self.assertEqual(self.db.insert_many("INSERT INTO t (a) VALUES (%s)", rows, batch_size=2), 5)
+        executemany = self.connection.cursor.return_value.executemany
+        self.assertEqual([call.args[1] for call in executemany.call_args_list], [rows[0:2], rows[2:4], rows[4:5]])
+        self.assertEqual(self.connection.commit.call_count, 3)
+
+    @patch("lib.mysql_connection.requests.post")
+    def test_failed_batch_is_retried_row_by_row(self, post):
+        cursor = self.connection.cursor.return_value
+        cursor.executemany.side_effect = [None, Exception("duplicate"), None]
+
+        def execute(sql, row):
+            if row == (3,):
+                raise Exception("duplicate")
+
+        cursor.execute.side_effect = execute
+        rows = [(index,) for index in range(6)]
+        self.assertEqual(self.db.insert_many("INSERT INTO t (a) VALUES (%s)", rows, batch_size=2), 5)
+        self.assertEqual([call.args[1] for call in cursor.execute.call_args_list], [(2,), (3,)])
+        self.connection.rollback.assert_called()
+        post.assert_called_once()
+        self.assertIn("(3,)", post.call_args.kwargs["data"])
+
+    def test_nothing_to_insert(self):
+        self.assertEqual(self.db.insert_many("INSERT INTO t (a) VALUES (%s)", []), 0)
+        self.connection.cursor.return_value.executemany.assert_not_called()
+
+
+class TestReplaceRows(unittest.TestCase):
+
+    def setUp(self):
+        patcher = patch("mysql.connector.connect")
+        self.connect = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.connection = MagicMock()
+        self.connect.return_value = self.connection
+        mysql_connection._pools.clear()
+        self.addCleanup(mysql_connection._pools.clear)
+        self.db = MYSQLConnection()
+        self.db.get_db_connection()
+
+    def test_delete_and_inserts_commit_together(self):
+        rows = [(index,) for index in range(3)]
+        self.assertEqual(self.db.replace_rows("DELETE FROM t WHERE b = %s", (1,), "INSERT INTO t (a) VALUES (%s)",
+                                              rows, batch_size=2), 3)
+        cursor = self.connection.cursor.return_value
+        cursor.execute.assert_called_once_with("DELETE FROM t WHERE b = %s", (1,))
+        self.assertEqual([call.args[1] for call in cursor.executemany.call_args_list], [rows[0:2], rows[2:3]])
+        self.connection.start_transaction.assert_called_once()
+        self.connection.commit.assert_called_once()
+
+    def test_failed_insert_rolls_back_the_delete(self):
+        self.connection.cursor.return_value.executemany.side_effect = [None, Exception("duplicate")]
+        with self.assertRaises(Exception):
+            self.db.replace_rows("DELETE FROM t WHERE b = %s", (1,), "INSERT INTO t (a) VALUES (%s)",
+                                 [(index,) for index in range(3)], batch_size=2)
+        self.connection.rollback.assert_called_once()
+        self.connection.commit.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from hashlib import md5
+from unittest import mock
+from services.checksum_cache import ChecksumCache
+from services.dlu_filesystem import calculate_checksum, calculate_checksums
+
+
+class TestChecksumCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache_path = os.path.join(self.tmp_dir.name, "checksums.sqlite")
+        self.file_path = os.path.join(self.tmp_dir.name, "file.txt")
+        with open(self.file_path, "wb") as f:
+            f.write(b"original")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_lookup_misses_after_file_changes(self):
+        cache = ChecksumCache(self.cache_path)
+        cache.store(self.file_path, "abc")
+        self.assertEqual("abc", cache.lookup(self.file_path))
+        with open(self.file_path, "wb") as f:
+            f.write(b"changed!!")
+        self.assertIsNone(cache.lookup(self.file_path))
+
+    def test_evicts_least_recently_used(self):
+        cache = ChecksumCache(self.cache_path, max_entries=10)
+        for i in range(20):
+            path = os.path.join(self.tmp_dir.name, str(i))
+            open(path, "w").close()
+            cache.store(path, str(i))
+        cache.evict()
+        count = cache.get_connection().execute("SELECT COUNT(*) FROM checksum_cache").fetchone()[0]
+        self.assertEqual(9, count)
+        self.assertIsNone(cache.lookup(os.path.join(self.tmp_dir.name, "0")))
+        self.assertEqual("19", cache.lookup(os.path.join(self.tmp_dir.name, "19")))
+
+    def test_calculate_checksum_uses_cache(self):
+        with mock.patch.dict(os.environ, {"checksum_cache_path": self.cache_path}):
+            self.assertEqual(md5(b"original").hexdigest(), calculate_checksum(self.file_path))
+            with mock.patch("services.dlu_filesystem.stream_checksums") as stream_checksums:
+                self.assertEqual(md5(b"original").hexdigest(), calculate_checksum(self.file_path))
+                stream_checksums.assert_not_called()
+                stream_checksums.return_value = ("reread", None)
+                self.assertEqual("reread", calculate_checksum(self.file_path, verify=True))
+
+    def test_keeps_secondary_checksum(self):
+        with mock.patch.dict(os.environ, {"checksum_cache_path": self.cache_path,
+                                          "secondary_checksum_algorithm": "blake2b"}):
+            self.assertEqual(md5(b"original").hexdigest(), calculate_checksum(self.file_path))
+            with mock.patch("services.dlu_filesystem.stream_checksums") as stream_checksums:
+                checksum, secondary_checksum = calculate_checksums(self.file_path)
+                stream_checksums.assert_not_called()
+        self.assertEqual(md5(b"original").hexdigest(), checksum)
+        self.assertTrue(secondary_checksum.startswith("blake2b:"))
+
+    def test_adds_secondary_checksum_column(self):
+        connection = sqlite3.connect(self.cache_path)
+        connection.execute("CREATE TABLE checksum_cache (path TEXT PRIMARY KEY, device INTEGER, inode INTEGER, "
+                           "size INTEGER, mtime_ns INTEGER, checksum TEXT, last_used REAL)")
+        connection.close()
+        cache = ChecksumCache(self.cache_path)
+        cache.store(self.file_path, "abc", secondary_checksum="blake2b:def")
+        self.assertEqual(("abc", "blake2b:def"), cache.lookup_checksums(self.file_path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import os
+import tempfile
+import threading
+import unittest
+from hashlib import md5
+from services.checksum_executor import ChecksumExecutor
+from services.dlu_filesystem import calculate_checksum, calculate_checksums_for_paths
+
+
+class TestChecksumExecutor(unittest.TestCase):
+
+    def test_map_returns_checksum_per_path(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            files = []
+            for i in range(5):
+                file_path = os.path.join(tmp_dir, "file_" + str(i))
+                with open(file_path, "wb") as f:
+                    f.write(bytes([i]) * 1000)
+                files.append((file_path, 1000))
+            executor = ChecksumExecutor(workers=3, pool_type="thread", max_inflight_bytes=2000)
+            result = executor.map(calculate_checksum, files)
+            executor.shutdown()
+            for i, (file_path, _) in enumerate(files):
+                self.assertEqual(md5(bytes([i]) * 1000).hexdigest(), result[file_path])
+
+    def test_inflight_bytes_are_bounded(self):
+        executor = ChecksumExecutor(workers=4, pool_type="thread", max_inflight_bytes=100)
+        peak = []
+        lock = threading.Lock()
+
+        def record(_):
+            with lock:
+                peak.append(executor.inflight_bytes)
+            return "ok"
+
+        futures = [executor.submit(record, "f" + str(i), 60) for i in range(6)]
+        for future in futures:
+            future.result()
+        executor.shutdown()
+        self.assertTrue(max(peak) <= 100)
+        self.assertEqual(0, executor.inflight_bytes)
+
+    def test_oversized_file_still_runs(self):
+        executor = ChecksumExecutor(workers=1, pool_type="thread", max_inflight_bytes=10)
+        self.assertEqual("ok", executor.submit(lambda _: "ok", "big", 1000).result())
+        executor.shutdown()
+
+    def test_calculate_checksums_for_paths_empty_file(self):
+        with tempfile.NamedTemporaryFile() as f:
+            result = calculate_checksums_for_paths([f.name])
+            self.assertEqual('d41d8cd98f00b204e9800998ecf8427e', result[f.name])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import hashlib
+import json
+import os
+import tempfile
+import unittest
+from services.chunk_manifest import build_manifest, verify_manifest, choose_chunks, load_manifest
+
+
+class TestChunkManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.file_path = os.path.join(self.tmp_dir.name, "slide.svs")
+        self.data = os.urandom(10 * 1024 + 100)
+        with open(self.file_path, "wb") as f:
+            f.write(self.data)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_build_manifest(self):
+        manifest = build_manifest(self.file_path, chunk_size=1024, algorithm="sha256")
+        self.assertEqual(11, len(manifest["chunks"]))
+        self.assertEqual(hashlib.sha256(self.data[:1024]).hexdigest(), manifest["chunks"][0])
+        self.assertEqual(hashlib.sha256(self.data[10240:]).hexdigest(), manifest["chunks"][10])
+        self.assertEqual(len(self.data), manifest["size"])
+        self.assertEqual(hashlib.md5(self.data).hexdigest(), manifest["md5"])
+        self.assertEqual([], verify_manifest(self.file_path, manifest))
+
+    def test_finds_changed_chunks(self):
+        manifest = build_manifest(self.file_path, chunk_size=1024)
+        with open(self.file_path, "r+b") as f:
+            f.seek(3 * 1024 + 5)
+            f.write(b"x" if self.data[3 * 1024 + 5:3 * 1024 + 6] != b"x" else b"y")
+        os.utime(self.file_path, ns=(manifest["mtimeNs"] + 10 ** 9, manifest["mtimeNs"] + 10 ** 9))
+        # The file's mtime changed, so every chunk is checked even when sampling
+        self.assertEqual([3], verify_manifest(self.file_path, manifest, sample_fraction=0.1))
+
+    def test_samples_unchanged_files(self):
+        manifest = load_manifest(json.dumps(build_manifest(self.file_path, chunk_size=1024)))
+        self.assertEqual(2, len(choose_chunks(self.file_path, manifest, sample_fraction=0.2)))
+        self.assertEqual(1, len(choose_chunks(self.file_path, manifest, sample_fraction=0.01)))
+        self.assertEqual(11, len(choose_chunks(self.file_path, manifest)))
+
+
+if __name__ == '__main__':
+    unittest.main()
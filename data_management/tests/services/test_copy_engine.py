@@ -0,0 +1,45 @@
+import os
+import tempfile
+import unittest
+from services.copy_engine import CopyEngine, CopyTask, kernel_copy
+
+
+class TestCopyEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_file(self, name: str, data: bytes):
+        file_path = os.path.join(self.tmp_dir.name, name)
+        with open(file_path, "wb") as f:
+            f.write(data)
+        return file_path
+
+    def test_kernel_copy_keeps_contents_and_mtime(self):
+        data = os.urandom(300000)
+        source_file = self.write_file("source", data)
+        os.utime(source_file, ns=(1000000000, 1000000000))
+        dest_file = os.path.join(self.tmp_dir.name, "dest")
+        self.assertEqual(len(data), kernel_copy(source_file, dest_file))
+        with open(dest_file, "rb") as f:
+            self.assertEqual(data, f.read())
+        self.assertEqual(1000000000, os.stat(dest_file).st_mtime_ns)
+
+    def test_run_copies_every_task(self):
+        tasks = []
+        for i in range(10):
+            source_file = self.write_file("source_" + str(i), bytes([i]) * (i + 1))
+            tasks.append(CopyTask(source_file, os.path.join(self.tmp_dir.name, "dest_" + str(i))))
+        stats = CopyEngine(workers=3).run(tasks, label="test")
+        self.assertEqual(10, stats["files"])
+        self.assertEqual(55, stats["bytes"])
+        for i in range(10):
+            with open(os.path.join(self.tmp_dir.name, "dest_" + str(i)), "rb") as f:
+                self.assertEqual(bytes([i]) * (i + 1), f.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
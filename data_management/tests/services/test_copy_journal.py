@@ -0,0 +1,51 @@
+import os
+import tempfile
+import unittest
+from services.copy_journal import CopyJournal
+
+
+class TestCopyJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.source_file = os.path.join(self.tmp_dir.name, "source")
+        self.dest_file = os.path.join(self.tmp_dir.name, "dest")
+        for file_path in [self.source_file, self.dest_file]:
+            with open(file_path, "wb") as f:
+                f.write(b"data")
+        self.journal_directory = os.path.join(self.tmp_dir.name, "journal")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_recorded_file_is_complete_after_reload(self):
+        CopyJournal("pkg", self.journal_directory).record(self.source_file, self.dest_file, "abc", "sha256:def")
+        journal = CopyJournal("pkg", self.journal_directory)
+        journal.load()
+        entry = journal.completed_entry(self.source_file, self.dest_file)
+        self.assertEqual(("abc", "sha256:def"), (entry["checksum"], entry["secondary_checksum"]))
+
+    def test_changed_destination_is_not_complete(self):
+        journal = CopyJournal("pkg", self.journal_directory)
+        journal.record(self.source_file, self.dest_file)
+        with open(self.dest_file, "ab") as f:
+            f.write(b"more")
+        self.assertIsNone(journal.completed_entry(self.source_file, self.dest_file))
+
+    def test_torn_last_line_is_ignored(self):
+        journal = CopyJournal("pkg", self.journal_directory)
+        journal.record(self.source_file, self.dest_file)
+        with open(journal.journal_path, "a") as f:
+            f.write('{"source": "/x", "de')
+        self.assertEqual([self.dest_file], list(CopyJournal("pkg", self.journal_directory).load().keys()))
+
+    def test_clear_removes_journal(self):
+        journal = CopyJournal("pkg", self.journal_directory)
+        journal.record(self.source_file, self.dest_file)
+        journal.clear()
+        self.assertFalse(os.path.exists(journal.journal_path))
+        self.assertEqual({}, journal.load())
+
+
+if __name__ == '__main__':
+    unittest.main()
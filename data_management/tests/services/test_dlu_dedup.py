@@ -0,0 +1,78 @@
+import os
+import tempfile
+import unittest
+from hashlib import md5
+from unittest.mock import Mock
+from lib.mysql_connection import MYSQLConnection
+from services.dlu_dedup import DedupIndex
+from services.dlu_filesystem import DLUFileHandler, DirectoryInfo
+from services.dlu_management import DluManagement
+
+
+class TestDluDedup(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.data = os.urandom(4096)
+        self.handler = DLUFileHandler()
+        self.handler.globus_data_directory = os.path.join(self.tmp_dir.name, "globus")
+        self.handler.dlu_data_directory = os.path.join(self.tmp_dir.name, "data")
+        os.makedirs(os.path.join(self.handler.globus_data_directory, "new"))
+        os.makedirs(os.path.join(self.handler.dlu_data_directory, "package_old"))
+        self.existing_file = os.path.join(self.handler.dlu_data_directory, "package_old", "slide.svs")
+        for path in [self.existing_file, os.path.join(self.handler.globus_data_directory, "new", "copy.svs")]:
+            with open(path, "wb") as f:
+                f.write(self.data)
+        self.dlu_management = Mock(DluManagement)
+        self.dlu_management.find_dedup_candidates.return_value = [
+            {"dlu_package_id": "old", "dlu_fileName": "slide.svs", "dlu_filesize": len(self.data),
+             "dlu_md5checksum": md5(self.data).hexdigest()}]
+        self.handler.dedup_index = DedupIndex("hardlink", self.dlu_management, self.handler.dlu_data_directory,
+                                              min_file_size=1)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def copy_new_package(self):
+        file_list = DirectoryInfo(os.path.join(self.handler.globus_data_directory, "new"), calculate_checksums=False).file_details
+        for file in file_list:
+            file.path = self.handler.split_path(file.path)["file_path"]
+        self.handler.copy_files("new", file_list)
+        return os.path.join(self.handler.dlu_data_directory, "package_new", "copy.svs")
+
+    def test_links_duplicate_content(self):
+        dest_file = self.copy_new_package()
+        self.assertTrue(os.path.samefile(self.existing_file, dest_file))
+        self.assertEqual(md5(self.data).hexdigest(), self.handler.copied_checksums[
+            os.path.join(self.handler.globus_data_directory, "new", "copy.svs")])
+        self.assertEqual(len(self.data), self.handler.last_copy_stats["deduplicated_bytes"])
+        self.assertEqual(len(self.data), self.handler.dedup_index.report()["bytes_saved"])
+
+    def test_copies_when_existing_file_changed(self):
+        with open(self.existing_file, "r+b") as f:
+            f.write(b"changed")
+        dest_file = self.copy_new_package()
+        self.assertFalse(os.path.samefile(self.existing_file, dest_file))
+        with open(dest_file, "rb") as f:
+            self.assertEqual(self.data, f.read())
+
+    def test_linked_file_is_replaced_not_overwritten(self):
+        dest_file = self.copy_new_package()
+        source_file = os.path.join(self.handler.globus_data_directory, "new", "copy.svs")
+        with open(source_file, "wb") as f:
+            f.write(b"new content")
+        self.handler.dedup_index = None
+        self.handler.copy_file(source_file, dest_file)
+        with open(self.existing_file, "rb") as f:
+            self.assertEqual(self.data, f.read())
+
+    def test_candidates_exclude_unverified_files(self):
+        dlu_management = DluManagement.__new__(DluManagement)
+        dlu_management.db = Mock(MYSQLConnection)
+        dlu_management.find_dedup_candidates(1)
+        sql = dlu_management.db.get_data.call_args[0][0]
+        self.assertIn("(dlu_verification_status IS NULL OR dlu_verification_status = 'verified')", sql)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,288 @@
+import os
+import tempfile
+import unittest
+from zarr_checksum import compute_zarr_checksum
+from zarr_checksum.generators import yield_files_local
+from unittest import mock
+import hashlib
+from hashlib import md5
+from services.dlu_filesystem import calculate_checksum, stream_checksum, copy_and_hash, DLUFileHandler, \
+    DirectoryInfo, DLUFile, calculate_pending_checksums, walk_files, calculate_checksums_for_paths, get_directory_size, \
+    stream_file, stream_checksums, verify_secondary_checksum
+
+
+class TestDLUFilesystem(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.data = os.urandom(100000)
+        self.file_path = os.path.join(self.tmp_dir.name, "slide.svs")
+        with open(self.file_path, "wb") as f:
+            f.write(self.data)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_stream_checksum_matches_md5(self):
+        self.assertEqual(md5(self.data).hexdigest(), stream_checksum(self.file_path))
+
+    def test_stream_checksum_uneven_read_size(self):
+        self.assertEqual(md5(self.data).hexdigest(), stream_checksum(self.file_path, read_size=4099))
+
+    def test_calculate_checksum(self):
+        self.assertEqual(md5(self.data).hexdigest(), calculate_checksum(self.file_path))
+        self.assertEqual("0", calculate_checksum(self.tmp_dir.name))
+
+    def test_copy_and_hash(self):
+        dest_file = os.path.join(self.tmp_dir.name, "renamed.svs")
+        dlu_file = copy_and_hash(self.file_path, dest_file, "sha256")
+        with open(dest_file, "rb") as f:
+            self.assertEqual(self.data, f.read())
+        self.assertEqual("renamed.svs", dlu_file.name)
+        self.assertEqual(len(self.data), dlu_file.size)
+        self.assertEqual(md5(self.data).hexdigest(), dlu_file.checksum)
+        self.assertEqual("sha256:" + hashlib.sha256(self.data).hexdigest(), dlu_file.secondary_checksum)
+
+    def test_stream_checksums_reads_once(self):
+        with mock.patch("services.dlu_filesystem.stream_file", wraps=stream_file) as wrapped_stream_file:
+            checksum, secondary_checksum = stream_checksums(self.file_path, "blake2b")
+            wrapped_stream_file.assert_called_once()
+        self.assertEqual(md5(self.data).hexdigest(), checksum)
+        self.assertEqual("blake2b:" + hashlib.blake2b(self.data).hexdigest(), secondary_checksum)
+        self.assertTrue(verify_secondary_checksum(self.file_path, secondary_checksum))
+        self.assertFalse(verify_secondary_checksum(self.file_path, "blake2b:0"))
+
+    def test_pending_checksums_include_secondary(self):
+        lazy_file = DLUFile("slide.svs", "", None, len(self.data), source_path=self.file_path)
+        with mock.patch.dict(os.environ, {"secondary_checksum_algorithm": "sha256"}):
+            calculate_pending_checksums([lazy_file])
+        self.assertEqual("sha256:" + hashlib.sha256(self.data).hexdigest(), lazy_file.secondary_checksum)
+
+    def test_copy_files_fills_in_checksums(self):
+        handler = DLUFileHandler()
+        handler.globus_data_directory = os.path.join(self.tmp_dir.name, "globus")
+        handler.dlu_data_directory = os.path.join(self.tmp_dir.name, "data")
+        os.makedirs(os.path.join(handler.globus_data_directory, "pkg", "sub"))
+        os.makedirs(handler.dlu_data_directory)
+        with open(os.path.join(handler.globus_data_directory, "pkg", "a.txt"), "wb") as f:
+            f.write(b"a")
+        with open(os.path.join(handler.globus_data_directory, "pkg", "sub", "b.txt"), "wb") as f:
+            f.write(b"b")
+        file_list = handler.match_files("pkg")
+        self.assertTrue(all(file.checksum_pending() for file in file_list))
+        top_level = DirectoryInfo(os.path.join(handler.globus_data_directory, "pkg"), calculate_checksums=False)
+        for file in top_level.file_details:
+            file.path = handler.split_path(file.path)["file_path"]
+        self.assertEqual(2, handler.copy_files("pkg", top_level.file_details))
+        self.assertEqual(2, len(handler.copied_checksums))
+        with mock.patch("services.dlu_filesystem.calculate_checksums_for_paths") as calculate_checksums_for_paths:
+            handler.fill_in_checksums(file_list)
+            calculate_checksums_for_paths.assert_not_called()
+        checksums = {file.name: file.checksum for file in file_list}
+        self.assertEqual({"a.txt": md5(b"a").hexdigest(), "sub/b.txt": md5(b"b").hexdigest()}, checksums)
+        self.assertTrue(os.path.isfile(os.path.join(handler.dlu_data_directory, "package_pkg", "sub", "b.txt")))
+
+    def test_copy_files_links_on_same_device(self):
+        handler = DLUFileHandler()
+        handler.globus_data_directory = os.path.join(self.tmp_dir.name, "globus")
+        handler.dlu_data_directory = os.path.join(self.tmp_dir.name, "data")
+        handler.globus_dir_prefix = ""
+        os.makedirs(os.path.join(handler.globus_data_directory, "pkg"))
+        os.makedirs(handler.dlu_data_directory)
+        source_file = os.path.join(handler.globus_data_directory, "pkg", "a.txt")
+        with open(source_file, "wb") as f:
+            f.write(b"a")
+        with mock.patch.dict(os.environ, {"dlu_move_strategy": "link"}):
+            self.assertEqual("link", handler.choose_move_strategy("pkg"))
+        file_list = handler.match_files("pkg")
+        top_level = DirectoryInfo(os.path.join(handler.globus_data_directory, "pkg"), calculate_checksums=False)
+        for file in top_level.file_details:
+            file.path = handler.split_path(file.path)["file_path"]
+        self.assertEqual(1, handler.copy_files("pkg", top_level.file_details))
+        dest_file = os.path.join(handler.dlu_data_directory, "package_pkg", "a.txt")
+        self.assertTrue(os.path.samefile(source_file, dest_file))
+        handler.fill_in_checksums(file_list)
+        self.assertEqual(md5(b"a").hexdigest(), file_list[0].checksum)
+
+    def test_move_file_falls_back_to_copy_across_devices(self):
+        handler = DLUFileHandler()
+        handler.move_strategy = "rename"
+        dest_file = os.path.join(self.tmp_dir.name, "moved.svs")
+        with mock.patch("services.dlu_filesystem.os.rename", side_effect=OSError(18, "Invalid cross-device link")):
+            self.assertFalse(handler.move_file(self.file_path, dest_file))
+            handler.copy_file(self.file_path, dest_file)
+        self.assertTrue(os.path.isfile(self.file_path))
+        self.assertEqual(md5(self.data).hexdigest(), calculate_checksum(dest_file))
+
+    @mock.patch.dict(os.environ, {"secondary_checksum_algorithm": "sha256"})
+    def test_copy_files_resumes_from_journal(self):
+        handler = DLUFileHandler()
+        handler.globus_data_directory = os.path.join(self.tmp_dir.name, "globus")
+        handler.dlu_data_directory = os.path.join(self.tmp_dir.name, "data")
+        handler.journal_copies = True
+        os.makedirs(os.path.join(handler.globus_data_directory, "pkg"))
+        os.makedirs(handler.dlu_data_directory)
+        for name in ["a.txt", "b.txt"]:
+            with open(os.path.join(handler.globus_data_directory, "pkg", name), "wb") as f:
+                f.write(name.encode())
+        top_level = DirectoryInfo(os.path.join(handler.globus_data_directory, "pkg"), calculate_checksums=False)
+        for file in top_level.file_details:
+            file.path = handler.split_path(file.path)["file_path"]
+        handler.copy_files("pkg", top_level.file_details)
+        # Simulate a crash that left b.txt half written
+        with open(os.path.join(handler.dlu_data_directory, "package_pkg", "b.txt"), "wb") as f:
+            f.write(b"b")
+        copied = []
+        original_copy_file = handler.copy_file
+        with mock.patch.object(handler, "copy_file",
+                               side_effect=lambda src, dst: copied.append(dst) or original_copy_file(src, dst)):
+            handler.copy_files("pkg", top_level.file_details, resume=True)
+        self.assertEqual([os.path.join(handler.dlu_data_directory, "package_pkg", "b.txt")], copied)
+        self.assertEqual(md5(b"a.txt").hexdigest(),
+                         handler.copied_checksums[os.path.join(handler.globus_data_directory, "pkg", "a.txt")])
+        self.assertEqual("sha256:" + hashlib.sha256(b"a.txt").hexdigest(),
+                         handler.copied_secondary_checksums[os.path.join(handler.globus_data_directory, "pkg", "a.txt")])
+        handler.clear_journal("pkg")
+        self.assertEqual([], os.listdir(handler.get_journal_directory()))
+
+    def test_sync_files_copies_only_changes(self):
+        handler = DLUFileHandler()
+        handler.globus_data_directory = os.path.join(self.tmp_dir.name, "globus")
+        handler.dlu_data_directory = os.path.join(self.tmp_dir.name, "data")
+        source_directory = os.path.join(handler.globus_data_directory, "pkg")
+        os.makedirs(os.path.join(source_directory, "sub"))
+        os.makedirs(os.path.join(source_directory, "image.zarr", "0"))
+        contents = {"a.txt": b"a", "sub/b.txt": b"b", "image.zarr/0/0": b"chunk", "old.txt": b"old"}
+        for name, data in contents.items():
+            with open(os.path.join(source_directory, name), "wb") as f:
+                f.write(data)
+        handler.sync_files("pkg", handler.match_files("pkg"))
+        self.assertEqual(4, handler.last_copy_stats["files"])
+
+        with open(os.path.join(source_directory, "sub", "b.txt"), "wb") as f:
+            f.write(b"changed")
+        os.utime(os.path.join(source_directory, "image.zarr", "0", "0"), ns=(1000000000, 1000000000))
+        os.remove(os.path.join(source_directory, "old.txt"))
+        with open(os.path.join(source_directory, "c.txt"), "wb") as f:
+            f.write(b"c")
+        file_list = handler.match_files("pkg")
+        sync_info = handler.sync_files("pkg", file_list)
+
+        self.assertEqual(2, handler.last_copy_stats["files"])
+        self.assertEqual(["a.txt", "image.zarr"], sorted(file.name for file in sync_info["unmodified_files"]))
+        self.assertEqual([{"dlu_fileName": "old.txt"}], sync_info["deleted_files"])
+        dest_directory = os.path.join(handler.dlu_data_directory, "package_pkg")
+        self.assertFalse(os.path.exists(os.path.join(dest_directory, "old.txt")))
+        with open(os.path.join(dest_directory, "sub", "b.txt"), "rb") as f:
+            self.assertEqual(b"changed", f.read())
+        self.assertEqual(1000000000, os.stat(os.path.join(dest_directory, "image.zarr", "0", "0")).st_mtime_ns)
+        handler.fill_in_checksums(file_list)
+        self.assertEqual(calculate_checksum(os.path.join(source_directory, "image.zarr")),
+                         [file for file in file_list if file.name == "image.zarr"][0].checksum)
+
+    def test_sync_files_breaks_hardlinks(self):
+        handler = DLUFileHandler()
+        handler.globus_data_directory = os.path.join(self.tmp_dir.name, "data")
+        handler.dlu_data_directory = os.path.join(self.tmp_dir.name, "globus")
+        handler.globus_dir_prefix = "package_"
+        handler.dlu_package_dir_prefix = ""
+        source_file = os.path.join(handler.globus_data_directory, "package_pkg", "a.txt")
+        dest_file = os.path.join(handler.dlu_data_directory, "pkg", "a.txt")
+        os.makedirs(os.path.dirname(source_file))
+        os.makedirs(os.path.dirname(dest_file))
+        with open(source_file, "wb") as f:
+            f.write(b"a")
+        os.link(source_file, dest_file)
+        handler.sync_files("pkg", handler.match_files("pkg"), calculate_checksums=False)
+        self.assertFalse(os.path.samefile(source_file, dest_file))
+        self.assertEqual(0, handler.last_copy_stats["files"])
+        with open(dest_file, "wb") as f:
+            f.write(b"edited in globus")
+        with open(source_file, "rb") as f:
+            self.assertEqual(b"a", f.read())
+
+    def test_sync_files_package_with_only_a_zarr_store(self):
+        handler = DLUFileHandler()
+        handler.globus_data_directory = os.path.join(self.tmp_dir.name, "globus")
+        handler.dlu_data_directory = os.path.join(self.tmp_dir.name, "data")
+        source_directory = os.path.join(handler.globus_data_directory, "pkg")
+        os.makedirs(os.path.join(source_directory, "image.zarr", "0"))
+        with open(os.path.join(source_directory, "image.zarr", "0", "0"), "wb") as f:
+            f.write(b"chunk")
+        self.assertEqual(source_directory, handler.get_source_root("pkg"))
+        handler.sync_files("pkg", handler.match_files("pkg"))
+        with open(os.path.join(source_directory, "image.zarr", "0", "0"), "wb") as f:
+            f.write(b"changed")
+        sync_info = handler.sync_files("pkg", handler.match_files("pkg"))
+        self.assertEqual([], sync_info["unmodified_files"])
+        dest_directory = os.path.join(handler.dlu_data_directory, "package_pkg")
+        with open(os.path.join(dest_directory, "image.zarr", "0", "0"), "rb") as f:
+            self.assertEqual(b"changed", f.read())
+        self.assertFalse(os.path.exists(os.path.join(dest_directory, "image.zarr", "image.zarr")))
+
+    @unittest.skipUnless(os.geteuid() == 0, "chown to another owner needs root")
+    def test_chown_dir_changes_whole_tree_once(self):
+        handler = DLUFileHandler()
+        handler.dlu_data_directory = self.tmp_dir.name
+        package_path = os.path.join(self.tmp_dir.name, "package_pkg")
+        os.makedirs(os.path.join(package_path, "sub", "image.zarr", "0"))
+        open(os.path.join(package_path, "sub", "image.zarr", "0", "0"), "w").close()
+        open(os.path.join(package_path, "a.txt"), "w").close()
+        os.symlink("/nonexistent", os.path.join(package_path, "link"))
+        for workers in ["1", "4"]:
+            with mock.patch.dict(os.environ, {"dlu_group": "4321", "chown_workers": workers}):
+                self.assertEqual(7, handler.chown_dir("pkg", 1234 + int(workers)))
+                self.assertEqual(0, handler.chown_dir("pkg", 1234 + int(workers)))
+            self.assertEqual((1234 + int(workers), 4321),
+                             (os.stat(os.path.join(package_path, "sub", "image.zarr", "0", "0")).st_uid,
+                              os.lstat(os.path.join(package_path, "link")).st_gid))
+
+    def test_get_directory_size(self):
+        os.makedirs(os.path.join(self.tmp_dir.name, "sub", "image.zarr"))
+        with open(os.path.join(self.tmp_dir.name, "sub", "image.zarr", "0"), "wb") as f:
+            f.write(b"12345")
+        self.assertEqual(len(self.data) + 5, get_directory_size(self.tmp_dir.name))
+        self.assertEqual(0, get_directory_size(os.path.join(self.tmp_dir.name, "missing")))
+
+    def test_lazy_checksum_is_memoized(self):
+        dlu_file = DLUFile("slide.svs", self.file_path, None, len(self.data), source_path=self.file_path)
+        self.assertTrue(dlu_file.checksum_pending())
+        with mock.patch("services.dlu_filesystem.calculate_checksums", return_value=("abc", None)) as calculate_checksums:
+            self.assertEqual("abc", dlu_file.checksum)
+            self.assertEqual("abc", dlu_file.checksum)
+            calculate_checksums.assert_called_once()
+
+    def test_calculate_pending_checksums(self):
+        lazy_file = DLUFile("slide.svs", "", None, len(self.data), source_path=self.file_path)
+        known_file = DLUFile("other.svs", "", "known", 1)
+        calculate_pending_checksums([lazy_file, known_file])
+        self.assertFalse(lazy_file.checksum_pending())
+        self.assertEqual(md5(self.data).hexdigest(), lazy_file.checksum)
+        self.assertEqual("known", known_file.checksum)
+
+    def test_walk_files_treats_zarr_as_leaf(self):
+        package_dir = os.path.join(self.tmp_dir.name, "pkg")
+        os.makedirs(os.path.join(package_dir, "sub", "image.zarr", "0"))
+        open(os.path.join(package_dir, "top.txt"), "w").close()
+        open(os.path.join(package_dir, "sub", "b.txt"), "w").close()
+        open(os.path.join(package_dir, "sub", "image.zarr", "0", "0"), "w").close()
+        names = sorted(file.name for file in walk_files(package_dir))
+        self.assertEqual(["sub/b.txt", "sub/image.zarr", "top.txt"], names)
+        zarr_file = [file for file in walk_files(package_dir) if file.name == "sub/image.zarr"][0]
+        self.assertNotEqual("0", zarr_file.checksum)
+
+    def test_zarr_checksum_matches_zarr_checksum_library(self):
+        zarr_path = os.path.join(self.tmp_dir.name, "image.zarr")
+        os.makedirs(os.path.join(zarr_path, "0", "1"))
+        with open(os.path.join(zarr_path, ".zattrs"), "w") as f:
+            f.write("{}")
+        with open(os.path.join(zarr_path, "0", "1", "0"), "wb") as f:
+            f.write(os.urandom(5000))
+        open(os.path.join(zarr_path, "0", "empty"), "w").close()
+        expected = compute_zarr_checksum(yield_files_local(zarr_path)).md5
+        self.assertEqual(expected, calculate_checksum(zarr_path))
+        self.assertEqual(expected, calculate_checksums_for_paths([zarr_path, self.file_path])[zarr_path])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import unittest
+from unittest.mock import Mock
+from lib.mysql_connection import MYSQLConnection
+from services.dlu_package_inventory import DLUPackageInventory
+
+
+class TestDLUPackageInventory(unittest.TestCase):
+
+    def get_inventory(self, rowcount: int):
+        inventory = DLUPackageInventory.__new__(DLUPackageInventory)
+        inventory.db = Mock(MYSQLConnection)
+        inventory.db.update_data.return_value = rowcount
+        return inventory
+
+    def test_claim_package_won(self):
+        inventory = self.get_inventory(1)
+        self.assertTrue(inventory.claim_package("pkg", "watcher-a", 600))
+        sql, values = inventory.db.update_data.call_args[0]
+        self.assertIn("claim_heartbeat < NOW(6) - INTERVAL %s SECOND", sql)
+        self.assertEqual(("watcher-a", "pkg", "watcher-a", 600), values)
+
+    def test_claim_package_lost(self):
+        self.assertFalse(self.get_inventory(0).claim_package("pkg", "watcher-b", 600))
+
+    def test_release_package_only_releases_own_claim(self):
+        inventory = self.get_inventory(1)
+        inventory.release_package("pkg", "watcher-a")
+        sql, values = inventory.db.update_data.call_args[0]
+        self.assertIn("claim_owner = %s", sql)
+        self.assertEqual(("pkg", "watcher-a"), values)
+
+    def test_set_waiting_is_compare_and_set(self):
+        inventory = self.get_inventory(1)
+        self.assertTrue(inventory.set_dlu_package_waiting("yes", "pkg", 600))
+        sql, values = inventory.db.update_data.call_args[0]
+        self.assertIn('(dpi.globus_dlu_status IS NULL OR dpi.globus_dlu_status = "recalled")', sql)
+        self.assertIn("dpi.claim_heartbeat < NOW(6) - INTERVAL %s SECOND", sql)
+        self.assertEqual(("yes", "pkg", 600), values)
+
+    def test_set_waiting_skips_claimed_package(self):
+        self.assertFalse(self.get_inventory(0).set_dlu_package_waiting("yes", "pkg", 600))
+
+    def test_prune_package_events_keeps_queued_packages(self):
+        inventory = self.get_inventory(3)
+        self.assertEqual(3, inventory.prune_package_events(86400))
+        sql, values = inventory.db.update_data.call_args[0]
+        self.assertIn("e.created_at < NOW() - INTERVAL %s SECOND", sql)
+        self.assertIn('NOT IN ("waiting", "processing", "recalled")', sql)
+        self.assertEqual((86400,), values)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import os
+import tempfile
+import unittest
+from hashlib import md5
+from unittest import mock
+from unittest.mock import Mock
+from services.checksum_cache import get_checksum_cache
+from services.dlu_filesystem import DLUFile, DLUFileHandler, DirectoryInfo, defer_pending_checksums, \
+    VERIFICATION_PENDING
+from services.dlu_management import DluManagement
+from services.dlu_mongo import DLUMongo
+from services.file_verifier import FileVerifier
+
+
+class TestFileVerifier(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        os.makedirs(os.path.join(self.tmp_dir.name, "package_pkg"))
+        self.file_path = os.path.join(self.tmp_dir.name, "package_pkg", "a.txt")
+        with open(self.file_path, "wb") as f:
+            f.write(b"data")
+        self.dlu_management = Mock(DluManagement)
+        self.dlu_management.dlu_mongo = Mock(DLUMongo)
+        self.verifier = FileVerifier(self.dlu_management, self.tmp_dir.name)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def get_row(self, checksum, size=4):
+        return {"dlu_file_id": "id", "dlu_package_id": "pkg", "dlu_fileName": "a.txt", "dlu_filesize": size,
+                "dlu_md5checksum": checksum}
+
+    def test_fills_in_missing_checksum(self):
+        self.dlu_management.get_files_pending_verification.return_value = [self.get_row(None)]
+        self.assertEqual(1, self.verifier.verify_pending())
+        self.dlu_management.set_dlu_file_verification.assert_called_once_with("id", "verified", md5(b"data").hexdigest())
+        self.dlu_management.dlu_mongo.set_file_verification.assert_called_once_with(
+            "pkg", "id", "verified", md5(b"data").hexdigest())
+
+    def test_flags_mismatch(self):
+        self.dlu_management.get_files_pending_verification.return_value = [self.get_row("not-the-md5")]
+        self.verifier.verify_pending()
+        self.dlu_management.set_dlu_file_verification.assert_called_once_with("id", "mismatch", None)
+
+    def test_waits_for_copy_to_finish(self):
+        self.dlu_management.get_files_pending_verification.return_value = [self.get_row(None, size=100)]
+        self.assertEqual(0, self.verifier.verify_pending())
+        self.dlu_management.set_dlu_file_verification.assert_not_called()
+
+    def test_defer_pending_checksums_does_not_hash(self):
+        supplied = DLUFile("a.txt", self.file_path, "supplied", 4, source_path=self.file_path)
+        unknown = DLUFile("a.txt", self.file_path, None, 4, source_path=self.file_path)
+        defer_pending_checksums([supplied, unknown])
+        self.assertEqual("supplied", supplied.checksum)
+        self.assertIsNone(unknown.checksum)
+        self.assertEqual([VERIFICATION_PENDING] * 2, [supplied.verification_status, unknown.verification_status])
+
+    def test_defer_with_rename_strategy(self):
+        handler = DLUFileHandler()
+        handler.globus_data_directory = os.path.join(self.tmp_dir.name, "globus")
+        handler.dlu_data_directory = os.path.join(self.tmp_dir.name, "data")
+        handler.globus_dir_prefix = ""
+        os.makedirs(os.path.join(handler.globus_data_directory, "pkg"))
+        os.makedirs(handler.dlu_data_directory)
+        for name in ["cached.txt", "unknown.txt"]:
+            with open(os.path.join(handler.globus_data_directory, "pkg", name), "wb") as f:
+                f.write(name.encode())
+        with mock.patch.dict(os.environ, {"dlu_move_strategy": "rename",
+                                          "checksum_cache_path": os.path.join(self.tmp_dir.name, "cache.db")}):
+            get_checksum_cache().store(os.path.join(handler.globus_data_directory, "pkg", "cached.txt"),
+                                       md5(b"cached.txt").hexdigest())
+            self.assertEqual("rename", handler.choose_move_strategy("pkg"))
+            file_list = sorted(handler.match_files("pkg"), key=lambda file: file.name)
+            # Resolved before the rename, as the watcher does
+            defer_pending_checksums(file_list)
+            top_level = DirectoryInfo(os.path.join(handler.globus_data_directory, "pkg"), calculate_checksums=False)
+            for file in top_level.file_details:
+                file.path = handler.split_path(file.path)["file_path"]
+            handler.copy_files("pkg", top_level.file_details, calculate_checksums=False)
+            self.assertEqual([], os.listdir(os.path.join(handler.globus_data_directory, "pkg")))
+            defer_pending_checksums(file_list)
+        self.assertEqual([md5(b"cached.txt").hexdigest(), None], [file.checksum for file in file_list])
+        self.assertEqual([VERIFICATION_PENDING] * 2, [file.verification_status for file in file_list])
+
+    def test_defer_skips_files_whose_source_is_gone(self):
+        gone = DLUFile("gone.txt", self.file_path, None, 4, source_path=os.path.join(self.tmp_dir.name, "gone.txt"))
+        defer_pending_checksums([gone])
+        self.assertIsNone(gone.checksum)
+        self.assertEqual(VERIFICATION_PENDING, gone.verification_status)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import os
+import time
+import unittest
+from unittest import mock
+from services.io_governor import TokenBucket, IOGovernor, get_io_governor, set_io_priority
+
+
+class TestIOGovernor(unittest.TestCase):
+
+    def test_token_bucket_limits_rate(self):
+        bucket = TokenBucket(1000)
+        start = time.monotonic()
+        for _ in range(3):
+            bucket.acquire(100)
+        # The first 1000 tokens are available straight away, the rest come at 1000 a second
+        bucket.acquire(1000)
+        self.assertGreaterEqual(time.monotonic() - start, 0.25)
+
+    def test_unlimited_governor_does_not_wait(self):
+        governor = IOGovernor()
+        start = time.monotonic()
+        for _ in range(1000):
+            governor.acquire(1024 * 1024 * 1024)
+        self.assertLess(time.monotonic() - start, 0.5)
+
+    def test_no_governor_without_limits(self):
+        with mock.patch.dict(os.environ, {"io_max_bytes_per_second": "0", "io_max_iops": "0"}):
+            self.assertIsNone(get_io_governor())
+
+    @mock.patch("services.io_governor.subprocess.run")
+    def test_set_io_priority(self, run):
+        with mock.patch.dict(os.environ, {"io_priority_class": "best-effort", "io_priority_level": "7"}):
+            self.assertTrue(set_io_priority())
+        run.assert_called_once_with(["ionice", "-c", "2", "-n", "7", "-p", str(os.getpid())],
+                                    check=True, capture_output=True)
+        with mock.patch.dict(os.environ, {"io_priority_class": "idle"}):
+            set_io_priority()
+        self.assertEqual(["ionice", "-c", "3", "-p", str(os.getpid())], run.call_args[0][0])
+
+
+if __name__ == '__main__':
+    unittest.main()
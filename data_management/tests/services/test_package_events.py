@@ -0,0 +1,27 @@
+import os
+import threading
+import unittest
+from unittest import mock
+from services.package_events import NudgeListener, send_nudge
+
+
+class TestPackageEvents(unittest.TestCase):
+
+    def test_nudge_sets_event(self):
+        event = threading.Event()
+        listener = NudgeListener("127.0.0.1:0", event).start()
+        try:
+            host, port = listener.address
+            with mock.patch.dict(os.environ, {"dlu_watcher_nudge_address": host + ":" + str(port)}):
+                self.assertTrue(send_nudge("pkg"))
+            self.assertTrue(event.wait(5))
+        finally:
+            listener.close()
+
+    def test_no_nudge_without_address(self):
+        with mock.patch.dict(os.environ, {"dlu_watcher_nudge_address": ""}):
+            self.assertFalse(send_nudge("pkg"))
+
+
+if __name__ == '__main__':
+    unittest.main()
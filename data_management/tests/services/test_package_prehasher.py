@@ -0,0 +1,53 @@
+import os
+import tempfile
+import time
+import unittest
+from hashlib import md5
+from unittest import mock
+from services.checksum_cache import get_checksum_cache
+from services.dlu_package_inventory import DLUPackageInventory
+from services.package_prehasher import PackagePrehasher
+
+
+class TestPackagePrehasher(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.globus_directory = os.path.join(self.tmp_dir.name, "globus")
+        os.makedirs(os.path.join(self.globus_directory, "pkg", "image.zarr", "0"))
+        self.file_path = os.path.join(self.globus_directory, "pkg", "image.zarr", "0", "0")
+        with open(self.file_path, "wb") as f:
+            f.write(b"chunk")
+        self.environ = mock.patch.dict(os.environ, {"checksum_cache_path": os.path.join(self.tmp_dir.name, "cache.sqlite")})
+        self.environ.start()
+        self.inventory = mock.Mock(spec=DLUPackageInventory)
+        self.inventory.get_prehash_candidates.return_value = [{"dlu_package_id": "pkg"}]
+
+    def tearDown(self):
+        self.environ.stop()
+        self.tmp_dir.cleanup()
+
+    def test_hashes_quiet_packages_once(self):
+        prehasher = PackagePrehasher(self.globus_directory, quiet_seconds=0, package_inventory=self.inventory)
+        self.assertEqual(1, prehasher.scan_once())
+        self.assertEqual(md5(b"chunk").hexdigest(), get_checksum_cache().lookup(self.file_path))
+        self.assertEqual(0, prehasher.scan_once())
+
+    def test_skips_packages_still_being_uploaded(self):
+        os.utime(self.file_path, (time.time(), time.time()))
+        self.assertEqual(0, PackagePrehasher(self.globus_directory, quiet_seconds=3600, package_inventory=self.inventory).scan_once())
+
+    def test_only_hashes_packages_not_yet_ready_or_moved(self):
+        self.inventory.get_prehash_candidates.return_value = [{"dlu_package_id": "other"}]
+        prehasher = PackagePrehasher(self.globus_directory, quiet_seconds=0, package_inventory=self.inventory)
+        self.assertEqual(0, prehasher.scan_once())
+        self.assertIsNone(get_checksum_cache().lookup(self.file_path))
+
+    def test_skips_pass_when_lookup_fails(self):
+        self.inventory.get_prehash_candidates.return_value = None
+        prehasher = PackagePrehasher(self.globus_directory, quiet_seconds=0, package_inventory=self.inventory)
+        self.assertEqual(0, prehasher.scan_once())
+
+
+if __name__ == '__main__':
+    unittest.main()
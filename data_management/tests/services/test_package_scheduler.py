@@ -0,0 +1,83 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+from services.package_scheduler import PackageScheduler
+
+SIZES = {"big-a": 1000, "small-a": 10, "small-b": 20, "medium-b": 500}
+
+
+def get_packages():
+    return [{"dlu_package_id": "big-a", "dlu_tis": "A"}, {"dlu_package_id": "small-a", "dlu_tis": "A"},
+            {"dlu_package_id": "medium-b", "dlu_tis": "B"}, {"dlu_package_id": "small-b", "dlu_tis": "B"}]
+
+
+@mock.patch.object(PackageScheduler, "estimate_size", lambda self, package: SIZES[package["dlu_package_id"]])
+class TestPackageScheduler(unittest.TestCase):
+
+    def get_order(self, scheduler: PackageScheduler):
+        return [package["dlu_package_id"] for package, _ in scheduler.order(get_packages())]
+
+    def test_fifo_keeps_order(self):
+        self.assertEqual(["big-a", "small-a", "medium-b", "small-b"], self.get_order(PackageScheduler("fifo")))
+
+    def test_shortest_first(self):
+        self.assertEqual(["small-a", "small-b", "medium-b", "big-a"],
+                         self.get_order(PackageScheduler("shortest_first")))
+
+    def test_fifo_aging_moves_overdue_packages_first(self):
+        scheduler = PackageScheduler("fifo_aging", max_wait_seconds=3600)
+        scheduler.ready_since["big-a"] = 0
+        self.assertEqual(["big-a", "small-a", "small-b", "medium-b"], self.get_order(scheduler))
+
+    def test_fifo_aging_counts_from_when_packages_became_ready(self):
+        scheduler = PackageScheduler("fifo_aging", max_wait_seconds=3600)
+        packages = get_packages()
+        packages[2]["seconds_since_ready"] = 7200
+        packages[0]["seconds_since_ready"] = 4000
+        order = [package["dlu_package_id"] for package, _ in scheduler.order(packages)]
+        # Both overdue on their first pass, the longest waiting first, ahead of the smaller packages
+        self.assertEqual(["medium-b", "big-a", "small-a", "small-b"], order)
+        self.assertGreaterEqual(scheduler.started("medium-b"), 7200)
+
+    def test_fair_share_alternates_sites(self):
+        self.assertEqual(["small-a", "small-b", "big-a", "medium-b"], self.get_order(PackageScheduler("fair_share")))
+
+    def test_started_reports_wait(self):
+        scheduler = PackageScheduler("fifo")
+        scheduler.order(get_packages())
+        self.assertGreaterEqual(scheduler.started("big-a"), 0)
+        self.assertNotIn("big-a", scheduler.ready_since)
+
+
+class TestEstimateSize(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        os.makedirs(os.path.join(self.tmp_dir.name, "package_pkg", "sub"))
+        with open(os.path.join(self.tmp_dir.name, "package_pkg", "sub", "file"), "wb") as f:
+            f.write(b"12345")
+        self.scheduler = PackageScheduler("fifo", globus_data_directory=self.tmp_dir.name, globus_dir_prefix="package_")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_walks_package_once_until_it_changes(self):
+        package = {"dlu_package_id": "pkg"}
+        with mock.patch("services.package_scheduler.get_directory_size", return_value=5) as get_directory_size:
+            self.assertEqual(5, self.scheduler.estimate_size(package))
+            self.assertEqual(5, self.scheduler.estimate_size(package))
+            self.assertEqual(1, get_directory_size.call_count)
+            os.utime(os.path.join(self.tmp_dir.name, "package_pkg"), ns=(0, 0))
+            self.scheduler.estimate_size(package)
+            self.assertEqual(2, get_directory_size.call_count)
+
+    def test_sizes_use_package_directory(self):
+        self.assertEqual([({"dlu_package_id": "pkg"}, 5)], self.scheduler.order([{"dlu_package_id": "pkg"}]))
+        self.assertEqual(0, self.scheduler.estimate_size({"dlu_package_id": "missing"}))
+        self.scheduler.started("pkg")
+        self.assertNotIn("pkg", self.scheduler.sizes)
+
+
+if __name__ == '__main__':
+    unittest.main()
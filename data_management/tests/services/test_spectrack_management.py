@@ -0,0 +1,32 @@
+import unittest
+from unittest.mock import Mock
+from lib.mysql_connection import MYSQLConnection
+from services.spectrack_management import SpectrackManagement
+
+
+def get_values(specimen_id):
+    return (specimen_id,) + (None,) * 15
+
+
+class TestSpectrackManagement(unittest.TestCase):
+
+    def setUp(self):
+        self.spectrack_management = SpectrackManagement.__new__(SpectrackManagement)
+        self.spectrack_management.db = Mock(MYSQLConnection)
+        self.spectrack_management.db.insert_many.side_effect = lambda sql, rows: len(rows)
+
+    def test_inserts_only_new_specimens(self):
+        self.spectrack_management.db.get_data.return_value = [{"spectrack_specimen_id": 1}]
+        self.assertEqual(1, self.spectrack_management.insert_spectrack_specimens([get_values(1), get_values(2), get_values(2)]))
+        self.assertEqual([get_values(2)], self.spectrack_management.db.insert_many.call_args.args[1])
+
+    def test_failed_lookup_inserts_nothing(self):
+        self.spectrack_management.db.get_data.return_value = None
+        self.assertIsNone(self.spectrack_management.get_existing_specimen_ids([1, 2]))
+        self.assertEqual(0, self.spectrack_management.insert_spectrack_specimens([get_values(1), get_values(2)]))
+        self.spectrack_management.upsert_spectrack_specimens([get_values(1)])
+        self.spectrack_management.db.insert_many.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import hashlib
+import os
+import tempfile
+import unittest
+from unittest.mock import Mock
+from services.dlu_management import DluManagement
+from services.dlu_mongo import DLUMongo
+from verify_files import Main
+
+
+class TestBuildManifests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        os.makedirs(os.path.join(self.tmp_dir.name, "package_pkg"))
+        self.data = os.urandom(4096)
+        with open(os.path.join(self.tmp_dir.name, "package_pkg", "slide.svs"), "wb") as f:
+            f.write(self.data)
+        self.main = Main.__new__(Main)
+        self.main.data_lake_directory = self.tmp_dir.name
+        self.main.dlu_management = Mock(DluManagement)
+        self.main.dlu_management.dlu_mongo = Mock(DLUMongo)
+
+    def set_file(self, checksum: str):
+        self.main.dlu_management.find_files_missing_chunk_manifest.return_value = [
+            {"dlu_file_id": "id", "dlu_package_id": "pkg", "dlu_fileName": "slide.svs", "dlu_md5checksum": checksum}]
+
+    def test_stores_manifest_when_md5_matches(self):
+        self.set_file(hashlib.md5(self.data).hexdigest())
+        self.assertEqual(1, self.main.build_manifests())
+        self.main.dlu_management.update_chunk_manifest.assert_called_once()
+        self.main.dlu_management.set_dlu_file_verification.assert_not_called()
+
+    def test_refuses_manifest_when_md5_differs(self):
+        self.set_file(hashlib.md5(b"what was uploaded").hexdigest())
+        self.assertEqual(0, self.main.build_manifests())
+        self.main.dlu_management.update_chunk_manifest.assert_not_called()
+        self.main.dlu_management.set_dlu_file_verification.assert_called_once_with("id", "mismatch")
+        self.main.dlu_management.dlu_mongo.set_file_verification.assert_called_once_with("pkg", "id", "mismatch")
+
+
+if __name__ == '__main__':
+    unittest.main()
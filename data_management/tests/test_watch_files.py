@@ -0,0 +1,126 @@
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from services.package_scheduler import PackageScheduler
+from watch_files import TaskScheduler, DLUWatcher
+
+
+class TestTaskScheduler(unittest.TestCase):
+
+    def test_backs_off_when_no_work(self):
+        scheduler = TaskScheduler(jitter=0)
+        scheduler.add("task", lambda: False, 10, 35)
+        task = scheduler.tasks["task"]
+        for expected_interval in [20, 35, 35]:
+            scheduler.run_task(task)
+            self.assertEqual(expected_interval, task.current_interval)
+        self.assertEqual(3, task.runs)
+
+    def test_reruns_while_work_found(self):
+        results = [True, True, False]
+        scheduler = TaskScheduler(jitter=0)
+        scheduler.add("task", lambda: results.pop(0), 10, 100)
+        task = scheduler.tasks["task"]
+        with mock.patch("watch_files.time.monotonic", return_value=1000.0):
+            scheduler.run_task(task)
+            self.assertEqual(1000.0, task.next_run)
+            scheduler.run_task(task)
+            scheduler.run_task(task)
+            self.assertEqual(1020.0, task.next_run)
+
+    def test_reruns_are_capped(self):
+        scheduler = TaskScheduler(jitter=0, max_reruns=2)
+        scheduler.add("task", lambda: True, 10)
+        task = scheduler.tasks["task"]
+        with mock.patch("watch_files.time.monotonic", return_value=1000.0):
+            for _ in range(3):
+                scheduler.run_task(task)
+        self.assertEqual(1010.0, task.next_run)
+
+    def test_wake_triggers_task(self):
+        scheduler = TaskScheduler(jitter=0)
+        scheduler.add("task", lambda: False, 60, 600)
+        scheduler.tasks["task"].current_interval = 600
+        scheduler.trigger("task")
+        self.assertEqual(60, scheduler.tasks["task"].current_interval)
+
+
+class TestMovePackages(unittest.TestCase):
+
+    def setUp(self):
+        self.watcher = DLUWatcher.__new__(DLUWatcher)
+        self.watcher.package_workers = 2
+        self.watcher.package_executor = ThreadPoolExecutor(max_workers=2)
+        self.addCleanup(self.watcher.package_executor.shutdown)
+        self.watcher.max_inflight_bytes = 0
+        self.watcher.inflight_bytes = 0
+        self.watcher.inflight_packages = {}
+        self.watcher.inflight_lock = threading.Lock()
+        self.watcher.package_event = threading.Event()
+        self.watcher.scheduler = PackageScheduler(policy="fifo")
+        self.watcher.scheduler.estimate_size = lambda package: 1
+        self.release = {}
+        self.addCleanup(lambda: [event.set() for event in self.release.values()])
+
+        def move_package_with_lock(package, resume=False):
+            self.release[package['dlu_package_id']].wait(5)
+            return True
+
+        self.watcher.move_package_with_lock = move_package_with_lock
+
+    def get_packages(self, *package_ids):
+        for package_id in package_ids:
+            self.release.setdefault(package_id, threading.Event())
+        return [{'dlu_package_id': package_id} for package_id in package_ids]
+
+    def test_returns_without_waiting_for_packages(self):
+        self.assertEqual(2, self.watcher.move_packages_to_DLU(self.get_packages("big", "small", "later")))
+        self.assertEqual({"big", "small"}, set(self.watcher.inflight_packages))
+
+    def test_in_flight_packages_are_not_resubmitted(self):
+        self.watcher.move_packages_to_DLU(self.get_packages("big"))
+        self.assertEqual(1, self.watcher.move_packages_to_DLU(self.get_packages("big", "new")))
+        self.assertEqual({"big", "new"}, set(self.watcher.inflight_packages))
+
+    def test_finished_package_frees_worker_and_wakes_loop(self):
+        self.watcher.move_packages_to_DLU(self.get_packages("big", "small"))
+        self.release["small"].set()
+        self.assertTrue(self.watcher.package_event.wait(5))
+        self.assertEqual(1, self.watcher.move_packages_to_DLU(self.get_packages("big", "next")))
+        self.assertEqual({"big", "next"}, set(self.watcher.inflight_packages))
+
+    @mock.patch("watch_files.requests.post")
+    def test_failed_package_alerts_and_frees_worker(self, post):
+        self.watcher.move_package_with_lock = mock.Mock(side_effect=OSError("disk full"))
+        self.watcher.move_packages_to_DLU(self.get_packages("big"))
+        self.watcher.package_executor.shutdown(wait=True)
+        self.assertEqual({}, self.watcher.inflight_packages)
+        self.assertIn("Error: moving package big failed: disk full", post.call_args.kwargs["json"]["text"])
+        self.assertFalse(self.watcher.package_event.is_set())
+
+
+class TestMovePackageWithLock(unittest.TestCase):
+
+    def setUp(self):
+        self.watcher = DLUWatcher.__new__(DLUWatcher)
+        self.watcher.package_locks = {}
+        self.watcher.package_locks_lock = threading.Lock()
+        self.watcher.claim_owner = "watcher"
+        self.watcher.claim_lease_seconds = 600
+        self.watcher.scheduler = PackageScheduler(policy="fifo")
+        self.worker = mock.Mock()
+        self.worker.package_inventory.claim_package.return_value = True
+        self.watcher.get_worker = lambda: self.worker
+
+    def test_failed_move_leaves_processing(self):
+        self.watcher.move_package = mock.Mock(side_effect=OSError("disk full"))
+        with self.assertRaises(OSError):
+            self.watcher.move_package_with_lock({'dlu_package_id': "pkg"})
+        self.worker.dlu_management.update_dlu_package.assert_called_once_with(
+            "pkg", {"globus_dlu_status": "Error: moving package pkg failed: disk full"})
+        self.worker.package_inventory.release_package.assert_called_once_with("pkg", "watcher")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import argparse
+import logging
+import os
+import sys
+from dotenv import load_dotenv
+from services.chunk_manifest import build_manifest, verify_manifest, get_min_file_size, load_manifest
+from services.dlu_filesystem import VERIFICATION_MISMATCH
+from services.dlu_management import DluManagement
+
+logger = logging.getLogger("verify-files")
+logger.setLevel(logging.INFO)
+load_dotenv()
+
+
+class Main:
+    def __init__(self):
+        self.dlu_management = DluManagement()
+        self.data_lake_directory = os.environ["checker_dlu_data_directory"]
+
+    def get_file_path(self, file: dict):
+        full_path = os.path.join(self.data_lake_directory, "package_" + file["dlu_package_id"], file["dlu_fileName"])
+        if not os.path.isfile(full_path):
+            logger.error("file : " + full_path + " not found")
+            return None
+        return full_path
+
+    # Files are handled one at a time. A manifest is only stored when the md5 read alongside the chunks matches
+    # dlu_md5checksum, otherwise the file is flagged as a mismatch, since a manifest of corrupted bytes would
+    # vouch for them from then on.
+    def build_manifests(self, package_id: str = None):
+        files = self.dlu_management.find_files_missing_chunk_manifest(get_min_file_size())
+        built = 0
+        for file in files:
+            if package_id is not None and file["dlu_package_id"] != package_id:
+                continue
+            full_path = self.get_file_path(file)
+            if full_path is None:
+                continue
+            manifest = build_manifest(full_path)
+            if manifest["md5"] != file["dlu_md5checksum"]:
+                logger.error("file uuid: " + file["dlu_file_id"] + " in package: " + file["dlu_package_id"] +
+                             " doesn't match its md5, not building a chunk manifest")
+                self.dlu_management.set_dlu_file_verification(file["dlu_file_id"], VERIFICATION_MISMATCH)
+                self.dlu_management.dlu_mongo.set_file_verification(file["dlu_package_id"], file["dlu_file_id"],
+                                                                    VERIFICATION_MISMATCH)
+                continue
+            self.dlu_management.update_chunk_manifest(file["dlu_file_id"], manifest)
+            built += 1
+            logger.info("Built a " + str(len(manifest["chunks"])) + " chunk manifest for " + full_path)
+        logger.info("Built " + str(built) + " chunk manifests")
+        return built
+
+    # Returns the number of files that failed. sample_fraction below 1 checks that share of each file's
+    # chunks; files changed since their manifest was built are always checked in full.
+    def verify(self, sample_fraction: float = 1.0, package_id: str = None):
+        files = self.dlu_management.find_files_with_chunk_manifest()
+        failed = 0
+        for file in files:
+            if package_id is not None and file["dlu_package_id"] != package_id:
+                continue
+            full_path = self.get_file_path(file)
+            if full_path is None:
+                failed += 1
+                continue
+            mismatched = verify_manifest(full_path, load_manifest(file["dlu_chunk_manifest"]), sample_fraction)
+            if mismatched:
+                failed += 1
+                logger.error("file uuid: " + file["dlu_file_id"] + " in package: " + file["dlu_package_id"] +
+                             " failed verification in chunks " + ", ".join(str(index) for index in mismatched))
+        logger.info("Verified " + str(len(files)) + " files, " + str(failed) + " failed")
+        return failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-b",
+                        "--build",
+                        required=False,
+                        action='store_true',
+                        help="Build chunk manifests for large files that don't have one yet")
+    parser.add_argument("-s",
+                        "--sample",
+                        required=False,
+                        type=float,
+                        default=1.0,
+                        help="Fraction of each file's chunks to check, e.g. 0.05. Defaults to every chunk.")
+    parser.add_argument("-p",
+                        "--package_id",
+                        required=False,
+                        default=None,
+                        help="Only handle files in this package")
+    args = parser.parse_args()
+    main = Main()
+    if args.build:
+        main.build_manifests(args.package_id)
+    else:
+        sys.exit(1 if main.verify(args.sample, args.package_id) > 0 else 0)
@@ -1,35 +1,164 @@
 from lib.mongo_connection import MongoConnection
-from services.dlu_filesystem import DLUFileHandler, DirectoryInfo, DLUFile
+from lib.mysql_connection import slack_url
+from services.dlu_filesystem import DLUFileHandler, DirectoryInfo, DLUFile, calculate_pending_checksums, \
+    defer_pending_checksums
 from services.dlu_package_inventory import DLUPackageInventory
 from services.dlu_state import DLUState, PackageState
 from services.dlu_management import DluManagement
 from model.dlu_package import DLUPackage
 from services.dlu_mongo import DLUMongo
 from services.slide_management import SlideManagement
+from services.io_governor import set_io_priority
+from services.package_scheduler import PackageScheduler
+from services.package_events import NudgeListener
+from services.package_prehasher import PackagePrehasher
+from services.file_verifier import FileVerifier
+from services.dlu_dedup import get_dedup_index
 
 from dotenv import load_dotenv
 import logging
+import random
+import socket
+import threading
 import time
 import os
+import requests
+from concurrent.futures import ThreadPoolExecutor
 
 logger = logging.getLogger("services-dlu_package_watcher")
 logger.setLevel(logging.INFO)
 load_dotenv()
 
 
+class ScheduledTask:
+
+    def __init__(self, name: str, function, interval: float, max_interval: float):
+        self.name = name
+        self.function = function
+        self.interval = interval
+        self.max_interval = max(interval, max_interval)
+        self.current_interval = interval
+        self.next_run = 0.0
+        self.reruns = 0
+        self.runs = 0
+        self.total_seconds = 0.0
+
+
+# Runs the watcher's tasks on their own intervals. A task returns True when it found work: it is run again
+# straight away, in case more came in meanwhile, up to max_reruns times in a row. A task that finds nothing
+# waits twice as long before the next try, up to its max_interval. Intervals get +/- jitter so several
+# watchers don't query in lockstep. wait(timeout) is called between runs; when it returns True the wake
+# task is run early.
+class TaskScheduler:
+
+    def __init__(self, wait=None, wake_task: str = None, jitter: float = 0.1, max_reruns: int = 5):
+        self.tasks = {}
+        self.wait = wait
+        self.wake_task = wake_task
+        self.jitter = jitter
+        self.max_reruns = max_reruns
+
+    def add(self, name: str, function, interval: float, max_interval: float = None):
+        self.tasks[name] = ScheduledTask(name, function, interval, max_interval or interval)
+
+    def trigger(self, name: str):
+        task = self.tasks[name]
+        task.current_interval = task.interval
+        task.next_run = time.monotonic()
+
+    def run_task(self, task: ScheduledTask):
+        start = time.monotonic()
+        found_work = task.function()
+        elapsed = time.monotonic() - start
+        task.runs += 1
+        task.total_seconds += elapsed
+        if found_work and task.reruns < self.max_reruns:
+            task.reruns += 1
+            task.current_interval = task.interval
+            delay = 0.0
+        else:
+            task.reruns = 0
+            if not found_work:
+                task.current_interval = min(task.max_interval, task.current_interval * 2)
+            delay = task.current_interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+        task.next_run = time.monotonic() + delay
+        logger.info(f"Task {task.name} took {elapsed:.1f}s (found work: {bool(found_work)}), next run in {delay:.0f}s; "
+                    f"{task.runs} runs, {task.total_seconds:.1f}s in total")
+
+    def run_pending(self):
+        now = time.monotonic()
+        for task in sorted(self.tasks.values(), key=lambda task: task.next_run):
+            if task.next_run <= now:
+                self.run_task(task)
+
+    def run_forever(self):
+        while True:
+            self.run_pending()
+            timeout = max(0.0, min(task.next_run for task in self.tasks.values()) - time.monotonic())
+            if self.wait is None:
+                time.sleep(timeout)
+            elif self.wait(timeout) and self.wake_task is not None:
+                self.trigger(self.wake_task)
+
+
 class DLUWatcher:   
     def __init__ (self, db: DLUPackageInventory = None):
         if db:
             self.db = db
         else:
             self.db = DLUPackageInventory()
-        self.mongo_connection = MongoConnection().get_mongo_connection()
-        self.dlu_mongo = DLUMongo(self.mongo_connection)
-        self.dlu_management = DluManagement()
-        self.dlu_file_handler = DLUFileHandler()
+        # Each package worker thread gets its own database connections and file handler, see get_worker
+        self.worker = threading.local()
+        self.package_workers = max(1, int(os.environ.get("package_workers", 1)))
+        self.package_executor = ThreadPoolExecutor(max_workers=self.package_workers, thread_name_prefix="package")
+        self.max_inflight_bytes = int(os.environ.get("package_max_inflight_bytes", 0))
+        self.inflight_bytes = 0
+        # Package ids handed to the executor and not finished yet, with the bytes reserved for each
+        self.inflight_packages = {}
+        self.inflight_lock = threading.Lock()
+        self.package_locks = {}
+        self.package_locks_lock = threading.Lock()
+        # Packages are claimed in the database under this id, so several watchers can share the queue
+        self.claim_owner = os.environ.get("watcher_id", socket.gethostname())
+        self.claim_lease_seconds = int(os.environ.get("claim_lease_seconds", 600))
+        file_handler = DLUFileHandler()
+        self.scheduler = PackageScheduler(globus_data_directory=file_handler.globus_data_directory,
+                                          globus_dir_prefix=file_handler.globus_dir_prefix)
+        self.defer_verification = os.environ.get("defer_verification", "false").lower() in ["true", "1", "yes"]
+        # Set by the nudge listener; the dlu_package_event table is polled as well for watchers on other hosts
+        self.package_event = threading.Event()
+        self.last_package_event_id = None
+        self.package_event_poll_seconds = float(os.environ.get("package_event_poll_seconds", 5))
+        self.package_event_retention_seconds = int(os.environ.get("package_event_retention_seconds", 24 * 60 * 60))
         self.dluPackage = DLUPackage()
-        self.dlu_state = DLUState()
         self.slide_management = SlideManagement(self.dlu_management)
+
+    def get_worker(self):
+        if not hasattr(self.worker, "dlu_management"):
+            self.worker.dlu_mongo = DLUMongo(MongoConnection().get_mongo_connection())
+            self.worker.dlu_management = DluManagement()
+            self.worker.dlu_file_handler = DLUFileHandler()
+            self.worker.dlu_file_handler.journal_copies = True
+            self.worker.dlu_file_handler.dedup_index = get_dedup_index()
+            self.worker.dlu_state = DLUState()
+            self.worker.package_inventory = DLUPackageInventory()
+        return self.worker
+
+    @property
+    def dlu_mongo(self) -> DLUMongo:
+        return self.get_worker().dlu_mongo
+
+    @property
+    def dlu_management(self) -> DluManagement:
+        return self.get_worker().dlu_management
+
+    @property
+    def dlu_file_handler(self) -> DLUFileHandler:
+        return self.get_worker().dlu_file_handler
+
+    @property
+    def dlu_state(self) -> DLUState:
+        return self.get_worker().dlu_state
     
     def watch_for_packages(self):
         packages = self.db.get_dlu_package("yes")
@@ -39,14 +168,18 @@ class DLUWatcher:
             )
         else:
             self.update_packages_for_globus(packages)
-            self.move_packages_to_DLU(packages)
+        # Waiting packages include the ones earlier passes had no free worker for
+        submitted = self.pickup_waiting_packages()
+        return len(packages) > 0 or submitted > 0
     
     def watch_for_side_manifest_records(self):
         equal_num_rows = self.dlu_management.get_equal_num_rows()
         if equal_num_rows == 1:
             logger.info("No new records found in slide_manifest_import")
+            return False
         else:
             self.update_slide_scan_curation()
+            return True
     
     def update_slide_scan_curation(self):
         logger.info("Importing new row(s) into slide_scan_curation")
@@ -55,7 +188,8 @@ class DLUWatcher:
     def update_packages_for_globus(self, packages):
         for index, package_result in enumerate(packages):
             logger.info("Setting file status to 'waiting' on package " + package_result['dlu_package_id'])
-            self.db.set_dlu_package_waiting("yes", package_result['dlu_package_id'])
+            if not self.db.set_dlu_package_waiting("yes", package_result['dlu_package_id'], self.claim_lease_seconds):
+                logger.info("Package " + package_result['dlu_package_id'] + " was picked up by another watcher. Skipping.")
 
     def process_file_paths(self, file_list: list[DLUFile]) -> list:
         dlu_files = []
@@ -67,61 +201,213 @@ class DLUWatcher:
     def pickup_waiting_packages(self):
         packages_in_waiting = self.db.get_waiting_packages()
         if len(packages_in_waiting) == 0:
-            return  logger.info(
+            logger.info(
                 "No records were found with status 'waiting'"
             )
+            return 0
         else:
-            self.move_packages_to_DLU(packages_in_waiting)
+            return self.move_packages_to_DLU(packages_in_waiting)
 
-    def move_packages_to_DLU(self, packages):
-        file_list = None
+    # Packages left in "processing" were interrupted by a restart of this watcher, or belong to a watcher whose
+    # claim has expired. They pick up from their copy journal.
+    def pickup_processing_packages(self):
+        packages_in_processing = self.db.get_reclaimable_packages(self.claim_owner, self.claim_lease_seconds)
+        if len(packages_in_processing) == 0:
+            logger.info(
+                "No records were found with status 'processing'"
+            )
+            return False
+        else:
+            return self.move_packages_to_DLU(packages_in_processing, resume=True) > 0
 
-        for _, package in enumerate(packages):
-            skip_copy = False
+    # Packages are moved on the watcher's pool of package_workers threads without waiting for them, so the
+    # other tasks keep running and a package that becomes ready meanwhile starts as soon as a worker is free.
+    # Each pass hands out packages in the order the scheduler picks, only as many as there are free workers
+    # and only while the bytes already moving plus the package's own fit in package_max_inflight_bytes (0 for
+    # no limit). The rest wait for a later pass; packages still in flight are left alone. Returns the number
+    # of packages started.
+    def move_packages_to_DLU(self, packages, resume: bool = False) -> int:
+        with self.inflight_lock:
+            queued = [package for package in packages if package['dlu_package_id'] not in self.inflight_packages]
+        started = 0
+        for package, size in self.scheduler.order(queued):
             package_id = package['dlu_package_id']
-            logger.info("Moving package " + package_id)
-
-            self.dlu_management.update_dlu_package(package_id, { "globus_dlu_status": "processing" })
-            globus_data_directory = '/globus/' + package_id
-            if not os.path.isdir(globus_data_directory):
-                error_msg = "Error: package " + package_id + " not found in directory " + globus_data_directory + "."
-                logger.info(error_msg + " Skipping.")
-                self.dlu_management.update_dlu_package(package_id, { "globus_dlu_status": error_msg })
+            with self.inflight_lock:
+                if package_id in self.inflight_packages:
+                    continue
+                if len(self.inflight_packages) >= self.package_workers:
+                    break
+                if self.inflight_bytes > 0 and 0 < self.max_inflight_bytes < self.inflight_bytes + size:
+                    break
+                self.inflight_packages[package_id] = size
+                self.inflight_bytes += size
+            future = self.package_executor.submit(self.move_package_with_lock, package, resume)
+            future.add_done_callback(lambda future, package_id=package_id: self.package_finished(package_id, future))
+            started += 1
+        return started
+
+    # A move that raised has already had its status set by move_package_with_lock; this alerts on it
+    def package_finished(self, package_id: str, future):
+        with self.inflight_lock:
+            self.inflight_bytes -= self.inflight_packages.pop(package_id, 0)
+        error = future.exception()
+        if error is not None:
+            message = "Error: moving package " + package_id + " failed: " + str(error)
+            logger.error(message, exc_info=error)
+            try:
+                requests.post(slack_url, headers={'Content-type': 'application/json', }, json={"text": message})
+            except requests.RequestException as post_error:
+                logger.error("Unable to send alert for package " + package_id + ": " + str(post_error))
+        elif future.result():
+            # Wakes the task loop so a waiting package can take the free worker. Skipped packages don't, or
+            # one claimed by another watcher would be handed out again straight away.
+            self.package_event.set()
+
+    # Holding the package's lock for the whole move keeps its status updates from interleaving with another
+    # move of the same package. Returns False when the package was skipped.
+    def move_package_with_lock(self, package, resume: bool = False):
+        package_id = package['dlu_package_id']
+        with self.package_locks_lock:
+            package_lock = self.package_locks.setdefault(package_id, threading.Lock())
+        if not package_lock.acquire(blocking=False):
+            logger.info("Package " + package_id + " is already being moved. Skipping.")
+            return False
+        try:
+            package_inventory = self.get_worker().package_inventory
+            if not package_inventory.claim_package(package_id, self.claim_owner, self.claim_lease_seconds):
+                logger.info("Package " + package_id + " is claimed by another watcher. Skipping.")
+                return False
+            try:
+                self.scheduler.started(package_id)
+                self.move_package(package, resume)
+                return True
+            except Exception as error:
+                # Left in "processing", the package would be reclaimed and fail the same way on every pass
+                error_msg = "Error: moving package " + package_id + " failed: " + str(error)
+                self.dlu_management.update_dlu_package(package_id, {"globus_dlu_status": error_msg})
+                raise
+            finally:
+                package_inventory.release_package(package_id, self.claim_owner)
+        finally:
+            package_lock.release()
+
+    # Keeps this watcher's claims alive. Runs on its own thread with its own connection.
+    def heartbeat_claims(self):
+        package_inventory = DLUPackageInventory()
+        while True:
+            time.sleep(max(1, self.claim_lease_seconds // 3))
+            try:
+                package_inventory.heartbeat_claims(self.claim_owner)
+            except Exception as error:
+                logger.error("Unable to renew package claims: " + str(error))
+                package_inventory.reconnect()
+
+    def start_heartbeat(self):
+        threading.Thread(target=self.heartbeat_claims, name="claim-heartbeat", daemon=True).start()
+
+    def start_nudge_listener(self):
+        address = os.environ.get("dlu_watcher_listen_address")
+        if address:
+            NudgeListener(address, self.package_event).start()
+
+    # Waits up to timeout seconds for a package to be marked ready, either through a nudge or a new row in
+    # dlu_package_event. Returns True when there is something new to pick up.
+    def wait_for_package_event(self, timeout: float):
+        deadline = time.monotonic() + timeout
+        if self.last_package_event_id is None:
+            self.last_package_event_id = self.db.get_latest_package_event_id()
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            if self.package_event.wait(min(self.package_event_poll_seconds, remaining)):
+                self.package_event.clear()
+                return True
+            if self.last_package_event_id is None:
+                # No event table to poll, so only nudges can wake us early
                 continue
+            latest_event_id = self.db.get_latest_package_event_id()
+            if latest_event_id is not None and latest_event_id > self.last_package_event_id:
+                self.last_package_event_id = latest_event_id
+                return True
 
-            if package['dlu_packageType'] == 'Whole Slide Images' and package['globus_dlu_status'] != 'recalled':
-                success = self.do_wsi_file_renames(globus_data_directory, package_id)
-                if not success:
-                    continue
-                else:
-                    skip_copy = True
+    def move_package(self, package, resume: bool = False):
+        skip_copy = False
+        package_id = package['dlu_package_id']
+        logger.info("Moving package " + package_id)
 
-            if not skip_copy:
-                directory_info = DirectoryInfo(globus_data_directory)
-                if not self.is_directory_valid(directory_info, package_id):
-                    continue
+        self.dlu_management.update_dlu_package(package_id, { "globus_dlu_status": "processing" })
+        globus_data_directory = '/globus/' + package_id
+        if not os.path.isdir(globus_data_directory):
+            error_msg = "Error: package " + package_id + " not found in directory " + globus_data_directory + "."
+            logger.info(error_msg + " Skipping.")
+            self.dlu_management.update_dlu_package(package_id, { "globus_dlu_status": error_msg })
+            return
+
+        self.dlu_file_handler.choose_move_strategy(package_id)
+        if resume:
+            self.dlu_file_handler.restore_renamed_files(package_id)
+        if package['dlu_packageType'] == 'Whole Slide Images' and package['globus_dlu_status'] != 'recalled':
+            success = self.do_wsi_file_renames(globus_data_directory, package_id, resume)
+            if not success:
+                return
+            else:
+                skip_copy = True
 
-                if directory_info.file_count == 0 and directory_info.subdir_count == 1:
-                    contents = "".join(directory_info.dir_contents)
-                    top_level_subdir = package_id + "/" + contents
-                    file_list = self.dlu_file_handler.match_files(top_level_subdir)
+        if not skip_copy:
+            directory_info = DirectoryInfo(globus_data_directory)
+            if not self.is_directory_valid(directory_info, package_id):
+                return
+
+            # Checksums are lazy and get filled in from the copy below, so each file is only read once
+            if directory_info.file_count == 0 and directory_info.subdir_count == 1:
+                contents = "".join(directory_info.dir_contents)
+                top_level_subdir = package_id + "/" + contents
+                file_list = self.dlu_file_handler.match_files(top_level_subdir)
+            else:
+                file_list = self.dlu_file_handler.match_files(package_id)
+            if self.dlu_file_handler.move_strategy == "rename":
+                # Sources are renamed away by the copy, so their checksums are resolved first
+                if self.defer_verification:
+                    defer_pending_checksums(file_list)
                 else:
-                    file_list = self.dlu_file_handler.match_files(package_id)
+                    calculate_pending_checksums(file_list)
 
-                self.dlu_file_handler.copy_files(package_id, self.process_file_paths(directory_info.file_details))
-                self.dlu_file_handler.chown_dir(package_id, file_list, int(os.environ['dlu_user']))
-                file_info = self.dlu_management.insert_dlu_files(package_id, file_list)
-                self.dlu_management.update_dlu_package(package_id, { "globus_dlu_status": "success" })
-                self.dlu_management.update_dlu_package(package_id, { "ready_to_move_from_globus": "done" })
-                self.dlu_mongo.update_package_files(package_id, file_info)
+            dest_package_directory = os.path.join(self.dlu_file_handler.dlu_data_directory,
+                                                  self.dlu_file_handler.dlu_package_dir_prefix + package_id)
+            if not resume and os.path.isdir(dest_package_directory):
+                # Already moved before (e.g. recalled and edited), so only what changed is copied
+                sync_info = self.dlu_file_handler.sync_files(package_id, file_list,
+                                                             calculate_checksums=not self.defer_verification)
+                self.dlu_management.fill_in_unmodified_checksums(package_id, sync_info["unmodified_files"])
+            else:
+                self.dlu_file_handler.copy_files(package_id, self.process_file_paths(directory_info.file_details),
+                                                 calculate_checksums=not self.defer_verification, resume=resume)
+            if self.defer_verification:
+                # The package is available straight away and the file verifier hashes it afterwards
+                defer_pending_checksums(file_list)
+            else:
+                self.dlu_file_handler.fill_in_checksums(file_list)
+            self.dlu_file_handler.chown_dir(package_id, int(os.environ['dlu_user']))
+            file_info = self.dlu_management.insert_dlu_files(package_id, file_list)
+            self.dlu_management.update_dlu_package(package_id, { "globus_dlu_status": "success" })
+            self.dlu_management.update_dlu_package(package_id, { "ready_to_move_from_globus": "done" })
+            self.dlu_mongo.update_package_files(package_id, file_info)
+            self.dlu_file_handler.clear_journal(package_id)
 
-                self.dlu_state.set_package_state(package_id, PackageState.UPLOAD_SUCCEEDED)
-                self.dlu_state.clear_cache()
+            self.dlu_state.set_package_state(package_id, PackageState.UPLOAD_SUCCEEDED)
+            self.dlu_state.clear_cache()
 
     def fill_in_null_package_ids(self):
-        self.slide_management.fill_in_package_ids()
+        return self.slide_management.fill_in_package_ids() > 0
+
+    def prune_package_events(self):
+        deleted = self.db.prune_package_events(self.package_event_retention_seconds)
+        if deleted:
+            logger.info("Deleted " + str(deleted) + " old package events")
+        return False
 
-    def do_wsi_file_renames(self, globus_data_directory: str, package_id: str):
+    def do_wsi_file_renames(self, globus_data_directory: str, package_id: str, resume: bool = False):
         logger.info("starting rename process")
         error_msg = ""
         slide_scan_info = self.dlu_management.find_slide_scan_info_by_package_id(package_id)
@@ -169,15 +455,16 @@ class DLUWatcher:
             self.dlu_management.update_dlu_package(package_id, {"globus_dlu_status": error_msg})
             return False
 
-        copied_files = self.dlu_file_handler.rename_and_move_files(file_list, slide_name_map, package_id)
+        copied_files = self.dlu_file_handler.rename_and_move_files(file_list, slide_name_map, package_id, resume)
         if len(copied_files) == 0:
             return False
 
-        self.dlu_file_handler.chown_dir(package_id, copied_files, int(os.environ['dlu_user']))
+        self.dlu_file_handler.chown_dir(package_id, int(os.environ['dlu_user']))
         file_info = self.dlu_management.insert_dlu_files(package_id=package_id, file_list=copied_files)
         self.dlu_management.update_dlu_package(package_id, {"globus_dlu_status": "success"})
         self.dlu_management.update_dlu_package(package_id, {"ready_to_move_from_globus": "done"})
         self.dlu_mongo.update_package_files(package_id, file_info)
+        self.dlu_file_handler.clear_journal(package_id)
 
         self.dlu_state.set_package_state(package_id, PackageState.UPLOAD_SUCCEEDED)
         self.dlu_state.clear_cache()
@@ -199,10 +486,27 @@ class DLUWatcher:
 
 
 if __name__ == "__main__":
+    set_io_priority()
     dlu_watcher = DLUWatcher()
+    dlu_watcher.start_heartbeat()
+    dlu_watcher.start_nudge_listener()
+    if os.environ.get("prehash_enabled", "false").lower() in ["true", "1", "yes"]:
+        file_handler = DLUFileHandler()
+        PackagePrehasher(file_handler.globus_data_directory, globus_dir_prefix=file_handler.globus_dir_prefix).start()
+    if dlu_watcher.defer_verification or os.environ.get("file_verifier_enabled", "false").lower() in ["true", "1", "yes"]:
+        FileVerifier().start()
+    dlu_watcher.pickup_processing_packages()
     dlu_watcher.pickup_waiting_packages()
-    while True:
-        dlu_watcher.watch_for_packages()
-        dlu_watcher.watch_for_side_manifest_records()
-        dlu_watcher.fill_in_null_package_ids()
-        time.sleep(60) 
+    # Newly ready packages are picked up as soon as they're announced, without waiting for their interval
+    scheduler = TaskScheduler(wait=dlu_watcher.wait_for_package_event, wake_task="watch_for_packages")
+    scheduler.add("watch_for_packages", dlu_watcher.watch_for_packages,
+                  int(os.environ.get("watch_packages_interval", 60)), int(os.environ.get("watch_packages_max_interval", 300)))
+    scheduler.add("pickup_processing_packages", dlu_watcher.pickup_processing_packages,
+                  int(os.environ.get("pickup_processing_interval", 60)), int(os.environ.get("pickup_processing_max_interval", 600)))
+    scheduler.add("watch_for_side_manifest_records", dlu_watcher.watch_for_side_manifest_records,
+                  int(os.environ.get("slide_manifest_interval", 300)), int(os.environ.get("slide_manifest_max_interval", 1800)))
+    scheduler.add("fill_in_null_package_ids", dlu_watcher.fill_in_null_package_ids,
+                  int(os.environ.get("fill_package_ids_interval", 300)), int(os.environ.get("fill_package_ids_max_interval", 3600)))
+    scheduler.add("prune_package_events", dlu_watcher.prune_package_events,
+                  int(os.environ.get("prune_package_events_interval", 3600)))
+    scheduler.run_forever() 